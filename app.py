@@ -9,14 +9,26 @@ import importlib
 if 'src.translator' in sys.modules:
     importlib.reload(sys.modules['src.translator'])
 
-from src.translator import translate_paragraphs, get_deepl_usage, render_deepl_usage_ui, get_available_models, ocr_and_translate_image
+from src.translator import translate_paragraphs, get_deepl_usage, render_deepl_usage_ui, get_available_models, ocr_and_translate_image, is_missing_translation, reuse_aligned_translations, HEDGE_SECONDARY_ENGINES
 from src.article_generator import generate_article
+from src.rate_limiter import rate_limiter, configure_rate_limits
+from src.gemini_client import prewarm as prewarm_gemini
+from src.key_pool import key_pool, parse_api_keys
+from src.engine_health import engine_health
+from src.jobs import job_manager, wait_for_next_poll
+from src.result_cache import result_cache, translation_cache_key, article_cache_key
+from src.draft_store import draft_store, draft_key, translation_store
+from src.batch_queue import batch_queue, KIND_ARTICLE, KIND_TRANSLATION
+from src.near_duplicates import find_and_register
 from st_copy_to_clipboard import st_copy_to_clipboard
-from src.utils import create_images_zip, fetch_image_data_v10, make_diff_html, detect_language
+from src.utils import create_images_zip, fetch_image_data_v10, prefetch_images, make_diff_html, default_source_lang, DIFF_CONTEXT_LINES
+from src.concurrency import get_limiter, thread_initializer
 
 import extra_streamlit_components as stx
 import base64
+import copy
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 ICON_CIRCLE_CHECK_OUTLINE = "data:image/svg+xml;base64," + base64.b64encode(b"""
 <svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 24 24' fill='none' stroke='#94a3b8' stroke-width='1.5'>
   <circle cx='12' cy='12' r='10'/>
@@ -150,10 +162,225 @@ def render_copy_header(title, text_to_copy, key_suffix=""):
     """
     components.html(html_code, height=48)
 
+def format_engine_option(option):
+    """
+    エンジン選択肢に稼働状況のバッジを付ける（🟢正常 / 🟡不安定 / 🔴障害中 / ⏳利用上限中）
+    """
+    if option.startswith("--"):
+        return option
+    engine = "Gemini" if option.startswith("Gemini") else option
+    badge = engine_health.status_badge(engine)
+    return f"{option} {badge}" if badge else option
+
+# 先行翻訳（URL読み込み直後に前回のエンジンで冒頭を翻訳しておく）の段落数
+SPECULATIVE_PARAGRAPHS = 5
+
+# URL読み込み時に表示する類似記事の最大件数
+NEAR_DUPLICATE_DISPLAY_LIMIT = 5
+
+def translated_title_or_none(stored_title, source_title):
+    """
+    保存済みのタイトル訳を返す（未翻訳で原題のままの場合はNone。再開時にタイトルも翻訳し直す）
+    """
+    if not stored_title or stored_title == source_title:
+        return None
+    return stored_title
+
+def submit_translation_job(kind, src_url, src_article, engine_name, model_name, source_lang, row_count=None, item_id_prefix=None, speculative=None, reuse_from=None, resume_from=None):
+    """
+    本文とタイトルの翻訳をバックグラウンドジョブとして開始する。
+    row_count: 行ごとのプレースホルダー数（Noneなら単一のプレースホルダーに描画）
+    speculative: 同じエンジンで冒頭を先行翻訳したジョブ。完了を待ち、その続きから翻訳する
+    reuse_from: (翻訳済みの記事, 翻訳結果リスト, タイトル訳)。同一の段落はその翻訳を使い、追加・変更された段落だけを翻訳する
+    resume_from: (途中で失敗した翻訳結果リスト, タイトル訳)。翻訳済みの段落は残し、未翻訳の段落だけを翻訳する
+    別のセッションで同じ翻訳が実行中ならそのジョブに相乗りし、全段落を翻訳できたら共有キャッシュに保存する。
+    """
+    cache_key = translation_cache_key(src_url, engine_name, model_name, source_lang)
+    paragraphs = src_article.structured_html_parts
+    title = src_article.title
+    deepl_api_key = st.session_state.get("deepl_api_key")
+    gemini_api_key = st.session_state.get("gemini_api_key")
+    hedge = bool(st.session_state.get("hedge_translation", False))
+
+    def run(job):
+        previous_results = previous_title = None
+        if resume_from is not None:
+            previous_results, previous_title = resume_from
+        elif speculative is not None:
+            if not speculative.finished:
+                job.placeholder("status").info("⚡ 先行翻訳の完了を待っています...")
+            speculative.wait()
+            if speculative.status == "done":
+                head, head_title = speculative.result
+                previous_results = list(head) + [
+                    {"text": p.get("text", ""), "engine": engine_name, "tag": p.get("tag", "p"), "missing": True}
+                    for p in paragraphs[len(head):]
+                ]
+                previous_title = translated_title_or_none(head_title, title)
+        elif reuse_from is not None:
+            base_article, base_results, base_title = reuse_from
+            previous_results = reuse_aligned_translations(base_article.structured_html_parts, base_results, paragraphs, engine_name)
+            previous_title = translated_title_or_none(base_title, title) if base_article.title == title else None
+        result = translate_paragraphs(
+            paragraphs,
+            engine_name=engine_name,
+            source_lang=source_lang,
+            deepl_api_key=deepl_api_key,
+            gemini_api_key=gemini_api_key,
+            output_placeholder=job.placeholders("output", row_count) if row_count else job.placeholder("output"),
+            progress_placeholder=job.placeholder("progress"),
+            status_placeholder=job.placeholder("status"),
+            model_name=model_name,
+            item_id_prefix=item_id_prefix,
+            hedge=hedge,
+            title=title,
+            previous_results=previous_results,
+            previous_title=previous_title
+        )
+        results, translated_title = result
+        if not any(is_missing_translation(item) for item in results) and translated_title_or_none(translated_title, title):
+            result_cache.put(cache_key, result)
+        return result
+
+    # 描画先の形式（行ごと / 単一）が同じ場合だけ相乗りする
+    return job_manager.submit(kind, run, dedupe_key=cache_key + (bool(row_count), item_id_prefix))
+
+def speculative_store_key(src_url):
+    return f"spec_v9_{src_url}"
+
+def submit_speculative_job(src_url, src_article, engine_name, model_name, source_lang):
+    """
+    URL読み込み直後に、前回使ったエンジンでタイトルと冒頭の段落を先に翻訳しておく。
+    同じエンジンが選ばれたら submit_translation_job(speculative=...) で続きから翻訳する。
+    別のエンジンが選ばれた場合も結果はジョブに残るため、後でそのエンジンを選べば使われる。
+    """
+    store = st.session_state.setdefault(speculative_store_key(src_url), {})
+    spec_key = f"{engine_name}|{source_lang}"
+    if job_manager.get(store.get(spec_key)) is not None:
+        return
+    if result_cache.get(translation_cache_key(src_url, engine_name, model_name, source_lang)) is not None:
+        # 翻訳済み（共有キャッシュにある）なら先行翻訳は不要
+        return
+    paragraphs = src_article.structured_html_parts[:SPECULATIVE_PARAGRAPHS]
+    title = src_article.title
+    deepl_api_key = st.session_state.get("deepl_api_key")
+    gemini_api_key = st.session_state.get("gemini_api_key")
+    hedge = bool(st.session_state.get("hedge_translation", False))
+
+    def run(job):
+        return translate_paragraphs(
+            paragraphs,
+            engine_name=engine_name,
+            source_lang=source_lang,
+            deepl_api_key=deepl_api_key,
+            gemini_api_key=gemini_api_key,
+            progress_placeholder=job.placeholder("progress"),
+            status_placeholder=job.placeholder("status"),
+            model_name=model_name,
+            hedge=hedge,
+            title=title
+        )
+
+    store[spec_key] = job_manager.submit("speculative", run).id
+
+def get_speculative_job(src_url, engine_name, source_lang):
+    """
+    選択されたエンジン・言語で先行翻訳したジョブ（無ければNone）
+    """
+    store = st.session_state.get(speculative_store_key(src_url)) or {}
+    return job_manager.get(store.get(f"{engine_name}|{source_lang}"))
+
+def article_draft_key(src_article, model_name):
+    """
+    生成記事の保存キー（記事生成に渡す原文・タイトル・媒体名とモデル、プロンプトから求める）
+    """
+    chinese_text = "\n\n".join([p["text"] for p in src_article.structured_html_parts])
+    return draft_key(chinese_text, src_article.title, src_article.publisher, model_name)
+
+def track_job(state_key, job, view, target_keys, engine=None):
+    """
+    ジョブIDと、完了時に結果を保存するセッションキーをセッションに記録する。
+    view: ジョブを開始した画面（元記事URLなど）。表示中の画面と異なるジョブは描画・ポーリングしない
+    target_keys: 結果を保存するセッションキー（開始時のURLで決めておき、URLが変わっても元の記事に保存する）
+    engine: 翻訳エンジン（エンジンを切り替えたら、前のエンジンのジョブは破棄する）
+    """
+    st.session_state[state_key] = {"id": job.id, "view": view, "target_keys": tuple(target_keys), "engine": engine}
+
+def tracked_job(state_key, view):
+    """
+    セッションに記録したジョブのうち、表示中の画面のもの（無ければNone）。
+    サーバー再起動などで失われたジョブの記録は削除する。
+    """
+    entry = st.session_state.get(state_key)
+    if not entry:
+        return None
+    job = job_manager.get(entry["id"])
+    if job is None:
+        del st.session_state[state_key]
+        return None
+    return job if entry["view"] == view else None
+
+def has_job(state_key, view):
+    return tracked_job(state_key, view) is not None
+
+def has_pending_job(state_key, view):
+    """
+    表示中の画面のジョブが実行中か（ポーリングを続けるかどうかの判定に使う）
+    """
+    job = tracked_job(state_key, view)
+    return job is not None and not job.finished
+
+def drop_job(state_key, engine=None):
+    """
+    ジョブの記録を破棄する（engine を指定した場合は、別のエンジンのジョブだけを破棄する）。
+    ジョブ自体は最後まで実行され、結果は共有キャッシュに残る。
+    """
+    entry = st.session_state.get(state_key)
+    if entry and (engine is None or entry.get("engine") != engine):
+        del st.session_state[state_key]
+
+def collect_job(state_key, view):
+    """
+    完了したジョブの結果を、開始時に記録したセッションキーに保存する。
+    表示中の画面のジョブならエラーバナー・エラーを表示し、完了時に再描画する。
+    翻訳の結果は (本文, タイトル) を2つのキーに、記事生成の結果は1つのキーに保存する。
+    """
+    entry = st.session_state.get(state_key)
+    job = job_manager.get(entry["id"]) if entry else None
+    if job is None:
+        st.session_state.pop(state_key, None)
+        return
+    is_current = entry["view"] == view
+    if is_current and job.banner_set:
+        st.session_state["v9_error_banner_html"] = job.banner_html
+    if not job.finished:
+        return
+    target_keys = entry["target_keys"]
+    if job.status != "done":
+        if is_current:
+            st.error(f"処理中にエラーが発生しました: {job.error}")
+    elif len(target_keys) == 2:
+        # 共有ジョブの結果は他のセッションも受け取るため、コピーして保存する
+        st.session_state[target_keys[0]], st.session_state[target_keys[1]] = copy.deepcopy(job.result)
+    elif job.result and not job.result.startswith("[エラー]"):
+        st.session_state[target_keys[0]] = job.result
+    del st.session_state[state_key]
+    job_manager.discard(job.id)
+    if is_current and job.status == "done":
+        st.rerun()
+
 # --- メイン UI ---
 def main():
     st.set_page_config(layout="wide", page_title="メディア解析ツール")
 
+    # エンジンごとのレート制限（.streamlit/secrets.toml の [rate_limits.<engine>] で上書き可能）
+    try:
+        configure_rate_limits(st.secrets.get("rate_limits"))
+    except Exception:
+        pass
+    # 一括処理のワーカープロセスと利用枠を共有するため、APIリクエストを記録する
+    rate_limiter.add_listener(batch_queue.record_usage)
+
     # Initialize Cookie Manager AFTER page config
     # Use a fixed key to ensure component stability across reruns
     cookie_manager = stx.CookieManager(key="v9_cookie_manager")
@@ -171,6 +398,8 @@ def main():
     cookie_gemini = cookies.get("gemini_v9_key") if cookies else None
     if cookie_gemini and not st.session_state.get("gemini_api_key"):
         st.session_state["gemini_api_key"] = cookie_gemini
+        for gemini_key in parse_api_keys(cookie_gemini):
+            prewarm_gemini(gemini_key, [cookies.get("gemini_v9_model")])
     
     # Gemini Model Selection Persistence
     cookie_gemini_model = cookies.get("gemini_v9_model") if cookies else None
@@ -180,6 +409,11 @@ def main():
     elif "gemini_label_current" not in st.session_state:
         st.session_state["gemini_label_current"] = "Gemini (gemini-2.5-flash)"
     
+    # 前回使った翻訳エンジン（先行翻訳に使う）
+    cookie_last_engine = cookies.get("last_engine_v9") if cookies else None
+    if cookie_last_engine and "last_engine_v9" not in st.session_state:
+        st.session_state["last_engine_v9"] = cookie_last_engine
+
     # Debug Cookies
     # st.write(f"DEBUG COOKIES: {cookie_manager.get_all()}")
     if "sel_imgs" not in st.session_state:
@@ -191,6 +425,9 @@ def main():
 
     st.markdown(f"""
     <style>
+        /* 翻訳済み段落のフェードイン（段落ごとに<style>を送らないよう共通で定義） */
+        @keyframes fadeIn {{ from {{ opacity:0; }} to {{ opacity:1; }} }}
+
         /* 1. 基本設定と白モードの徹底強制 */
         .stApp, [data-testid="stAppViewContainer"], [data-testid="stHeader"], [data-testid="stToolbar"] {{
             background-color: #f8fafc !important;
@@ -423,6 +660,22 @@ def main():
         .trans-scroll-pane-wrapper::-webkit-scrollbar-thumb {{ background-color: #cbd5e1; border-radius: 3px; }}
         .trans-scroll-pane-wrapper::-webkit-scrollbar-track {{ background: transparent; }}
 
+        /* 文章比較の差分表（make_diff_html が出力するクラス。セルごとに style を繰り返さない） */
+        .diff-table {{ width: 100%; border-collapse: collapse; table-layout: fixed; }}
+        .diff-table td {{
+            padding: 12px 16px; line-height: 1.8; min-height: 2em; color: #1e293b;
+            border-bottom: 1px solid #f1f5f9; vertical-align: top; width: 50%; background-color: #ffffff;
+        }}
+        .diff-table td.d-del {{ background-color: #fee2e2; border-left: 3px solid #ef4444; }}
+        .diff-table td.d-ins {{ background-color: #dcfce7; border-left: 3px solid #22c55e; }}
+        .diff-table td.d-rep {{ background-color: #fef3c7; border-left: 3px solid #f59e0b; }}
+        .diff-table td.d-none {{ background-color: #fafafa; }}
+        .diff-table td.d-none i {{ color: #94a3b8; }}
+        .diff-table tr.d-skip td {{
+            background-color: #f8fafc; color: #94a3b8; text-align: center; font-size: 0.85em; padding: 6px 16px;
+        }}
+        .diff-table mark {{ background-color: #fcd34d; border-radius: 2px; padding: 0 1px; }}
+
         /* Grid Container - 左右2列のレイアウト - 翻訳タブ専用 */
         .trans-grid-container {{
             display: grid;
@@ -556,7 +809,11 @@ def main():
 
     # セッション状態の初期化 (廃止: mainの冒頭に移動済み)
 
-    tab_titles = ["原文抽出/翻訳", "画像読込", "文章比較"]
+    # 翻訳の描画先（翻訳タブで作成する。行ごとならリスト、翻訳前の表示なら単一のプレースホルダー）
+    t1_placeholders = None
+    t2_placeholders = None
+
+    tab_titles = ["原文抽出/翻訳", "画像読込", "文章比較", "一括処理"]
     tabs = st.tabs(tab_titles)
 
     # --- タブ1: 原文抽出/翻訳 ---
@@ -595,37 +852,8 @@ def main():
         
             # 自動判定: コンテンツから言語を推定してデフォルト設定
             if "src_lang_select" not in st.session_state:
-                detected_code = detect_language(src_article.text[:2000] if src_article.text else "")
-                
-                # 判定ロジック
-                is_english = detected_code.lower().startswith("en")
-                is_chinese = detected_code.lower().startswith("zh") or detected_code == "mixed" # mixedも中国語扱い（または次でFallback）
-
-                if is_english:
-                        st.session_state["src_lang_select"] = "英語"
-                elif "weixin.qq.com" in src_url:
-                    # WeChat Special Handling
-                    # "ja" -> False positive for Chinese (Kanji) -> Force Chinese
-                    # "mixed" -> Likely Chinese with English UI elements -> Force Chinese
-                    # "unknown" -> Fallback to Chinese
-                    if detected_code.lower().startswith("ja") or detected_code == "mixed" or detected_code == "unknown":
-                        st.session_state["src_lang_select"] = "中国語 (簡体字)"
-                    elif is_chinese:
-                        # Explicit Chinese
-                        if "tw" in detected_code.lower() or "hant" in detected_code.lower():
-                            st.session_state["src_lang_select"] = "中国語 (繁体字)"
-                        else:
-                            st.session_state["src_lang_select"] = "中国語 (簡体字)"
-                    else:
-                        # Other (e.g. fr, es, or specific code) -> Auto
-                        st.session_state["src_lang_select"] = "自動検出"
-                elif is_chinese:
-                    if "tw" in detected_code.lower() or "hant" in detected_code.lower():
-                        st.session_state["src_lang_select"] = "中国語 (繁体字)"
-                    else:
-                        st.session_state["src_lang_select"] = "中国語 (簡体字)"
-                else:
-                    st.session_state["src_lang_select"] = "自動検出"
+                lang_label_by_code = {code: label for label, code in lang_map.items()}
+                st.session_state["src_lang_select"] = lang_label_by_code[default_source_lang(src_article.text, src_url)]
 
             # 3. 言語選択UI (ラジオボタン)
             # session_stateにあればそれをindexとして使う
@@ -654,6 +882,31 @@ def main():
                      # 維持すると再翻訳ボタンが必要。
                      st.rerun()
 
+                # 無料エンジン（Google / MyMemory）の応答待ちが長い段落を、もう一方のエンジンにも同時に送る
+                st.toggle(
+                    "高速モード（遅い段落を別エンジンにも送信）",
+                    key="hedge_translation",
+                    help="応答が通常（直近のp90）より遅い段落を、Google と MyMemory の両方に送り、先に返った翻訳を使います。リクエスト数は増えます。"
+                )
+                # ヘッジを送った回数と、どちらの応答が先に返ったか（このサーバープロセスでの累計）
+                if st.session_state.get("hedge_translation"):
+                    hedge_lines = []
+                    for hedge_engine, secondary_engine in HEDGE_SECONDARY_ENGINES.items():
+                        wins = engine_health.hedge_stats(hedge_engine)
+                        if wins:
+                            hedge_lines.append(
+                                f"{hedge_engine}: ヘッジ {sum(wins.values())} 回（{hedge_engine} が先 {wins.get('primary', 0)} / "
+                                f"{secondary_engine} が先 {wins.get(secondary_engine, 0)} / 両方失敗 {wins.get('failed', 0)}）"
+                            )
+                    if hedge_lines:
+                        st.caption("　".join(hedge_lines))
+                # URL読み込み直後に、前回使ったエンジンでタイトルと冒頭の段落を翻訳しておく
+                st.toggle(
+                    "先行翻訳（前回のエンジンで冒頭を先に翻訳）",
+                    key="speculative_translation",
+                    help="記事を読み込んだ時点で、前回使ったエンジンでタイトルと冒頭の数段落を翻訳しておき、同じエンジンを選ぶとすぐに表示します。別のエンジンを選んだ場合も、使われなかった分のリクエスト（Geminiの利用回数・DeepLの文字数）は消費されます。"
+                )
+
                 # DEBUG info for user verification (Temporary)
                 if "detected_code" in locals():
                     st.markdown(f"<div style='font-size:0.7em; color:#cbd5e1; margin-top:-5px;'>Detected: {detected_code}</div>", unsafe_allow_html=True)
@@ -681,7 +934,8 @@ def main():
                         value=st.session_state.get("deepl_api_key", ""),
                         type="password",
                         key="deepl_key_input",
-                        placeholder="xxxx-xxxx-xxxx-xxxx"
+                        placeholder="xxxx-xxxx-xxxx-xxxx",
+                        help="カンマ区切りで複数のキーを登録すると、利用上限に達したキーを避けて自動で切り替えます。"
                     )
                     
                     # 保存ボタン (入力値が現在の保存値と異なる場合のみ表示)
@@ -748,7 +1002,8 @@ def main():
                     value=st.session_state.get("gemini_api_key", ""),
                     type="password",
                     key="gemini_key_input",
-                    placeholder="APIキーを入力してください (例: AIzaSy...)"
+                    placeholder="APIキーを入力してください (例: AIzaSy...)",
+                    help="カンマ区切りで複数のキーを登録すると、利用上限に達したキーを避けて自動で切り替えます。"
                 )
                 
                 # Gemini保存ボタン (入力値が現在の保存値と異なる場合のみ表示)
@@ -756,6 +1011,9 @@ def main():
                 if gemini_key_input != current_saved_gemini:
                     if st.button("Geminiキーをブラウザに保存", key="save_gemini_key"):
                         st.session_state["gemini_api_key"] = gemini_key_input
+                        # 最初の翻訳で接続確立を待たないよう、クライアントを先に用意しておく
+                        for gemini_key in parse_api_keys(gemini_key_input):
+                            prewarm_gemini(gemini_key, [st.session_state.get("gemini_model_setting")])
                         
                         # Save to cookie for 30 days
                         expires = datetime.datetime.now() + datetime.timedelta(days=30)
@@ -876,6 +1134,17 @@ def main():
                         </div>
                         """, unsafe_allow_html=True)
                         
+                        # サーバー全体で共有しているレート制限の残り枠（複数キーの場合は合計）
+                        gemini_keys = parse_api_keys(st.session_state.get("gemini_api_key", ""))
+                        remaining_rpd = key_pool.total_remaining("Gemini", gemini_keys)
+                        if remaining_rpd is not None:
+                            key_count_label = f"{len(gemini_keys)} 個のAPIキー合計" if len(gemini_keys) > 1 else "このAPIキー"
+                            st.markdown(f"""
+                            <div style="font-size: 0.8em; color: #64748b;">
+                                {key_count_label}の残りリクエスト枠 (サーバー全体・推定): {remaining_rpd} 回
+                            </div>
+                            """, unsafe_allow_html=True)
+                        
                         # Custom Progress Bar (Same style as DeepL)
                         bar_html = f"""
                         <div style="
@@ -915,7 +1184,57 @@ def main():
                 lang_choice_label = "自動検出" 
             
             source_lang = lang_map[lang_choice_label]
-            
+
+            # 先行翻訳: 未翻訳の記事なら、前回のエンジンで冒頭の翻訳をバックグラウンドで始めておく
+            last_engine = st.session_state.get("last_engine_v9")
+            if (
+                st.session_state.get("speculative_translation")
+                and last_engine
+                and t_key not in st.session_state
+                and src_article.structured_html_parts
+                and (last_engine in ("Google", "MyMemory")
+                     or (last_engine == "DeepL" and st.session_state.get("deepl_api_key"))
+                     or (last_engine == st.session_state.get("gemini_label_current") and st.session_state.get("gemini_api_key")))
+            ):
+                submit_speculative_job(
+                    src_url, src_article, last_engine,
+                    st.session_state.get("gemini_model_setting", "gemini-2.5-flash"), source_lang
+                )
+
+            # 類似記事: 以前に読み込んだ記事のうち本文がほぼ同じもの（別媒体の転載など）と、その翻訳・下書きを提示する
+            near_dup_key = f"near_dup_{src_url}"
+            if near_dup_key not in st.session_state:
+                try:
+                    st.session_state[near_dup_key] = find_and_register(src_url, src_article.title, src_article.text)
+                except Exception:
+                    st.session_state[near_dup_key] = []
+            near_duplicates = st.session_state[near_dup_key][:NEAR_DUPLICATE_DISPLAY_LIMIT]
+            if near_duplicates:
+                with st.expander(f"🔁 以前に読み込んだ類似記事があります（{len(near_duplicates)} 件）", expanded=False):
+                    for dup_index, dup in enumerate(near_duplicates):
+                        st.markdown(f"**{dup['title'] or dup['url']}**　類似度 {dup['similarity']:.0%}  \n{dup['url']}")
+                        dup_translations = []
+                        if last_engine:
+                            cached = result_cache.get(translation_cache_key(
+                                dup["url"], last_engine, st.session_state.get("gemini_model_setting", "gemini-2.5-flash"), source_lang
+                            ))
+                            if cached is not None:
+                                dup_translations.append((last_engine, cached[0], cached[1]))
+                        dup_translations += [(key[2], results, title) for key, results, title in translation_store.find_by_url(dup["url"])]
+                        dup_draft = draft_store.latest_by_url(dup["url"])
+
+                        dup_col1, dup_col2 = st.columns(2)
+                        if dup_translations:
+                            dup_engine, dup_results, dup_title = dup_translations[0]
+                            if dup_col1.toggle(f"翻訳を表示（{dup_engine}）", key=f"near_dup_trans_{dup_index}"):
+                                st.markdown(f"##### {dup_title}\n\n" + "\n\n".join(p.get("text", "") for p in dup_results))
+                        if dup_draft:
+                            if dup_col2.button("この記事の生成記事を使う", key=f"near_dup_draft_{dup_index}", help="類似記事で生成した記事を、この記事の生成結果として表示します"):
+                                st.session_state[f"gen_article_{src_url}"] = dup_draft["text"]
+                                st.rerun()
+                        if not dup_translations and not dup_draft:
+                            st.caption("保存済みの翻訳・生成記事はありません")
+
             st.markdown("<br>", unsafe_allow_html=True)
 
             # Pre-Translation Placeholder Logic (Only show if NOT translated yet)
@@ -992,6 +1311,7 @@ def main():
                         engines,
                         index=0,
                         key="engine_select_initial",
+                        format_func=format_engine_option,
                         label_visibility="collapsed"
                     )
                     
@@ -1010,6 +1330,11 @@ def main():
                             # Defer translation execution to after grid rendering
                             st.session_state["run_translation_1"] = True
                             st.session_state["pending_engine_1"] = selected_engine
+                            if st.session_state.get("last_engine_v9") != selected_engine:
+                                st.session_state["last_engine_v9"] = selected_engine
+                                # Gemini選択時は利用回数のクッキーも同じ実行で保存するため、別のkeyを指定する
+                                expires = datetime.datetime.now() + datetime.timedelta(days=30)
+                                cookie_manager.set("last_engine_v9", selected_engine, expires_at=expires, key="set_last_engine_v9")
                             st.session_state["pending_model_1"] = st.session_state.get("gemini_model_setting", "gemini-2.5-flash")
                             
                             # Note: Title translation is also deferred/handled at the end now to assume consistent state
@@ -1077,7 +1402,7 @@ def main():
                 with pc2:
                     # 翻訳1プレースホルダー
                     # If translating, prepare the placeholder
-                    if st.session_state.get("run_translation_1"):
+                    if st.session_state.get("run_translation_1") or has_job("job_translation_1", src_url):
                         t1_placeholders = st.empty()
                     else:
                         st.markdown("""
@@ -1204,6 +1529,7 @@ def main():
                         engines,
                         index=current_engine_1_idx,
                         key="engine_select_1",
+                        format_func=format_engine_option,
                         label_visibility="collapsed"
                     )
                     
@@ -1226,6 +1552,8 @@ def main():
                         if t_key in st.session_state: del st.session_state[t_key]
                         t_ttl_key = f"t_ttl_v9_{src_url}"
                         if t_ttl_key in st.session_state: del st.session_state[t_ttl_key]
+                        # 前のエンジンで実行中のジョブの結果は、このURLの翻訳として取り込まない
+                        drop_job("job_translation_1", engine=new_engine_1)
                         
                         # Defer translation execution
                 # Deferred blocks moved to end of script
@@ -1261,6 +1589,7 @@ def main():
                             engines,
                             index=current_engine_2_idx,
                             key="engine_select_2",
+                            format_func=format_engine_option,
                             label_visibility="collapsed"
                         )
                         
@@ -1289,6 +1618,7 @@ def main():
                                 if t_key_2 in st.session_state: del st.session_state[t_key_2]
                                 t_ttl_key_2 = f"t_ttl_v9_{src_url}_2"
                                 if t_ttl_key_2 in st.session_state: del st.session_state[t_ttl_key_2]
+                                drop_job("job_translation_2", engine=new_engine_2)
                                 
                                 # Defer translation execution
                                 st.session_state["run_translation_2"] = True
@@ -1322,13 +1652,50 @@ def main():
                         </div>
                         """, unsafe_allow_html=True)
                         
+                        # 保存済みの下書きがあれば、生成せずに最新のバージョンを表示する
+                        gen_model_name = st.session_state.get("gemini_model_setting", "gemini-2.5-flash")
+                        gen_draft_key = article_draft_key(src_article, gen_model_name)
+                        if (
+                            not st.session_state.get(gen_key)
+                            and not st.session_state.get("run_article_gen")
+                            and not has_job("job_article_gen", src_url)
+                        ):
+                            latest_draft = draft_store.latest(gen_draft_key)
+                            if latest_draft:
+                                st.session_state[gen_key] = latest_draft["text"]
+
                         # Show existing result header or generate button
                         if gen_key in st.session_state and st.session_state[gen_key]:
                             generated_text = st.session_state[gen_key]
                             render_copy_header("生成された記事", generated_text, "gen_article")
+                            # 再生成は明示的な操作のみ（保存済みの下書き・共有キャッシュを使わずに生成し、新しいバージョンとして保存する）
                             if st.button("🔄 再生成", key="regenerate_article", disabled=not has_gemini_key, use_container_width=True):
                                 del st.session_state[gen_key]
+                                st.session_state["run_article_gen"] = True
+                                st.session_state["force_article_gen"] = True
                                 st.rerun()
+
+                            # バージョン履歴（新しい順）。選んだバージョンを表示する
+                            draft_versions = draft_store.history(gen_draft_key)
+                            if len(draft_versions) > 1:
+                                version_ids = [v["id"] for v in draft_versions]
+                                version_texts = {v["id"]: v["text"] for v in draft_versions}
+                                version_labels = {
+                                    v["id"]: datetime.datetime.fromtimestamp(v["created_at"]).strftime("%m/%d %H:%M") + ("（最新）" if i == 0 else "")
+                                    for i, v in enumerate(draft_versions)
+                                }
+                                current_version = next((vid for vid in version_ids if version_texts[vid] == generated_text), version_ids[0])
+                                selected_version = st.selectbox(
+                                    "バージョン履歴",
+                                    version_ids,
+                                    index=version_ids.index(current_version),
+                                    format_func=lambda vid: version_labels[vid],
+                                    # 新しいバージョンが保存されたら選択をリセットする
+                                    key=f"draft_version_{version_ids[0]}",
+                                )
+                                if selected_version != current_version:
+                                    st.session_state[gen_key] = version_texts[selected_version]
+                                    st.rerun()
                         else:
                             if not has_gemini_key:
                                 st.warning("Gemini APIキーを設定してください")
@@ -1359,57 +1726,61 @@ def main():
                      current_e1 = st.session_state.get("engine_1_selected", "")
                      # Only show if we are actually using Gemini (to avoid confusion)
                      if "Gemini" in current_e1:
-                         st.warning(f"⚠️ Geminiでの翻訳に失敗しました。")
-                         if st.button(f"モデルを変更して再試行 ({fallback_target_model})", key="fallback_btn_1", help="より安定したモデルで再試行します"):
+                         missing_count_1 = sum(1 for item in trans_data if is_missing_translation(item))
+                         st.warning(f"⚠️ Geminiでの翻訳に失敗しました。(未翻訳: {missing_count_1} 段落)")
+                         retry_c1, retry_c2 = st.columns(2)
+                         # 翻訳済みの段落は残し、未翻訳の段落だけを再送する
+                         if retry_c1.button("未翻訳の段落から再開", key="resume_btn_1", help="翻訳済みの段落はそのまま残し、続きだけを翻訳します"):
+                             job = submit_translation_job(
+                                 "translation_1", src_url, src_article, current_e1,
+                                 st.session_state.get("gemini_model_setting", "gemini-2.5-flash"), source_lang,
+                                 row_count=len(src_article.structured_html_parts), item_id_prefix="p-trans",
+                                 resume_from=(trans_data, translated_title_or_none(st.session_state.get(f"t_ttl_v9_{src_url}"), src_article.title)),
+                             )
+                             track_job("job_translation_1", job, src_url, (f"t_v9_{src_url}", f"t_ttl_v9_{src_url}"), engine=current_e1)
+                             st.rerun()
+                         if retry_c2.button(f"モデルを変更して再試行 ({fallback_target_model})", key="fallback_btn_1", help="より安定したモデルで未翻訳の段落を再試行します"):
                              new_label = f"Gemini ({fallback_target_model})"
                              st.session_state["gemini_label_current"] = new_label
                              st.session_state["engine_1_selected"] = new_label
                              
-                             # Execute translation immediately
-                             with st.spinner(f"{new_label} で再試行中..."):
-                                 st.session_state[t_key] = translate_paragraphs(
-                                     src_article.structured_html_parts,
-                                     engine_name=f"Gemini:{fallback_target_model}",
-                                     source_lang=source_lang,
-                                     deepl_api_key=st.session_state.get("deepl_api_key"),
-                                     gemini_api_key=st.session_state.get("gemini_api_key")
-                                 )
-                                 st.session_state[f"t_ttl_v9_{src_url}"] = translate_paragraphs(
-                                     [{"tag": "h1", "text": src_article.title}],
-                                     engine_name=f"Gemini:{fallback_target_model}",
-                                     source_lang=source_lang,
-                                     deepl_api_key=st.session_state.get("deepl_api_key"),
-                                     gemini_api_key=st.session_state.get("gemini_api_key")
-                                 )[0]["text"]
+                             # 未翻訳の段落だけをバックグラウンドジョブで再試行する（タイトルも本文と同じリクエストで翻訳する）
+                             job = submit_translation_job(
+                                 "translation_1", src_url, src_article, new_label, fallback_target_model, source_lang,
+                                 row_count=len(src_article.structured_html_parts), item_id_prefix="p-trans",
+                                 resume_from=(trans_data, translated_title_or_none(st.session_state.get(f"t_ttl_v9_{src_url}"), src_article.title)),
+                             )
+                             track_job("job_translation_1", job, src_url, (f"t_v9_{src_url}", f"t_ttl_v9_{src_url}"), engine=new_label)
                              st.rerun()
 
                 # Check Engine 2 for Errors (Compare Mode)
                 if is_compare_mode and trans_data_2 and any("Gemini (Error)" in str(item.get("engine", "")) for item in trans_data_2):
                      current_e2 = st.session_state.get("engine_2_selected", "")
                      if "Gemini" in current_e2:
-                         st.warning(f"⚠️ Geminiでの翻訳に失敗しました (比較)。")
-                         if st.button(f"モデルを変更して再試行 ({fallback_target_model})", key="fallback_btn_2", help="より安定したモデルで再試行します"):
+                         missing_count_2 = sum(1 for item in trans_data_2 if is_missing_translation(item))
+                         st.warning(f"⚠️ Geminiでの翻訳に失敗しました (比較)。(未翻訳: {missing_count_2} 段落)")
+                         retry_c1, retry_c2 = st.columns(2)
+                         if retry_c1.button("未翻訳の段落から再開", key="resume_btn_2", help="翻訳済みの段落はそのまま残し、続きだけを翻訳します"):
+                             job = submit_translation_job(
+                                 "translation_2", src_url, src_article, current_e2,
+                                 st.session_state.get("gemini_model_setting", "gemini-2.5-flash"), source_lang,
+                                 row_count=len(src_article.structured_html_parts), item_id_prefix="p-comp",
+                                 resume_from=(trans_data_2, translated_title_or_none(st.session_state.get(f"t_ttl_v9_{src_url}_2"), src_article.title)),
+                             )
+                             track_job("job_translation_2", job, src_url, (f"t_v9_{src_url}_2", f"t_ttl_v9_{src_url}_2"), engine=current_e2)
+                             st.rerun()
+                         if retry_c2.button(f"モデルを変更して再試行 ({fallback_target_model})", key="fallback_btn_2", help="より安定したモデルで未翻訳の段落を再試行します"):
                              new_label = f"Gemini ({fallback_target_model})"
                              st.session_state["gemini_label_current"] = new_label
                              st.session_state["engine_2_selected"] = new_label
                              
-                             # Execute translation immediately
-                             with st.spinner(f"{new_label} で再試行中..."):
-                                 t_key_2 = f"t_v9_{src_url}_compare"
-                                 st.session_state[t_key_2] = translate_paragraphs(
-                                     src_article.structured_html_parts,
-                                     engine_name=f"Gemini:{fallback_target_model}",
-                                     source_lang=source_lang,
-                                     deepl_api_key=st.session_state.get("deepl_api_key"),
-                                     gemini_api_key=st.session_state.get("gemini_api_key")
-                                 )
-                                 st.session_state[f"t_ttl_v9_{src_url}_compare"] = translate_paragraphs(
-                                     [{"tag": "h1", "text": src_article.title}],
-                                     engine_name=f"Gemini:{fallback_target_model}",
-                                     source_lang=source_lang,
-                                     deepl_api_key=st.session_state.get("deepl_api_key"),
-                                     gemini_api_key=st.session_state.get("gemini_api_key")
-                                 )[0]["text"]
+                             # 未翻訳の段落だけをバックグラウンドジョブで再試行する（タイトルも本文と同じリクエストで翻訳する）
+                             job = submit_translation_job(
+                                 "translation_2", src_url, src_article, new_label, fallback_target_model, source_lang,
+                                 row_count=len(src_article.structured_html_parts), item_id_prefix="p-comp",
+                                 resume_from=(trans_data_2, translated_title_or_none(st.session_state.get(f"t_ttl_v9_{src_url}_2"), src_article.title)),
+                             )
+                             track_job("job_translation_2", job, src_url, (f"t_v9_{src_url}_2", f"t_ttl_v9_{src_url}_2"), engine=new_label)
                              st.rerun()
 
                 # --- Body Generation ---
@@ -1515,17 +1886,18 @@ def main():
                 """
                 components.html(js_alignment_script, height=0, width=0)
                 # This restores the "formatted" look by aligning paragraphs and adding style.
-                is_translating_1 = st.session_state.get("run_translation_1", False)
-                is_translating_2 = st.session_state.get("run_translation_2", False)
+                # バックグラウンドで翻訳中のジョブがある間も、行ごとのプレースホルダーを用意する
+                is_translating_1 = st.session_state.get("run_translation_1", False) or has_job("job_translation_1", src_url)
+                is_translating_2 = st.session_state.get("run_translation_2", False) or has_job("job_translation_2", src_url)
     
                 # Retrieve existing translations if available
                 t1_title = st.session_state.get(f"t_ttl_v9_{src_url}", "")
                 t2_title = st.session_state.get(f"t_ttl_v9_{src_url}_2", "")
     
                 # Prepare lists for streaming placeholders
-                if "t1_placeholders" not in locals() or not isinstance(t1_placeholders, list):
+                if not isinstance(t1_placeholders, list):
                     t1_placeholders = []
-                if "t2_placeholders" not in locals() or not isinstance(t2_placeholders, list):
+                if not isinstance(t2_placeholders, list):
                     t2_placeholders = []
     
     
@@ -1666,7 +2038,7 @@ def main():
                                 border-radius: 12px;
                             ">{_format_article_html(generated_text)}</div>
                             """, unsafe_allow_html=True)
-                        elif st.session_state.get("run_article_gen"):
+                        elif st.session_state.get("run_article_gen") or has_job("job_article_gen", src_url):
                             # Placeholder while generating
                             gen_output_placeholder = st.empty()
                             gen_output_placeholder.markdown("""
@@ -1718,6 +2090,8 @@ def main():
     # These must be outside the conditionally rendered columns to ensure they always run if flagged.
     
     # Translation 1 (Main)
+    # 翻訳・記事生成はバックグラウンドジョブで実行する。途中でウィジェットを操作して再実行されても
+    # ジョブは止まらず、毎回の実行でジョブの途中経過を描画し、完了したら結果をセッションに取り込む。
     if st.session_state.get("run_translation_1"):
         pending_engine = st.session_state.get("pending_engine_1")
         pending_model = st.session_state.get("pending_model_1")
@@ -1726,40 +2100,20 @@ def main():
         st.session_state["run_translation_1"] = False
         st.session_state["v9_error_banner_html"] = None
         
-        with st.spinner(f"{pending_engine} で翻訳中..."):
-            # Ensure placeholders exist
-            # If t1_placeholders was populated in the loop above, use it.
-            # If for some reason checking triggered without loop (unlikely), fallback.
-            if "t1_placeholders" not in locals() or not t1_placeholders:
-                # If we have no placeholders (e.g. empty details), we can't stream properly row-by-row.
-                # Fallback to single area (legacy safely)
-                t1_placeholders = st.empty()
-            
-            # Execute translation
-            t_key = f"t_v9_{src_url}"
-            st.session_state[t_key] = translate_paragraphs(
-                src_article.structured_html_parts,
-                engine_name=pending_engine,
-                source_lang=source_lang,
-                deepl_api_key=st.session_state.get("deepl_api_key"),
-                gemini_api_key=st.session_state.get("gemini_api_key"),
-                output_placeholder=t1_placeholders, 
-                progress_placeholder=progress_area_top if 'progress_area_top' in locals() else None, 
-                status_placeholder=status_area_top if 'status_area_top' in locals() else None,
-                model_name=pending_model,
-                item_id_prefix="p-trans"
-            )
-            
-            # Title translation
-            st.session_state[f"t_ttl_v9_{src_url}"] = translate_paragraphs(
-                [{"tag": "h1", "text": src_article.title}],
-                engine_name=pending_engine,
-                source_lang=source_lang,
-                deepl_api_key=st.session_state.get("deepl_api_key"),
-                gemini_api_key=st.session_state.get("gemini_api_key")
-            )[0]["text"]
-            
-        st.rerun()
+        # 別のセッション・一括処理で翻訳済みなら共有キャッシュ・保存済みの結果から表示する
+        translation_key = translation_cache_key(src_url, pending_engine, pending_model, source_lang)
+        cached = result_cache.get(translation_key) or translation_store.get(translation_key)
+        if cached is not None:
+            st.session_state[f"t_v9_{src_url}"], st.session_state[f"t_ttl_v9_{src_url}"] = cached
+            st.rerun()
+
+        job = submit_translation_job(
+            "translation_1", src_url, src_article, pending_engine, pending_model, source_lang,
+            row_count=len(t1_placeholders) if isinstance(t1_placeholders, list) and t1_placeholders else None,
+            item_id_prefix="p-trans",
+            speculative=get_speculative_job(src_url, pending_engine, source_lang),
+        )
+        track_job("job_translation_1", job, src_url, (f"t_v9_{src_url}", f"t_ttl_v9_{src_url}"), engine=pending_engine)
 
     # Translation 2 (Compare)
     if st.session_state.get("run_translation_2"):
@@ -1769,64 +2123,91 @@ def main():
         st.session_state["run_translation_2"] = False
         st.session_state["v9_error_banner_html"] = None
         
-        with st.spinner(f"{pending_engine} で比較翻訳中..."):
-            if "t2_placeholders" not in locals() or not t2_placeholders:
-                t2_placeholders = st.empty()
-            
-            t_key_2 = f"t_v9_{src_url}_2"
-            st.session_state[t_key_2] = translate_paragraphs(
-                src_article.structured_html_parts,
-                engine_name=pending_engine,
-                source_lang=source_lang,
-                deepl_api_key=st.session_state.get("deepl_api_key"),
-                gemini_api_key=st.session_state.get("gemini_api_key"),
-                output_placeholder=t2_placeholders,
-                progress_placeholder=progress_area_top_2 if 'progress_area_top_2' in locals() else None, 
-                status_placeholder=status_area_top_2 if 'status_area_top_2' in locals() else None,
-                model_name=pending_model,
-                item_id_prefix="p-comp"
-            )
-            
-            st.session_state[f"t_ttl_v9_{src_url}_2"] = translate_paragraphs(
-                [{"tag": "h1", "text": src_article.title}],
-                engine_name=pending_engine,
-                source_lang=source_lang,
-                deepl_api_key=st.session_state.get("deepl_api_key"),
-                gemini_api_key=st.session_state.get("gemini_api_key")
-            )[0]["text"]
-            
-        st.rerun()
+        translation_key = translation_cache_key(src_url, pending_engine, pending_model, source_lang)
+        cached = result_cache.get(translation_key) or translation_store.get(translation_key)
+        if cached is not None:
+            st.session_state[f"t_v9_{src_url}_2"], st.session_state[f"t_ttl_v9_{src_url}_2"] = cached
+            st.rerun()
+
+        job = submit_translation_job(
+            "translation_2", src_url, src_article, pending_engine, pending_model, source_lang,
+            row_count=len(t2_placeholders) if isinstance(t2_placeholders, list) and t2_placeholders else None,
+            item_id_prefix="p-comp",
+        )
+        track_job("job_translation_2", job, src_url, (f"t_v9_{src_url}_2", f"t_ttl_v9_{src_url}_2"), engine=pending_engine)
 
     # Article Generation (Deferred)
     if st.session_state.get("run_article_gen"):
         st.session_state["run_article_gen"] = False
+        force_regenerate = st.session_state.pop("force_article_gen", False)
         
-        gen_key = f"gen_article_{src_url}"
         model_name = st.session_state.get("gemini_model_setting", "gemini-2.5-flash")
         
-        # Use the placeholder if it exists, otherwise create one
-        gen_placeholder = gen_output_placeholder if 'gen_output_placeholder' in locals() else st.empty()
-        
         # Prepare source text
         chinese_text = "\n\n".join(
             [p["text"] for p in src_article.structured_html_parts]
         )
+        gemini_api_key = st.session_state.get("gemini_api_key", "")
+        article_title = src_article.title if 'src_article' in locals() else ""
+        publisher = src_article.publisher if 'src_article' in locals() else ""
         
+        # 別のセッションで生成済みなら共有キャッシュ・保存済みの下書きから表示し、生成中ならそのジョブに相乗りする
+        # （再生成ボタンの場合はキャッシュを使わない）
+        gen_cache_key = article_cache_key(src_url, model_name)
+        gen_draft_key = article_draft_key(src_article, model_name)
+        if not force_regenerate:
+            cached = result_cache.get(gen_cache_key)
+            if cached is None:
+                latest_draft = draft_store.latest(gen_draft_key)
+                cached = latest_draft["text"] if latest_draft else None
+            if cached is not None:
+                st.session_state[f"gen_article_{src_url}"] = cached
+                st.rerun()
+
+        def run_article_gen(job):
+            result = generate_article(
+                chinese_text=chinese_text,
+                gemini_api_key=gemini_api_key,
+                model_name=model_name,
+                article_title=article_title,
+                publisher=publisher,
+                output_placeholder=job.placeholder("output"),
+            )
+            if result and not result.startswith("[エラー]"):
+                result_cache.put(gen_cache_key, result)
+                draft_store.save(gen_draft_key, result, source_url=src_url, title=article_title)
+            return result
+
         # Generate article
-        result = generate_article(
-            chinese_text=chinese_text,
-            gemini_api_key=st.session_state.get("gemini_api_key", ""),
-            model_name=model_name,
-            article_title=src_article.title if 'src_article' in locals() else "",
-            publisher=src_article.publisher if 'src_article' in locals() else "",
-            output_placeholder=gen_placeholder,
-        )
-        
-        # Save to session state
-        if result and not result.startswith("[エラー]"):
-            st.session_state[gen_key] = result
-        
-        st.rerun()
+        job = job_manager.submit("article_gen", run_article_gen, dedupe_key=gen_cache_key)
+        track_job("job_article_gen", job, src_url, (f"gen_article_{src_url}",))
+
+    # --- Background job polling ---
+    # 表示中の記事のジョブだけ途中経過を再生する。完了したジョブの結果は、URLが変わっていても開始時の記事のキーに保存する
+    job_1 = tracked_job("job_translation_1", src_url)
+    if job_1:
+        job_1.replay("output", t1_placeholders)
+        job_1.replay("progress", progress_area_top if 'progress_area_top' in locals() else None)
+        job_1.replay("status", status_area_top if 'status_area_top' in locals() else None)
+
+    job_2 = tracked_job("job_translation_2", src_url)
+    if job_2:
+        job_2.replay("output", t2_placeholders)
+        job_2.replay("progress", progress_area_top_2 if 'progress_area_top_2' in locals() else None)
+        job_2.replay("status", status_area_top_2 if 'status_area_top_2' in locals() else None)
+
+    gen_job = tracked_job("job_article_gen", src_url)
+    if gen_job:
+        gen_job.replay("output", gen_output_placeholder if 'gen_output_placeholder' in locals() else None)
+
+    cmp_view = (src_url, cmp_url)
+    for state_key, view in (
+        ("job_translation_1", src_url),
+        ("job_translation_2", src_url),
+        ("job_article_gen", src_url),
+        ("job_translation_cmp", cmp_view),
+    ):
+        collect_job(state_key, view)
 
     # --- タブ2: 画像読込 ---
     with tabs[1]:
@@ -1927,27 +2308,36 @@ def main():
                             ocr_results = st.session_state.get("ocr_results_v9", {})
                             progress_text = st.empty()
                             progress_bar = st.progress(0)
-                            
-                            for idx, abs_idx in enumerate(current_sel_indices):
-                                progress_text.text(f"画像 {idx+1}/{len(current_sel_indices)} を処理中...")
-                                progress_bar.progress((idx + 1) / len(current_sel_indices))
-                                
-                                img_url = image_urls[abs_idx]
-                                img_b64, _, _ = fetch_image_data_v10(img_url, base_url)
-                                
-                                if img_b64:
+                            progress_text.text(f"画像 0/{len(current_sel_indices)} を処理中...")
+
+                            def ocr_one(abs_idx):
+                                # ワーカースレッドではAPI呼び出しのみ行い、表示はメインスレッドで行う
+                                img_b64, _, _ = fetch_image_data_v10(image_urls[abs_idx], base_url)
+                                if not img_b64:
+                                    return None
+                                mime_type = img_b64.split(";")[0].split(":")[1]
+                                image_bytes = base64.b64decode(img_b64.split(",")[1])
+                                return ocr_and_translate_image(image_bytes, mime_type, gemini_key, gemini_model)
+
+                            # 同時実行数は "OCR" コントローラー（429で半減・安定時に増加）が調整する
+                            ocr_limiter = get_limiter("OCR")
+                            with ThreadPoolExecutor(max_workers=min(ocr_limiter.max_limit, len(current_sel_indices)), initializer=thread_initializer()) as executor:
+                                futures = {executor.submit(ocr_one, abs_idx): abs_idx for abs_idx in current_sel_indices}
+                                for done_count, future in enumerate(as_completed(futures), start=1):
+                                    abs_idx = futures[future]
+                                    progress_text.text(f"画像 {done_count}/{len(current_sel_indices)} を処理中...")
+                                    progress_bar.progress(done_count / len(current_sel_indices))
                                     try:
-                                        mime_type = img_b64.split(";")[0].split(":")[1]
-                                        b64_data = img_b64.split(",")[1]
-                                        image_bytes = base64.b64decode(b64_data)
-                                        
-                                        res = ocr_and_translate_image(image_bytes, mime_type, gemini_key, gemini_model)
-                                        if not res.get("error"):
-                                            ocr_results[abs_idx] = res
-                                        else:
-                                            st.error(f"画像 {abs_idx+1} の処理中にエラーが発生しました: {res['error']}")
+                                        res = future.result()
                                     except Exception as e:
                                         st.error(f"画像 {abs_idx+1} の解析に失敗しました: {e}")
+                                        continue
+                                    if res is None:
+                                        continue
+                                    if not res.get("error"):
+                                        ocr_results[abs_idx] = res
+                                    else:
+                                        st.error(f"画像 {abs_idx+1} の処理中にエラーが発生しました: {res['error']}")
                             
                             st.session_state["ocr_results_v9"] = ocr_results
                             progress_text.empty()
@@ -2030,6 +2420,8 @@ def main():
                 st.markdown("</div>", unsafe_allow_html=True)
                 
                 # 画像グリッド表示（4列）
+                # 先に全画像を並列取得してキャッシュしておき、グリッドの描画で1枚ずつ待たないようにする
+                prefetch_images(image_urls, base_url)
                 cols_per_row = 4
                 for i in range(0, len(image_urls), cols_per_row):
                     row_urls = image_urls[i:i + cols_per_row]
@@ -2210,7 +2602,19 @@ def main():
         else:
             # Comparison Logic
             if src_article and cmp_article:
-                diff_table, _ = make_diff_html(src_article.text, cmp_article.text)
+                # 一致部分は前後の数文だけ残して省略し、ハンクはページ単位で送る（全文表示は切り替えで選べる）
+                diff_opt_col1, diff_opt_col2 = st.columns([1, 1])
+                show_all_diff = diff_opt_col1.toggle("同一部分もすべて表示", value=False, key="diff_show_all")
+                diff_page_key = f"diff_page_{cmp_url}"
+                diff_page = st.session_state.get(diff_page_key, 1) - 1
+                if show_all_diff:
+                    diff_table, diff_page_count = make_diff_html(src_article.text, cmp_article.text, None, 0, None)
+                else:
+                    diff_table, diff_page_count = make_diff_html(src_article.text, cmp_article.text, DIFF_CONTEXT_LINES, diff_page)
+                if diff_page_count > 1:
+                    diff_opt_col2.number_input(
+                        f"ページ（全 {diff_page_count}）", min_value=1, max_value=diff_page_count, value=1, step=1, key=diff_page_key
+                    )
                 st.markdown(textwrap.dedent(f"""
                     <div class="trans-unified-container" style="height:75vh;">
                         <div class="trans-unified-header">
@@ -2222,8 +2626,123 @@ def main():
                         </div>
                     </div>
                 """), unsafe_allow_html=True)
+
+                # --- 比較記事の翻訳 ---
+                # 転載記事は大半の段落が元記事と同一のため、差分で対応付けて翻訳1の結果を再利用し、
+                # 追加・変更された段落だけを翻訳する
+                st.markdown("#### 比較記事の翻訳")
+                cmp_t_key, cmp_t_ttl_key = f"t_v9_{cmp_url}", f"t_ttl_v9_{cmp_url}"
+                base_results = st.session_state.get(f"t_v9_{src_url}")
+                if st.session_state.get(cmp_t_key) is not None:
+                    cmp_results = st.session_state[cmp_t_key]
+                    cmp_title = st.session_state.get(cmp_t_ttl_key, "")
+                    reused_count = st.session_state.get(f"cmp_reused_{cmp_url}")
+                    if reused_count is not None:
+                        st.caption(f"{len(cmp_results)} 段落のうち {reused_count} 段落は元記事の翻訳を再利用しました")
+                    cmp_full_text = f"# {cmp_title}\n\n" + "\n\n".join(p.get("text", "") for p in cmp_results)
+                    render_copy_header("比較記事 翻訳", cmp_full_text, "trans_cmp")
+                    st.markdown(cmp_full_text)
+                elif has_job("job_translation_cmp", cmp_view):
+                    # 比較記事の翻訳ジョブはこのタブでのみ描画する（描画先を作ってから途中経過を再生する）
+                    job_cmp = tracked_job("job_translation_cmp", cmp_view)
+                    job_cmp.replay("status", st.empty())
+                    job_cmp.replay("progress", st.empty())
+                    job_cmp.replay("output", st.empty())
+                elif not base_results:
+                    st.info("先に「翻訳」タブで元記事を翻訳すると、同一の段落はその翻訳を再利用して比較記事を翻訳できます。")
+                elif st.button("比較記事を翻訳（同一の段落は元記事の翻訳を再利用）", key="translate_cmp_btn"):
+                    # 翻訳1で現在選択中のエンジン（セレクトボックスで切り替えた場合は engine_1_selected、
+                    # 最初のエンジン選択のままなら pending_engine_1）。再利用する段落とエンジンを揃える
+                    cmp_engine = st.session_state.get("engine_1_selected") or st.session_state.get("pending_engine_1") or "Google"
+                    cmp_model = st.session_state.get("gemini_model_setting", "gemini-2.5-flash")
+                    cmp_source_lang = source_lang if "source_lang" in locals() else "auto"
+                    cmp_translation_key = translation_cache_key(cmp_url, cmp_engine, cmp_model, cmp_source_lang)
+                    cached = result_cache.get(cmp_translation_key) or translation_store.get(cmp_translation_key)
+                    if cached is not None:
+                        st.session_state[cmp_t_key], st.session_state[cmp_t_ttl_key] = cached
+                    else:
+                        reuse_preview = reuse_aligned_translations(
+                            src_article.structured_html_parts, base_results, cmp_article.structured_html_parts, cmp_engine
+                        )
+                        st.session_state[f"cmp_reused_{cmp_url}"] = sum(1 for item in reuse_preview if not is_missing_translation(item))
+                        job = submit_translation_job(
+                            "translation_cmp", cmp_url, cmp_article, cmp_engine, cmp_model, cmp_source_lang,
+                            item_id_prefix="p-cmp",
+                            reuse_from=(src_article, base_results, st.session_state.get(f"t_ttl_v9_{src_url}")),
+                        )
+                        track_job("job_translation_cmp", job, cmp_view, (cmp_t_key, cmp_t_ttl_key), engine=cmp_engine)
+                    st.rerun()
             else:
                 st.error("記事の読み込みに失敗しました。")
 
+    # --- タブ4: 一括処理キュー ---
+    with tabs[3]:
+        st.markdown("#### 一括処理キュー")
+        st.caption(
+            "複数の記事URLを登録しておくと、ワーカー（`python -m src.batch_queue worker`）がGeminiの利用枠に合わせて順に処理します。"
+            "結果は保存され、その記事を開くとすぐに表示されます。"
+        )
+        batch_urls_text = st.text_area("記事URL（1行に1件）", key="batch_urls", height=150)
+        bq_col1, bq_col2, bq_col3 = st.columns(3)
+        batch_kind = bq_col1.radio("処理内容", ["記事生成", "翻訳"], horizontal=True, key="batch_kind")
+        batch_engines = ["Google", "MyMemory", "DeepL", st.session_state.get("gemini_label_current", "Gemini (gemini-2.5-flash)")]
+        batch_engine = bq_col2.selectbox("翻訳エンジン", batch_engines, key="batch_engine", disabled=batch_kind != "翻訳")
+        batch_priority = bq_col3.number_input("優先度（大きいほど先に処理）", value=0, step=1, key="batch_priority")
+
+        if st.button("キューに追加", key="batch_enqueue_btn", type="primary"):
+            batch_urls = [u.strip() for u in batch_urls_text.splitlines() if u.strip().startswith("http")]
+            if not batch_urls:
+                st.warning("URLを入力してください")
+            else:
+                try:
+                    for url in batch_urls:
+                        batch_queue.enqueue(
+                            KIND_ARTICLE if batch_kind == "記事生成" else KIND_TRANSLATION,
+                            url,
+                            priority=int(batch_priority),
+                            engine=batch_engine if batch_kind == "翻訳" else None,
+                            model=st.session_state.get("gemini_model_setting", "gemini-2.5-flash"),
+                        )
+                    st.success(f"{len(batch_urls)} 件をキューに追加しました")
+                except Exception as e:
+                    st.error(f"キューに追加できませんでした: {e}")
+
+        try:
+            batch_counts = batch_queue.counts()
+            batch_jobs = batch_queue.jobs(100)
+        except Exception as e:
+            st.error(f"キューを読み込めませんでした: {e}")
+        else:
+            st.markdown(
+                f"待機中: **{batch_counts['queued']}** / 実行中: **{batch_counts['running']}** / "
+                f"完了: **{batch_counts['done']}** / 失敗: **{batch_counts['failed']}**"
+            )
+            if batch_jobs:
+                st.dataframe(
+                    [
+                        {
+                            "ID": job["id"],
+                            "状態": job["status"],
+                            "優先度": job["priority"],
+                            "処理": "記事生成" if job["kind"] == KIND_ARTICLE else f"翻訳 ({job['engine']})",
+                            "試行": f"{job['attempts']}/{job['max_attempts']}",
+                            "次回実行": datetime.datetime.fromtimestamp(job["next_run_at"]).strftime("%m/%d %H:%M") if job["status"] == "queued" else "",
+                            "URL": job["url"],
+                            "エラー": job["last_error"] or "",
+                        }
+                        for job in batch_jobs
+                    ],
+                    hide_index=True,
+                    use_container_width=True,
+                )
+
+    # 表示中の記事のジョブが実行中は、全タブを描画したあとで少し待って再描画する（進捗のポーリング）
+    if (
+        any(has_pending_job(k, src_url) for k in ("job_translation_1", "job_translation_2", "job_article_gen"))
+        or has_pending_job("job_translation_cmp", cmp_view)
+    ):
+        wait_for_next_poll()
+        st.rerun()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,9 +2,19 @@
 Shenzhen Fan 記事生成モジュール
 Gemini APIを使って中国語ニュース原文から日本語記事を自動生成する
 """
-import google.generativeai as genai
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
 import streamlit as st
 
+from src.concurrency import get_limiter
+from src.gemini_client import get_model
+from src.key_pool import call_with_failover
+from src.rate_limiter import rate_limiter
+from src.render import throttled
+from src.utils import estimate_tokens, plan_token_chunks
+
 
 # Shenzhen Fan 記事生成プロンプト
 ARTICLE_GENERATION_PROMPT = """あなたは深センの日本人向け情報サイト「Shenzhen Fan」の編集者です。
@@ -32,6 +42,32 @@ ARTICLE_GENERATION_PROMPT = """あなたは深センの日本人向け情報サ
 {chinese_text}
 """
 
+# 長文の原文は map-reduce で生成する（推定トークン数がこれを超える場合）
+# map: 段落の境界で分割したパートごとに事実を並列に抽出する / reduce: 抽出した事実から記事を構成する
+MAP_REDUCE_THRESHOLD_TOKENS = 8000
+MAP_CHUNK_TOKENS = 4000
+
+FACT_EXTRACTION_PROMPT = """あなたは深センの日本人向け情報サイト「Shenzhen Fan」の編集者です。
+以下は中国語の長い記事「{title}」（{publisher}）の一部（全{chunk_count}パート中の第{chunk_number}パート）です。
+記事作成の材料として、このパートに含まれる事実（Fact）を日本語の箇条書きで抽出してください。
+
+# 制約事項
+- 「世界をリードする」「画期的な」といった誇張やプロパガンダ的な修飾語は除き、事実のみを書く。
+- 数値・日付・固有名詞（企業名・地名・制度名）は省略せずに残す。
+- 深セン在住の日本人の生活やビジネスに関係しそうな点は漏らさない。
+- 前置きやまとめは書かず、箇条書きのみを出力する。
+
+# 元記事テキスト（中国語）
+{chinese_text}
+"""
+
+# reduce 用のプロンプト。制約事項・構成・トーンは通常のプロンプトと共通にし、原文の代わりに事実メモを渡す
+ARTICLE_COMPOSE_PROMPT = ARTICLE_GENERATION_PROMPT.split("# 元記事テキスト（中国語）")[0] + """# 元記事から抽出した事実メモ（日本語）
+元記事が長いため、パートごとに抽出した事実メモを原文の代わりに使用してください。
+
+{facts}
+"""
+
 # Gemini Safety Settings (shared with translator.py)
 SAFETY_SETTINGS = [
     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
@@ -48,6 +84,7 @@ def generate_article(
     article_title: str = "",
     publisher: str = "",
     output_placeholder=None,
+    map_reduce: Optional[bool] = None,
 ) -> str:
     """
     中国語テキストからShenzhen Fan向け日本語記事を生成する。
@@ -59,6 +96,7 @@ def generate_article(
         article_title: 元記事のタイトル
         publisher: 元記事のメディア名
         output_placeholder: Streamlit placeholder（ストリーミング表示用）
+        map_reduce: 長文向けの map-reduce で生成するか（None の場合は原文の長さで自動判定）
 
     Returns:
         生成された日本語記事テキスト
@@ -66,61 +104,58 @@ def generate_article(
     if not chinese_text or not gemini_api_key:
         return ""
 
-    # Configure Gemini
-    genai.configure(api_key=gemini_api_key)
-    model = genai.GenerativeModel(model_name)
-
-    # Build prompt
-    prompt = ARTICLE_GENERATION_PROMPT.format(
-        title=article_title or "(タイトル不明)",
-        publisher=publisher or "(メディア不明)",
-        chinese_text=chinese_text,
-    )
+    if map_reduce is None:
+        map_reduce = estimate_tokens(chinese_text) > MAP_REDUCE_THRESHOLD_TOKENS
 
     # Generate with streaming
     full_text = ""
 
     try:
-        response = model.generate_content(
-            prompt,
-            safety_settings=SAFETY_SETTINGS,
-            stream=True,
-        )
+        # Build prompt
+        if map_reduce:
+            facts = _extract_facts(chinese_text, gemini_api_key, model_name, article_title, publisher, output_placeholder)
+            prompt = ARTICLE_COMPOSE_PROMPT.format(
+                title=article_title or "(タイトル不明)",
+                publisher=publisher or "(メディア不明)",
+                facts=facts,
+            )
+        else:
+            prompt = ARTICLE_GENERATION_PROMPT.format(
+                title=article_title or "(タイトル不明)",
+                publisher=publisher or "(メディア不明)",
+                chinese_text=chinese_text,
+            )
 
-        for chunk in response:
-            if chunk.text:
-                full_text += chunk.text
-
-                # Update placeholder with streaming content
-                if output_placeholder:
-                    output_placeholder.markdown(
-                        f"""<div style="
-                            color: #1e293b;
-                            line-height: 2.0;
-                            font-size: 15px;
-                            padding: 20px 24px;
-                            background: #ffffff;
-                            border: 1px solid #e2e8f0;
-                            border-radius: 12px;
-                        ">{_format_article_html(full_text)}▌</div>""",
-                        unsafe_allow_html=True,
-                    )
-
-        # Final render (remove cursor)
-        if output_placeholder and full_text:
-            output_placeholder.markdown(
-                f"""<div style="
-                    color: #1e293b;
-                    line-height: 2.0;
-                    font-size: 15px;
-                    padding: 20px 24px;
-                    background: #ffffff;
-                    border: 1px solid #e2e8f0;
-                    border-radius: 12px;
-                ">{_format_article_html(full_text)}</div>""",
-                unsafe_allow_html=True,
+        def start_stream(key):
+            rate_limiter.acquire("Gemini", key, chars=len(prompt))
+            # キーごとのクライアントを使い回す（genai.configure はプロセス全体を書き換えるため使わない）
+            # stream=True でも最初のチャンクまでは呼び出し時に受信するため、429はここで発生する
+            return get_model(key, model_name).generate_content(
+                prompt,
+                safety_settings=SAFETY_SETTINGS,
+                stream=True,
             )
 
+        # 複数キーが設定されている場合は、429のキーを避けて次のキーで再送する
+        response = call_with_failover("Gemini", gemini_api_key, start_stream)
+
+        # 描画は10Hzに間引き、間引いた更新ではHTMLの組み立ても行わない（終了時に最後の内容を描画する）
+        # HTMLへの変換は行単位で差分だけ行う（確定した行は再変換しない）
+        formatter = IncrementalArticleFormatter()
+        with throttled(output_placeholder) as live:
+            for chunk in response:
+                if chunk.text:
+                    full_text += chunk.text
+                    formatter.feed(chunk.text)
+
+                    # Update placeholder with streaming content
+                    if live:
+                        live.markdown(lambda: _article_box_html(formatter.html(), cursor=True), unsafe_allow_html=True)
+
+            # Final render (remove cursor)
+            if live and full_text:
+                live.markdown(_article_box_html(formatter.html()), unsafe_allow_html=True)
+
         return full_text
 
     except Exception as e:
@@ -139,53 +174,123 @@ def generate_article(
         return f"[エラー] {error_msg}"
 
 
+def _extract_facts(chinese_text: str, gemini_api_key: str, model_name: str, article_title: str, publisher: str, output_placeholder=None) -> str:
+    """
+    map: 原文を段落の境界で分割し、パートごとの事実を並列に抽出して、パート順に連結した事実メモを返す。
+    同時実行数はGeminiのAIMDコントローラー、リクエスト数はレート制限に従う。いずれかのパートが失敗した場合は例外を送出する。
+    """
+    paragraphs = [p for p in chinese_text.split("\n\n") if p.strip()]
+    chunks = [
+        "\n\n".join(paragraphs[i] for i in indices)
+        for indices in plan_token_chunks(paragraphs, MAP_CHUNK_TOKENS)
+    ]
+    limiter = get_limiter("Gemini")
+
+    def extract(chunk_number: int, chunk_text: str) -> str:
+        prompt = FACT_EXTRACTION_PROMPT.format(
+            title=article_title or "(タイトル不明)",
+            publisher=publisher or "(メディア不明)",
+            chunk_count=len(chunks),
+            chunk_number=chunk_number,
+            chinese_text=chunk_text,
+        )
+
+        def call(key):
+            rate_limiter.acquire("Gemini", key, chars=len(prompt))
+            return get_model(key, model_name).generate_content(prompt, safety_settings=SAFETY_SETTINGS).text
+
+        with limiter.slot():
+            return call_with_failover("Gemini", gemini_api_key, call)
+
+    if output_placeholder:
+        output_placeholder.info(f"⏳ 長文のため {len(chunks)} パートに分けて要点を抽出中... (0/{len(chunks)})")
+
+    facts = [None] * len(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, min(limiter.max_limit, len(chunks)))) as executor:
+        futures = {executor.submit(extract, i + 1, text): i for i, text in enumerate(chunks)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            facts[futures[future]] = future.result()
+            if output_placeholder:
+                output_placeholder.info(f"⏳ 長文のため {len(chunks)} パートに分けて要点を抽出中... ({done}/{len(chunks)})")
+
+    return "\n\n".join(f"## パート{i + 1}\n{text.strip()}" for i, text in enumerate(facts))
+
+
+def _article_box_html(body_html: str, cursor: bool = False) -> str:
+    """
+    生成中・生成後の記事の表示用HTML（cursor=True なら末尾にカーソルを付ける）
+    body_html: _format_article_html() / IncrementalArticleFormatter.html() の出力
+    """
+    return f"""<div style="
+        color: #1e293b;
+        line-height: 2.0;
+        font-size: 15px;
+        padding: 20px 24px;
+        background: #ffffff;
+        border: 1px solid #e2e8f0;
+        border-radius: 12px;
+    ">{body_html}{"▌" if cursor else ""}</div>"""
+
+
+_BOLD_PATTERN = re.compile(r"\*\*(.*?)\*\*")
+
+
 def _format_article_html(text: str) -> str:
     """
     マークダウンテキストを簡易的なHTMLに変換する。
     Geminiの出力は通常マークダウン形式なので、見出しや箇条書きを整形する。
     """
-    import re
+    return "\n".join(_format_article_line(line) for line in text.split("\n"))
 
-    lines = text.split("\n")
-    html_lines = []
 
-    for line in lines:
-        stripped = line.strip()
-        if not stripped:
-            html_lines.append("<br>")
-            continue
+def _format_article_line(line: str) -> str:
+    """
+    1行分のマークダウンをHTMLに変換する（【…】の見出しは2要素になるため改行を含む場合がある）
+    """
+    stripped = line.strip()
+    if not stripped:
+        return "<br>"
 
-        # 見出し（### → h4, ## → h3, # → h2）
-        if stripped.startswith("### "):
-            html_lines.append(
-                f"<h4 style='color:#334155; margin:16px 0 8px 0; font-size:1.05em;'>{stripped[4:]}</h4>"
-            )
-        elif stripped.startswith("## "):
-            html_lines.append(
-                f"<h3 style='color:#1e293b; margin:20px 0 10px 0; font-size:1.15em;'>{stripped[3:]}</h3>"
-            )
-        elif stripped.startswith("# "):
-            html_lines.append(
-                f"<h2 style='color:#0f172a; margin:20px 0 12px 0; font-size:1.3em;'>{stripped[2:]}</h2>"
-            )
-        # 箇条書き
-        elif stripped.startswith("- ") or stripped.startswith("* "):
-            html_lines.append(
-                f"<div style='padding-left:16px; margin:4px 0;'>• {stripped[2:]}</div>"
-            )
-        # 太字のセクションヘッダー【…】
-        elif stripped.startswith("【") and "】" in stripped:
-            header_end = stripped.index("】") + 1
-            header = stripped[:header_end]
-            rest = stripped[header_end:]
-            html_lines.append(
-                f"<div style='font-weight:700; color:#1e40af; margin:18px 0 6px 0; font-size:1.1em;'>{header}</div>"
-            )
-            if rest.strip():
-                html_lines.append(f"<div>{rest.strip()}</div>")
-        else:
-            # Bold markers: **text** → <strong>text</strong>
-            formatted = re.sub(r"\*\*(.*?)\*\*", r"<strong>\1</strong>", stripped)
-            html_lines.append(f"<div style='margin:4px 0;'>{formatted}</div>")
+    # 見出し（### → h4, ## → h3, # → h2）
+    if stripped.startswith("### "):
+        return f"<h4 style='color:#334155; margin:16px 0 8px 0; font-size:1.05em;'>{stripped[4:]}</h4>"
+    if stripped.startswith("## "):
+        return f"<h3 style='color:#1e293b; margin:20px 0 10px 0; font-size:1.15em;'>{stripped[3:]}</h3>"
+    if stripped.startswith("# "):
+        return f"<h2 style='color:#0f172a; margin:20px 0 12px 0; font-size:1.3em;'>{stripped[2:]}</h2>"
+    # 箇条書き
+    if stripped.startswith("- ") or stripped.startswith("* "):
+        return f"<div style='padding-left:16px; margin:4px 0;'>• {stripped[2:]}</div>"
+    # 太字のセクションヘッダー【…】
+    if stripped.startswith("【") and "】" in stripped:
+        header_end = stripped.index("】") + 1
+        header = stripped[:header_end]
+        rest = stripped[header_end:]
+        html = f"<div style='font-weight:700; color:#1e40af; margin:18px 0 6px 0; font-size:1.1em;'>{header}</div>"
+        if rest.strip():
+            html += f"\n<div>{rest.strip()}</div>"
+        return html
+    # Bold markers: **text** → <strong>text</strong>
+    formatted = _BOLD_PATTERN.sub(r"<strong>\1</strong>", stripped)
+    return f"<div style='margin:4px 0;'>{formatted}</div>"
+
+
+class IncrementalArticleFormatter:
+    """
+    ストリーミング中の _format_article_html()。
+    確定した行（改行まで受信した行）のHTMLは保持しておき、受信途中の最後の行だけを毎回変換する。
+    html() の結果は、それまでに feed() した全文を _format_article_html() に渡した結果と同一。
+    """
+
+    def __init__(self):
+        self._done_html = ""  # 確定した行のHTML（各行の末尾に改行を付けて連結）
+        self._partial = ""    # 受信途中の最後の行
+
+    def feed(self, text: str):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        if lines:
+            self._done_html += "".join(_format_article_line(line) + "\n" for line in lines)
 
-    return "\n".join(html_lines)
+    def html(self) -> str:
+        return self._done_html + _format_article_line(self._partial)
@@ -0,0 +1,514 @@
+"""
+一括処理キュー（SQLite、画面と複数のワーカープロセスで共有）
+夜のうちに多数の記事をまとめて翻訳・記事生成するためのキュー。
+- 優先度の高いジョブから順に処理し、失敗したジョブは指数バックオフで再試行する
+- Geminiの利用枠（キーごとのRPM/RPD）は全プロセス共通の使用記録から判断し、
+  枠が足りないジョブは枠が戻る時刻まで後回しにする（その間も無料エンジンのジョブは進める）
+- 結果は生成記事・翻訳結果の永続ストア（src/draft_store.py）に保存し、画面で記事を開くとそのまま表示される
+
+使い方:
+    python -m src.batch_queue enqueue --kind article --priority 5 URL [URL ...]
+    python -m src.batch_queue enqueue --kind translation --engine Google URL [URL ...]
+    python -m src.batch_queue worker --processes 2
+    python -m src.batch_queue status
+APIキーは環境変数 GEMINI_API_KEY / DEEPL_API_KEY から読む（カンマ区切りで複数指定可）。
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import re
+import sys
+import time
+from typing import List, Optional
+
+from src.draft_store import _SqliteStore, DRAFT_STORE_PATH
+from src.rate_limiter import _key_id
+
+# 保存先（.gitignore 済み）。環境変数 BATCH_QUEUE_PATH で変更できる
+BATCH_QUEUE_PATH = os.environ.get(
+    "BATCH_QUEUE_PATH",
+    os.path.join(os.path.dirname(DRAFT_STORE_PATH), "queue.sqlite3"),
+)
+
+KIND_ARTICLE = "article"
+KIND_TRANSLATION = "translation"
+
+DEFAULT_MAX_ATTEMPTS = 5
+# 再試行の待ち時間: RETRY_BASE_SECONDS * 2^(試行回数-1)、上限 RETRY_MAX_SECONDS
+RETRY_BASE_SECONDS = 60.0
+RETRY_MAX_SECONDS = 3600.0
+# 実行中のまま応答の無いジョブ（ワーカーの異常終了など）は、この時間が過ぎたら再びキューに戻す
+LEASE_SECONDS = 1800.0
+# キューが空・枠待ちのときの確認間隔
+IDLE_POLL_SECONDS = 15.0
+# 使用記録の保持期間（RPDの判定に使う24時間分）
+USAGE_WINDOW_SECONDS = 86400.0
+
+_RETRY_PATTERN = re.compile(r"retry in ([0-9\.]+)s")
+
+
+class BatchQueue(_SqliteStore):
+    """
+    ジョブキューとAPI使用記録（スレッド・プロセスセーフ）
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS queue_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            url TEXT NOT NULL,
+            engine TEXT,
+            model TEXT,
+            source_lang TEXT NOT NULL DEFAULT 'auto',
+            uses_gemini INTEGER NOT NULL DEFAULT 0,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            next_run_at REAL NOT NULL,
+            lease_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_queue_jobs_ready ON queue_jobs (status, priority, next_run_at)",
+        """
+        CREATE TABLE IF NOT EXISTS api_usage (
+            engine TEXT NOT NULL,
+            key_id TEXT NOT NULL,
+            at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_api_usage ON api_usage (engine, key_id, at)",
+    ]
+
+    def __init__(self, path: str = BATCH_QUEUE_PATH):
+        super().__init__(path)
+
+    # --- ジョブ ---
+
+    def enqueue(self, kind: str, url: str, priority: int = 0, engine: Optional[str] = None,
+                model: Optional[str] = None, source_lang: str = "auto", max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+        """
+        ジョブを追加してIDを返す。
+        kind: "article"（記事生成）または "translation"（engine で翻訳）
+        source_lang: "auto" の場合は、実行時に画面の言語選択の初期値と同じ判定で決める
+        """
+        if kind not in (KIND_ARTICLE, KIND_TRANSLATION):
+            raise ValueError(f"unknown job kind: {kind}")
+        if kind == KIND_TRANSLATION and not engine:
+            raise ValueError("translation jobs need an engine")
+        uses_gemini = kind == KIND_ARTICLE or "Gemini" in (engine or "")
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO queue_jobs (kind, url, engine, model, source_lang, uses_gemini, priority, max_attempts, next_run_at, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (kind, url, engine, model, source_lang, int(uses_gemini), priority, max_attempts, now, now, now),
+                )
+                conn.commit()
+                return cursor.lastrowid
+            finally:
+                conn.close()
+
+    def claim(self, include_gemini: bool = True) -> Optional[dict]:
+        """
+        実行できるジョブのうち優先度が最も高いもの（同じなら古いもの）を取り出し、実行中にする。
+        include_gemini=False の場合はGeminiを使うジョブを除く（Geminiの枠待ちの間も他のジョブを進める）
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                # 複数プロセスが同じジョブを取らないよう、書き込みロックを取ってから選ぶ
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "UPDATE queue_jobs SET status = 'queued', lease_until = NULL, updated_at = ? WHERE status = 'running' AND lease_until < ?",
+                    (now, now),
+                )
+                row = conn.execute(
+                    "SELECT * FROM queue_jobs WHERE status = 'queued' AND next_run_at <= ?"
+                    + ("" if include_gemini else " AND uses_gemini = 0")
+                    + " ORDER BY priority DESC, id ASC LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    conn.commit()
+                    return None
+                conn.execute(
+                    "UPDATE queue_jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+                    (now + LEASE_SECONDS, now, row["id"]),
+                )
+                conn.commit()
+                job = dict(row)
+                job["attempts"] += 1
+                return job
+            finally:
+                conn.close()
+
+    def _update(self, job_id: int, sql: str, params: tuple):
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(f"UPDATE queue_jobs SET {sql}, lease_until = NULL, updated_at = ? WHERE id = ?", params + (time.time(), job_id))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def complete(self, job_id: int):
+        self._update(job_id, "status = 'done', last_error = NULL", ())
+
+    def fail(self, job_id: int, error: str, retry_after: Optional[float] = None, permanent: bool = False):
+        """
+        失敗を記録する。試行回数が上限未満なら指数バックオフ（または retry_after 秒）後に再試行する
+        """
+        job = self.get(job_id)
+        if job is None:
+            return
+        if permanent or job["attempts"] >= job["max_attempts"]:
+            self._update(job_id, "status = 'failed', last_error = ?", (error,))
+            return
+        delay = retry_after if retry_after is not None else min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1))
+        self._update(job_id, "status = 'queued', last_error = ?, next_run_at = ?", (error, time.time() + delay))
+
+    def defer(self, job_id: int, seconds: float, reason: str):
+        """
+        利用枠が戻るまで後回しにする（試行回数には数えない）
+        """
+        self._update(
+            job_id,
+            "status = 'queued', attempts = MAX(attempts - 1, 0), last_error = ?, next_run_at = ?",
+            (reason, time.time() + seconds),
+        )
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT * FROM queue_jobs WHERE id = ?", (job_id,)).fetchone()
+            finally:
+                conn.close()
+        return dict(row) if row else None
+
+    def jobs(self, limit: int = 200) -> List[dict]:
+        """
+        新しい順のジョブ一覧
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT * FROM queue_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            finally:
+                conn.close()
+        return [dict(row) for row in rows]
+
+    def counts(self) -> dict:
+        """
+        状態ごとのジョブ数 {"queued": n, "running": n, "done": n, "failed": n}
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT status, COUNT(*) AS n FROM queue_jobs GROUP BY status").fetchall()
+            finally:
+                conn.close()
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def has_ready(self) -> bool:
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT COUNT(*) AS n FROM queue_jobs WHERE status IN ('queued', 'running')").fetchone()
+            finally:
+                conn.close()
+        return row["n"] > 0
+
+    # --- API使用記録（全プロセス共通の利用枠の判定用） ---
+
+    def record_usage(self, engine: str, api_key: str = "", chars: int = 0):
+        """
+        rate_limiter.add_listener() に渡し、リクエストを送るたびに記録する（1日の上限があるエンジンのみ）
+        """
+        from src.rate_limiter import rate_limiter
+
+        if not rate_limiter.limits(engine).get("rpd"):
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute("INSERT INTO api_usage (engine, key_id, at) VALUES (?, ?, ?)", (engine, _key_id(api_key), now))
+                    conn.execute("DELETE FROM api_usage WHERE at < ?", (now - USAGE_WINDOW_SECONDS,))
+                    conn.commit()
+                finally:
+                    conn.close()
+        except Exception:
+            pass
+
+    def usage_times(self, engine: str, api_key: str, window_seconds: float) -> List[float]:
+        """
+        直近 window_seconds 秒のリクエスト時刻（古い順）
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT at FROM api_usage WHERE engine = ? AND key_id = ? AND at >= ? ORDER BY at",
+                    (engine, _key_id(api_key), time.time() - window_seconds),
+                ).fetchall()
+            finally:
+                conn.close()
+        return [row["at"] for row in rows]
+
+    def budget_wait(self, engine: str, keys: List[str], cost: int = 1) -> float:
+        """
+        全キー合計で cost 回分の1日の枠（RPD）が空くまでの秒数（今すぐ使えるなら0）
+        """
+        from src.rate_limiter import rate_limiter
+
+        rpd = rate_limiter.limits(engine).get("rpd")
+        if not rpd or not keys:
+            return 0.0
+        now = time.time()
+        remaining = 0
+        expiries = []
+        for key in keys:
+            times = self.usage_times(engine, key, USAGE_WINDOW_SECONDS)
+            remaining += max(0, rpd - len(times))
+            # 古い記録から順に24時間で枠が戻る
+            expiries.extend(at + USAGE_WINDOW_SECONDS - now for at in times[: max(0, len(times) - rpd + 1)])
+        if remaining >= cost:
+            return 0.0
+        expiries.sort()
+        needed = cost - remaining
+        if not expiries:
+            return IDLE_POLL_SECONDS
+        return max(IDLE_POLL_SECONDS, expiries[min(len(expiries), needed) - 1])
+
+
+# プロセス全体で共有するインスタンス（画面からの登録・状態表示と使用記録に使う）
+batch_queue = BatchQueue()
+
+
+def _parse_retry_seconds(message: str) -> Optional[float]:
+    match = _RETRY_PATTERN.search(message or "")
+    return float(match.group(1)) if match else None
+
+
+def estimate_gemini_requests(job: dict, article) -> int:
+    """
+    ジョブが使うGeminiのリクエスト数の見積もり（枠の判定用）
+    """
+    from src.article_generator import MAP_CHUNK_TOKENS, MAP_REDUCE_THRESHOLD_TOKENS
+    from src.translator import GEMINI_CHUNK_TOKEN_BUDGET
+    from src.utils import estimate_tokens, plan_token_chunks
+
+    texts = [p["text"] for p in article.structured_html_parts]
+    if job["kind"] == KIND_ARTICLE:
+        if estimate_tokens("\n\n".join(texts)) > MAP_REDUCE_THRESHOLD_TOKENS:
+            return len(plan_token_chunks(texts, MAP_CHUNK_TOKENS)) + 1
+        return 1
+    return len(plan_token_chunks(texts + [article.title or ""], GEMINI_CHUNK_TOKEN_BUDGET))
+
+
+def process_job(queue: BatchQueue, job: dict, gemini_api_key: str, deepl_api_key: str):
+    """
+    1件のジョブを実行し、結果を永続ストアに保存してキューの状態を更新する
+    """
+    from src.article_generator import generate_article
+    from src.draft_store import draft_store, draft_key, translation_store
+    from src.jobs import job_manager
+    from src.key_pool import is_quota_error, parse_api_keys
+    from src.result_cache import translation_cache_key
+    from src.scraper import load_article_v9
+    from src.translator import translate_paragraphs, is_missing_translation
+    from src.utils import default_source_lang
+
+    if job["uses_gemini"] and not gemini_api_key:
+        queue.fail(job["id"], "GEMINI_API_KEY が設定されていません", permanent=True)
+        return
+    if job["engine"] == "DeepL" and not deepl_api_key:
+        queue.fail(job["id"], "DEEPL_API_KEY が設定されていません", permanent=True)
+        return
+
+    article = load_article_v9(job["url"])
+    if article is None or not article.structured_html_parts:
+        queue.fail(job["id"], "記事の本文を取得できませんでした")
+        return
+
+    model_name = job["model"] or "gemini-2.5-flash"
+    if job["uses_gemini"]:
+        cost = estimate_gemini_requests(job, article)
+        wait = queue.budget_wait("Gemini", parse_api_keys(gemini_api_key), cost)
+        if wait > 0:
+            queue.defer(job["id"], wait, f"Geminiの利用枠待ち（{cost} リクエスト分）")
+            return
+
+    if job["kind"] == KIND_ARTICLE:
+        chinese_text = "\n\n".join(p["text"] for p in article.structured_html_parts)
+        result = generate_article(
+            chinese_text=chinese_text,
+            gemini_api_key=gemini_api_key,
+            model_name=model_name,
+            article_title=article.title,
+            publisher=article.publisher,
+        )
+        if not result or result.startswith("[エラー]"):
+            error = result or "空の応答"
+            if is_quota_error(error):
+                queue.defer(job["id"], _parse_retry_seconds(error) or RETRY_BASE_SECONDS, error)
+            else:
+                queue.fail(job["id"], error)
+            return
+        draft_store.save(draft_key(chinese_text, article.title, article.publisher, model_name), result, source_url=job["url"], title=article.title)
+        queue.complete(job["id"])
+        return
+
+    # 言語が指定されていない場合は、画面の言語選択の初期値と同じ判定で決める
+    # （画面は選択中の言語を含むキーで保存済みの翻訳を探すため）
+    source_lang = job["source_lang"]
+    if source_lang == "auto":
+        source_lang = default_source_lang(article.text, job["url"])
+
+    # 翻訳: 画面と同じくジョブとして実行する（エラーバナーなどのセッション状態に触れないため）
+    translation = job_manager.submit("batch_translation", lambda j: translate_paragraphs(
+        article.structured_html_parts,
+        engine_name=job["engine"],
+        source_lang=source_lang,
+        deepl_api_key=deepl_api_key,
+        gemini_api_key=gemini_api_key,
+        output_placeholder=j.placeholder("output"),
+        progress_placeholder=j.placeholder("progress"),
+        status_placeholder=j.placeholder("status"),
+        model_name=model_name,
+        hedge=False,
+        title=article.title,
+    ))
+    translation.wait()
+    job_manager.discard(translation.id)
+    if translation.status != "done":
+        queue.fail(job["id"], translation.error or "翻訳に失敗しました")
+        return
+    results, translated_title = translation.result
+    missing = [item for item in results if is_missing_translation(item)]
+    if missing:
+        retry_after = next((item.get("retry_after") for item in missing if item.get("retry_after") is not None), None)
+        queue.fail(job["id"], f"{len(missing)} 段落が未翻訳です", retry_after=retry_after)
+        return
+    translation_store.save(
+        translation_cache_key(job["url"], job["engine"], model_name, source_lang),
+        results,
+        translated_title,
+    )
+    queue.complete(job["id"])
+
+
+def run_worker(process_count: int = 1, drain: bool = False):
+    """
+    キューからジョブを取り出して実行し続ける（drain=True ならキューが空になったら終了する）。
+    process_count: 同時に動かすワーカープロセス数。1分あたりの上限（RPM/CPM）をプロセス数で分け合う
+    """
+    from src.key_pool import parse_api_keys
+    from src.rate_limiter import rate_limiter, configure_rate_limits, DEFAULT_RATE_LIMITS
+
+    try:
+        import streamlit as st
+        configure_rate_limits(st.secrets.get("rate_limits"))
+    except Exception:
+        pass
+    if process_count > 1:
+        for engine in DEFAULT_RATE_LIMITS:
+            limits = rate_limiter.limits(engine)
+            rate_limiter.configure(engine, **{
+                name: max(1, math.floor(limits[name] / process_count))
+                for name in ("rpm", "cpm") if limits.get(name)
+            })
+
+    queue = batch_queue
+    rate_limiter.add_listener(queue.record_usage)
+    gemini_api_key = os.environ.get("GEMINI_API_KEY", "")
+    deepl_api_key = os.environ.get("DEEPL_API_KEY", "")
+    gemini_keys = parse_api_keys(gemini_api_key)
+
+    while True:
+        # Geminiの1日の枠が残っていなければ、Geminiを使わないジョブだけを取り出す
+        include_gemini = not gemini_keys or queue.budget_wait("Gemini", gemini_keys) == 0
+        job = queue.claim(include_gemini=include_gemini)
+        if job is None:
+            if drain and not queue.has_ready():
+                return
+            time.sleep(IDLE_POLL_SECONDS)
+            continue
+        print(f"[batch] #{job['id']} {job['kind']} {job['url']} (attempt {job['attempts']})", flush=True)
+        try:
+            process_job(queue, job, gemini_api_key, deepl_api_key)
+        except Exception as e:
+            queue.fail(job["id"], f"{type(e).__name__}: {e}")
+        finished = queue.get(job["id"])
+        print(f"[batch] #{job['id']} -> {finished['status']}" + (f" ({finished['last_error']})" if finished["last_error"] else ""), flush=True)
+
+
+def _run_worker_process(process_count: int, drain: bool):
+    run_worker(process_count, drain)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m src.batch_queue", description="翻訳・記事生成の一括処理キュー")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = sub.add_parser("enqueue", help="ジョブを追加する")
+    enqueue.add_argument("urls", nargs="+")
+    enqueue.add_argument("--kind", choices=[KIND_ARTICLE, KIND_TRANSLATION], default=KIND_ARTICLE)
+    enqueue.add_argument("--engine", help="翻訳エンジン（Google / MyMemory / DeepL / \"Gemini (モデル名)\"）")
+    enqueue.add_argument("--model", default="gemini-2.5-flash", help="Geminiのモデル名")
+    enqueue.add_argument("--source-lang", default="auto", help="元記事の言語（auto なら画面と同じく本文から判定する）")
+    enqueue.add_argument("--priority", type=int, default=0, help="大きいほど先に処理する")
+
+    worker = sub.add_parser("worker", help="ワーカーを起動する")
+    worker.add_argument("--processes", type=int, default=1)
+    worker.add_argument("--drain", action="store_true", help="キューが空になったら終了する")
+
+    sub.add_parser("status", help="ジョブの状態を表示する")
+
+    args = parser.parse_args(argv)
+    queue = batch_queue
+
+    if args.command == "enqueue":
+        if args.kind == KIND_TRANSLATION and not args.engine:
+            parser.error("--kind translation には --engine が必要です")
+        for url in args.urls:
+            job_id = queue.enqueue(args.kind, url, priority=args.priority, engine=args.engine, model=args.model, source_lang=args.source_lang)
+            print(f"#{job_id} {args.kind} {url}")
+    elif args.command == "worker":
+        if args.processes <= 1:
+            run_worker(1, args.drain)
+        else:
+            processes = [
+                multiprocessing.Process(target=_run_worker_process, args=(args.processes, args.drain))
+                for _ in range(args.processes)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+    else:
+        counts = queue.counts()
+        print(" / ".join(f"{status}: {n}" for status, n in counts.items()))
+        for job in queue.jobs(50):
+            next_run = time.strftime("%m-%d %H:%M", time.localtime(job["next_run_at"]))
+            print(f"#{job['id']:<5} {job['status']:<8} p{job['priority']:<3} {job['kind']:<11} try {job['attempts']}/{job['max_attempts']} next {next_run} {job['url']}"
+                  + (f"  ({job['last_error']})" if job["last_error"] else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+AIMD方式の適応的な同時実行数コントローラー（プロセス全体でエンジンごとに共有）
+レイテンシが安定している間は同時実行数を少しずつ増やし、
+429・5xx・タイムアウトが返ってきたら半分に減らす。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+# 名前ごとの (初期値, 最小値, 最大値)。最大値はスレッドプールの大きさにも使う。
+ADAPTIVE_DEFAULTS = {
+    "Google": (4, 1, 16),
+    "MyMemory": (2, 1, 8),
+    "DeepL": (2, 1, 8),
+    "Gemini": (2, 1, 6),
+    "image": (6, 2, 16),
+    "OCR": (2, 1, 6),
+}
+FALLBACK_DEFAULT = (2, 1, 4)
+
+OUTCOME_OK = "ok"
+OUTCOME_THROTTLED = "throttled"  # 429 / quota
+OUTCOME_ERROR = "error"          # 5xx / 接続エラー
+OUTCOME_TIMEOUT = "timeout"
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD (Additive Increase / Multiplicative Decrease) で同時実行数の上限を調整する。
+    - 成功かつレイテンシが基準の latency_tolerance 倍以内: 上限を 1/limit ずつ増やす（約1往復で+1）
+    - 429 / 5xx / タイムアウト: 上限を decrease 倍にする（cooldown 秒に1回まで）
+    """
+
+    def __init__(self, name: str, initial: int = 2, min_limit: int = 1, max_limit: int = 8,
+                 decrease: float = 0.5, latency_tolerance: float = 1.5, cooldown: float = 2.0):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial)
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= max(self.min_limit, int(self.limit)):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, outcome: str, latency: float):
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == OUTCOME_OK:
+                self._record_latency(latency)
+                if self.latency_ewma <= self.baseline_latency * self.latency_tolerance:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+    def _record_latency(self, latency: float):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+            self.baseline_latency = latency
+            return
+        self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+        # 基準値は観測した最小値。回線状況の変化に追従できるよう少しずつ引き上げる
+        self.baseline_latency = min(self.baseline_latency * 1.01, self.latency_ewma)
+
+    @contextmanager
+    def slot(self):
+        """
+        with limiter.slot() as slot:
+            result = call_api()
+            slot.outcome = classify(result)
+        例外が発生した場合はメッセージから分類する（429 → throttled、タイムアウト → timeout、その他 → error）。
+        """
+        self.acquire()
+        handle = _SlotHandle()
+        started = time.monotonic()
+        try:
+            yield handle
+        except Exception as e:
+            outcome = classify_message(f"{type(e).__name__}: {e}")
+            handle.outcome = outcome if outcome != OUTCOME_OK else OUTCOME_ERROR
+            raise
+        finally:
+            self.release(handle.outcome, time.monotonic() - started)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "latency_ewma": self.latency_ewma,
+                "baseline_latency": self.baseline_latency,
+            }
+
+
+class _SlotHandle:
+    def __init__(self):
+        self.outcome = OUTCOME_OK
+
+
+_limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> AdaptiveConcurrencyLimiter:
+    """
+    名前（エンジン名・"image"・"OCR"）ごとのコントローラーを返す（プロセス全体で共有）
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            initial, min_limit, max_limit = ADAPTIVE_DEFAULTS.get(name, FALLBACK_DEFAULT)
+            _limiters[name] = AdaptiveConcurrencyLimiter(name, initial, min_limit, max_limit)
+        return _limiters[name]
+
+
+def classify_status_code(status_code: int) -> str:
+    if status_code == 429:
+        return OUTCOME_THROTTLED
+    if status_code >= 500:
+        return OUTCOME_ERROR
+    return OUTCOME_OK
+
+
+def classify_message(message: str) -> str:
+    """
+    エラーメッセージやエンジン表示（"DeepL (Error: 429 - ...)" など）から結果を分類する
+    """
+    if not message:
+        return OUTCOME_OK
+    lowered = message.lower()
+    if "429" in lowered or "quota" in lowered or "too many requests" in lowered:
+        return OUTCOME_THROTTLED
+    if "timeout" in lowered or "timed out" in lowered:
+        return OUTCOME_TIMEOUT
+    if "error" in lowered or "failed" in lowered or "fallback" in lowered:
+        return OUTCOME_ERROR
+    return OUTCOME_OK
+
+
+def thread_initializer():
+    """
+    ThreadPoolExecutor(initializer=...) 用。ワーカースレッドに現在のスクリプト実行コンテキストを引き継ぎ、
+    st.cache_data などをスレッド内から呼べるようにする。
+    """
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return lambda: None
+
+    ctx = get_script_run_ctx()
+
+    def initializer():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    return initializer
@@ -0,0 +1,403 @@
+"""
+文章比較用の差分エンジン
+difflib.SequenceMatcher は繰り返しの多い長文で極端に遅くなるため、
+文を整数の指紋に置き換えたうえで patience diff（両方に1回だけ現れる文を目印に分割）を行い、
+目印の無い区間だけを Myers の O(ND) 差分で埋める。
+置換（replace）区間の文どうしは文字単位でも差分を取り、変更箇所だけを強調できるようにする。
+結果は (text_a, text_b) のハッシュの組でメモ化する（Streamlitの再実行ごとに計算し直さない）。
+
+ベンチマーク: python -m src.diff_engine
+"""
+import hashlib
+import inspect
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# (tag, i1, i2, j1, j2)。SequenceMatcher.get_opcodes() と同じ形式
+Opcode = Tuple[str, int, int, int, int]
+
+# 文の区切り（句点・感嘆符・疑問符・改行）。区切り記号自体も1要素として残す
+SENTENCE_SPLIT_PATTERN = re.compile(r'([。！？\n]+)')
+
+# Myers の探索を打ち切る編集距離。超えた区間は丸ごと置換として扱う
+MYERS_MAX_EDIT_DISTANCE = 2000
+# 文字単位の差分を取る文の最大長（長すぎる場合は文全体を置換として扱う）
+INLINE_DIFF_MAX_CHARS = 2000
+# 文字単位の差分で探索を打ち切る編集距離（書き換えられた長い文で時間をかけず、文全体を置換として扱う）
+INLINE_MAX_EDIT_DISTANCE = 300
+# メモ化する組の数
+MEMO_MAX_ENTRIES = 64
+
+
+def memoize_by_text_hash(maxsize: int = MEMO_MAX_ENTRIES):
+    """
+    文字列引数のハッシュの組をキーにしたLRUメモ化（スレッドセーフ）。
+    長い本文そのものをキーとして保持・比較しないよう、SHA-1 のダイジェストだけを使う。
+    キーワード引数も使える（引数を関数のシグネチャに当てはめ、既定値を補ってからキーにするため、
+    位置引数・キーワード引数・既定値のどの渡し方でも同じ呼び出しは同じキーになる）。
+    """
+    def decorator(fn: Callable):
+        cache: "OrderedDict[tuple, object]" = OrderedDict()
+        lock = threading.Lock()
+        signature = inspect.signature(fn)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(
+                (name, hashlib.sha1(value.encode("utf-8")).hexdigest() if isinstance(value, str) else value)
+                for name, value in bound.arguments.items()
+            )
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return cache[key]
+            result = fn(*bound.args, **bound.kwargs)
+            with lock:
+                cache[key] = result
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_SPLIT_PATTERN.split(text or "") if s.strip()]
+
+
+def _fingerprints(a: Sequence[str], b: Sequence[str]) -> Tuple[List[int], List[int]]:
+    """
+    同じ文に同じ整数を割り当てる（以降の比較は整数どうしで行う）
+    """
+    ids = {}
+    a_ids = [ids.setdefault(s, len(ids)) for s in a]
+    b_ids = [ids.setdefault(s, len(ids)) for s in b]
+    return a_ids, b_ids
+
+
+def _middle_snake(a: Sequence, b: Sequence, alo: int, ahi: int, blo: int, bhi: int, max_d: int) -> Optional[Tuple[int, int, int, int]]:
+    """
+    区間の最短編集経路の中央にある斜線（一致の連続）を、先頭からと末尾からの探索が重なる位置として求める。
+    Returns: 斜線の始点と終点 (x, y, u, v)（絶対位置）。編集距離が max_d を超える場合はNone
+    """
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta % 2 != 0
+    limit = (min(max_d, n + m) + 1) // 2 + 1
+    offset = limit + 1
+    # forward[k]: 先頭からの探索で対角線 k 上に到達した x。backward[k]: 末尾からの探索で（逆向きの座標で）到達した x
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    for d in range(limit):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[offset + delta - k] >= n:
+                if 2 * d - 1 > max_d:
+                    return None
+                return alo + start_x, blo + start_y, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                if 2 * d > max_d:
+                    return None
+                return ahi - x, bhi - y, ahi - start_x, bhi - start_y
+    return None
+
+
+def _myers_matches(a: Sequence, b: Sequence, max_d: int = MYERS_MAX_EDIT_DISTANCE) -> Optional[List[Tuple[int, int]]]:
+    """
+    Myers の O(ND) 差分で一致する要素の位置 (i, j) を先頭から順に返す。
+    編集距離が max_d を超える場合はNone。
+    探索の途中経過を保持せず、中央の斜線で区間を分割していくため、メモリは O(N+M) で済む。
+    """
+    matches = []
+    # (alo, ahi, blo, bhi) の区間、または確定した一致 (i, j) を積む
+    stack: List[tuple] = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if len(item) == 2:
+            matches.append(item)
+            continue
+        alo, ahi, blo, bhi = item
+        # 先頭・末尾の共通部分を取り除く（残った区間は編集距離が2以上になり、分割で必ず小さくなる）
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        suffix = []
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            suffix.append((ahi, bhi))
+        stack.extend(suffix)
+        if alo >= ahi or blo >= bhi:
+            continue
+
+        # 編集距離の上限は最初の区間（全体）でだけ確認する。分割後の区間の編集距離は全体より小さい
+        snake = _middle_snake(a, b, alo, ahi, blo, bhi, max_d)
+        if snake is None:
+            return None
+        max_d = len(a) + len(b)
+        x, y, u, v = snake
+        stack.append((u, ahi, v, bhi))
+        stack.extend((x + step, y + step) for step in range(u - x - 1, -1, -1))
+        stack.append((alo, x, blo, y))
+    return matches
+
+
+def _unique_common_anchors(a: Sequence[int], b: Sequence[int], alo: int, ahi: int, blo: int, bhi: int) -> List[Tuple[int, int]]:
+    """
+    区間内で両方に1回だけ現れる要素のうち、順序が一致する最長の並び（最長増加部分列）を返す
+    """
+    positions = {}
+    for i in range(alo, ahi):
+        entry = positions.get(a[i])
+        positions[a[i]] = [i, None, 0] if entry is None else [None, None, 0]
+    for j in range(blo, bhi):
+        entry = positions.get(b[j])
+        if entry is not None and entry[0] is not None:
+            entry[1] = j
+            entry[2] += 1
+    pairs = sorted((i, j) for i, j, count in positions.values() if i is not None and count == 1)
+    if not pairs:
+        return []
+
+    # patience sorting による最長増加部分列（j について）
+    tails: List[int] = []
+    tail_indices: List[int] = []
+    previous = [-1] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos > 0:
+            previous[index] = tail_indices[pos - 1]
+        if pos == len(tails):
+            tails.append(j)
+            tail_indices.append(index)
+        else:
+            tails[pos] = j
+            tail_indices[pos] = index
+    anchors = []
+    index = tail_indices[-1]
+    while index >= 0:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _patience_matches(a: Sequence[int], b: Sequence[int]) -> List[Tuple[int, int]]:
+    """
+    patience diff で一致する要素の位置 (i, j) を先頭から順に返す（再帰の代わりに明示的なスタックを使う）
+    """
+    matches = []
+    # (alo, ahi, blo, bhi) の区間、または確定した一致 (i, j) を積む
+    stack: List[tuple] = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if len(item) == 2:
+            matches.append(item)
+            continue
+        alo, ahi, blo, bhi = item
+        # 先頭・末尾の共通部分を取り除く
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        suffix = []
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            suffix.append((ahi, bhi))
+        # 後で処理する順（スタックなので逆順）に積む
+        for pair in suffix:
+            stack.append(pair)
+        if alo >= ahi or blo >= bhi:
+            continue
+
+        anchors = _unique_common_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            segments = []
+            prev_i, prev_j = alo, blo
+            for i, j in anchors:
+                segments.append((prev_i, i, prev_j, j))
+                segments.append((i, j))
+                prev_i, prev_j = i + 1, j + 1
+            segments.append((prev_i, ahi, prev_j, bhi))
+            stack.extend(reversed(segments))
+        else:
+            sub = _myers_matches(a[alo:ahi], b[blo:bhi])
+            # 編集距離が大きすぎる区間は一致なし（丸ごと置換）とする
+            matches.extend((alo + i, blo + j) for i, j in (sub or []))
+    return matches
+
+
+def _opcodes_from_matches(matches: List[Tuple[int, int]], n: int, m: int) -> List[Opcode]:
+    opcodes: List[Opcode] = []
+    i = j = 0
+    for mi, mj in matches + [(n, m)]:
+        if i < mi and j < mj:
+            opcodes.append(("replace", i, mi, j, mj))
+        elif i < mi:
+            opcodes.append(("delete", i, mi, j, j))
+        elif j < mj:
+            opcodes.append(("insert", i, i, j, mj))
+        if mi < n and mj < m:
+            if opcodes and opcodes[-1][0] == "equal" and opcodes[-1][2] == mi:
+                tag, i1, _, j1, _ = opcodes[-1]
+                opcodes[-1] = ("equal", i1, mi + 1, j1, mj + 1)
+            else:
+                opcodes.append(("equal", mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return opcodes
+
+
+def diff_opcodes(a: Sequence[str], b: Sequence[str]) -> List[Opcode]:
+    """
+    文のリストどうしの差分（SequenceMatcher(None, a, b).get_opcodes() の置き換え）
+    """
+    a_ids, b_ids = _fingerprints(a, b)
+    return _opcodes_from_matches(_patience_matches(a_ids, b_ids), len(a), len(b))
+
+
+def inline_opcodes(a: str, b: str) -> List[Opcode]:
+    """
+    置換された文どうしの文字単位の差分。長すぎる場合・編集距離が大きすぎる場合は全体を置換とする
+    """
+    if len(a) > INLINE_DIFF_MAX_CHARS or len(b) > INLINE_DIFF_MAX_CHARS:
+        return [("replace", 0, len(a), 0, len(b))] if a != b else [("equal", 0, len(a), 0, len(b))]
+    matches = _myers_matches(a, b, max_d=INLINE_MAX_EDIT_DISTANCE)
+    if matches is None:
+        return [("replace", 0, len(a), 0, len(b))]
+    return _opcodes_from_matches(matches, len(a), len(b))
+
+
+def grouped_opcodes(opcodes: List[Opcode], context: int = 3) -> List[List[Opcode]]:
+    """
+    変更箇所ごとに前後 context 文の一致部分だけを残したハンクに分ける（unified diff と同じ考え方。
+    SequenceMatcher.get_grouped_opcodes() 相当）。変更が無い場合は空リスト。
+    """
+    if not any(tag != "equal" for tag, *_ in opcodes):
+        return []
+    codes = list(opcodes)
+    # 先頭・末尾の一致部分は context 文だけ残す
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    groups: List[List[Opcode]] = []
+    group: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in codes:
+        # 長い一致部分はハンクの区切りにする（前のハンクの後ろと次のハンクの前に context 文ずつ残す）
+        if tag == "equal" and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        groups.append(group)
+    # context=0 の場合に生じる空の一致を取り除く
+    return [[op for op in g if op[1] != op[2] or op[3] != op[4]] for g in groups]
+
+
+@memoize_by_text_hash()
+def diff_sentences(text_a: str, text_b: str) -> Tuple[List[str], List[str], List[Opcode]]:
+    """
+    2つの本文を文に分割して差分を取る（ハッシュの組でメモ化）
+    Returns: (文のリストA, 文のリストB, opcodes)
+    """
+    s_a = split_sentences(text_a)
+    s_b = split_sentences(text_b)
+    return s_a, s_b, diff_opcodes(s_a, s_b)
+
+
+def _benchmark_texts(sentence_count: int = 3000, seed: int = 7) -> Tuple[str, str]:
+    """
+    ベンチマーク用の転載記事（定型文の繰り返しが多く、一部の文が編集・追加・削除されたもの）
+    """
+    import random
+
+    rng = random.Random(seed)
+    boilerplate = [f"定型文{i}です" for i in range(40)]
+    sentences = []
+    for i in range(sentence_count):
+        sentences.append(rng.choice(boilerplate) if rng.random() < 0.3 else f"第{i}文の内容は{rng.randint(0, 10 ** 6)}です")
+    republished = []
+    for s in sentences:
+        r = rng.random()
+        if r < 0.03:
+            continue
+        if r < 0.08:
+            republished.append(s.replace("内容", "記述"))
+        else:
+            republished.append(s)
+        if rng.random() < 0.02:
+            republished.append(f"転載時の追記{rng.randint(0, 10 ** 6)}です")
+    return "。".join(sentences) + "。", "。".join(republished) + "。"
+
+
+def benchmark(sentence_count: int = 3000):
+    """
+    SequenceMatcher（従来の実装）と比較して処理時間を表示する
+    """
+    from difflib import SequenceMatcher
+
+    text_a, text_b = _benchmark_texts(sentence_count)
+    s_a, s_b = split_sentences(text_a), split_sentences(text_b)
+
+    started = time.perf_counter()
+    reference = SequenceMatcher(None, s_a, s_b).get_opcodes()
+    difflib_seconds = time.perf_counter() - started
+
+    diff_sentences.cache_clear()
+    started = time.perf_counter()
+    _, _, opcodes = diff_sentences(text_a, text_b)
+    engine_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    diff_sentences(text_a, text_b)
+    memo_seconds = time.perf_counter() - started
+
+    def equal_count(ops):
+        return sum(i2 - i1 for tag, i1, i2, _, _ in ops if tag == "equal")
+
+    print(f"sentences: {len(s_a)} / {len(s_b)}")
+    print(f"SequenceMatcher : {difflib_seconds * 1000:9.1f} ms  (equal: {equal_count(reference)})")
+    print(f"patience/Myers  : {engine_seconds * 1000:9.1f} ms  (equal: {equal_count(opcodes)})")
+    print(f"memoized        : {memo_seconds * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,251 @@
+"""
+生成記事・翻訳結果の永続保存（SQLite、プロセス全体で共有）
+記事生成は最も高価なGemini呼び出しのため、生成した下書きをディスクに保存し、
+同じ記事を開き直したときは再生成せずに最新の下書きを表示する。
+キーは (原文のハッシュ, モデル名, プロンプトのハッシュ)。原文やプロンプトが変われば別の下書きになる。
+再生成した場合も古い下書きは残し、バージョン履歴として選べるようにする。
+一括処理キュー（src/batch_queue.py）で翻訳した結果も、画面から使えるようにここへ保存する。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from src.article_generator import ARTICLE_GENERATION_PROMPT, FACT_EXTRACTION_PROMPT
+
+# 保存先（.gitignore 済み）。環境変数 DRAFT_STORE_PATH で変更できる
+DRAFT_STORE_PATH = os.environ.get(
+    "DRAFT_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".data", "drafts.sqlite3"),
+)
+TRANSLATION_STORE_PATH = os.environ.get(
+    "TRANSLATION_STORE_PATH",
+    os.path.join(os.path.dirname(DRAFT_STORE_PATH), "translations.sqlite3"),
+)
+# 1つの記事について保持するバージョン数（古いものから削除する）
+DRAFT_HISTORY_LIMIT = 20
+
+# 長文向けの map-reduce のプロンプトも含める（どちらかが変われば別の下書きになる）
+PROMPT_HASH = hashlib.sha256((ARTICLE_GENERATION_PROMPT + FACT_EXTRACTION_PROMPT).encode("utf-8")).hexdigest()[:16]
+
+
+def draft_key(chinese_text: str, article_title: str, publisher: str, model_name: str) -> tuple:
+    """
+    下書きのキー (原文のハッシュ, モデル名, プロンプトのハッシュ)。
+    原文のハッシュにはプロンプトに埋め込むタイトル・媒体名も含める。
+    """
+    source = "\0".join([article_title or "", publisher or "", chinese_text or ""])
+    source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    return (source_hash, model_name, PROMPT_HASH)
+
+
+class _SqliteStore:
+    """
+    初回接続時にスキーマを作成するSQLiteストアの共通部分。
+    ディスクに書き込めない環境では何もしない（保存・読み出しの失敗で翻訳・記事生成を止めない）。
+    """
+
+    SCHEMA: List[str] = []
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._initialized = True
+        return conn
+
+
+class DraftStore(_SqliteStore):
+    """
+    生成記事のバージョン履歴をSQLiteに保存する（スレッドセーフ）
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS drafts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_hash TEXT NOT NULL,
+            source_url TEXT,
+            title TEXT,
+            text TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_drafts_key ON drafts (source_hash, model, prompt_hash, created_at)",
+    ]
+
+    def __init__(self, path: str = DRAFT_STORE_PATH):
+        super().__init__(path)
+
+    def save(self, key: tuple, text: str, source_url: str = "", title: str = "") -> Optional[int]:
+        """
+        新しいバージョンとして保存し、そのIDを返す（保存できなかった場合はNone）
+        """
+        source_hash, model, prompt_hash = key
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    cursor = conn.execute(
+                        "INSERT INTO drafts (source_hash, model, prompt_hash, source_url, title, text, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (source_hash, model, prompt_hash, source_url, title, text, time.time()),
+                    )
+                    # 古いバージョンを削除する
+                    conn.execute(
+                        """
+                        DELETE FROM drafts WHERE source_hash = ? AND model = ? AND prompt_hash = ? AND id NOT IN (
+                            SELECT id FROM drafts WHERE source_hash = ? AND model = ? AND prompt_hash = ?
+                            ORDER BY created_at DESC, id DESC LIMIT ?
+                        )
+                        """,
+                        (source_hash, model, prompt_hash, source_hash, model, prompt_hash, DRAFT_HISTORY_LIMIT),
+                    )
+                    conn.commit()
+                    return cursor.lastrowid
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            return None
+
+    def history(self, key: tuple) -> List[dict]:
+        """
+        保存済みのバージョンを新しい順に返す
+        各要素: {"id", "text", "created_at", "source_url", "title"}
+        """
+        source_hash, model, prompt_hash = key
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    rows = conn.execute(
+                        "SELECT id, text, created_at, source_url, title FROM drafts "
+                        "WHERE source_hash = ? AND model = ? AND prompt_hash = ? ORDER BY created_at DESC, id DESC",
+                        (source_hash, model, prompt_hash),
+                    ).fetchall()
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            return []
+        return [dict(row) for row in rows]
+
+    def latest(self, key: tuple) -> Optional[dict]:
+        versions = self.history(key)
+        return versions[0] if versions else None
+
+    def latest_by_url(self, source_url: str) -> Optional[dict]:
+        """
+        その記事URLで最後に保存した下書き（現在のプロンプトのもの。モデルは問わない）
+        類似記事の下書きを提示するために使う
+        """
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    row = conn.execute(
+                        "SELECT id, text, created_at, source_url, title, model FROM drafts "
+                        "WHERE source_url = ? AND prompt_hash = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+                        (source_url, PROMPT_HASH),
+                    ).fetchone()
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            return None
+        return dict(row) if row else None
+
+
+class TranslationStore(_SqliteStore):
+    """
+    翻訳結果（段落ごとの結果リストとタイトル訳）をSQLiteに保存する（スレッドセーフ）。
+    キーは共有キャッシュと同じ translation_cache_key()。同じキーは最新の結果で上書きする。
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS translations (
+            cache_key TEXT PRIMARY KEY,
+            results TEXT NOT NULL,
+            title TEXT,
+            created_at REAL NOT NULL
+        )
+        """,
+    ]
+
+    def __init__(self, path: str = TRANSLATION_STORE_PATH):
+        super().__init__(path)
+
+    def save(self, key: tuple, results: List[dict], translated_title: str):
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO translations (cache_key, results, title, created_at) VALUES (?, ?, ?, ?)",
+                        (json.dumps(key, ensure_ascii=False), json.dumps(results, ensure_ascii=False), translated_title, time.time()),
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            pass
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """
+        保存済みの (翻訳結果リスト, タイトル訳)。無ければNone
+        """
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    row = conn.execute(
+                        "SELECT results, title FROM translations WHERE cache_key = ?",
+                        (json.dumps(key, ensure_ascii=False),),
+                    ).fetchone()
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            return None
+        if row is None:
+            return None
+        return json.loads(row["results"]), row["title"]
+
+    def find_by_url(self, src_url: str) -> List[tuple]:
+        """
+        その記事URLの保存済みの翻訳を新しい順に返す（エンジン・言語は問わない）
+        各要素: (キー, 翻訳結果リスト, タイトル訳)
+        """
+        # キーは translation_cache_key() の JSON のため、先頭の ["translation", URL, で絞り込む
+        prefix = json.dumps(["translation", src_url], ensure_ascii=False)[:-1] + ","
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    rows = conn.execute(
+                        "SELECT cache_key, results, title FROM translations WHERE substr(cache_key, 1, ?) = ? ORDER BY created_at DESC",
+                        (len(prefix), prefix),
+                    ).fetchall()
+                finally:
+                    conn.close()
+        except (sqlite3.Error, OSError):
+            return []
+        return [(tuple(json.loads(row["cache_key"])), json.loads(row["results"]), row["title"]) for row in rows]
+
+
+# プロセス全体で共有するインスタンス
+draft_store = DraftStore()
+translation_store = TranslationStore()
@@ -0,0 +1,168 @@
+"""
+翻訳エンジンごとの稼働状況の記録（プロセス全体で共有）
+- 直近のレイテンシからp90を求め、ヘッジ（応答が遅いリクエストを別エンジンにも投げる）の判断に使う
+- 直近の成功率と利用上限（429）の状態から、障害中のエンジンをルーターが飛ばす
+"""
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+# 直近何件のレイテンシを保持するか
+LATENCY_WINDOW = 50
+# p90を信用するための最小サンプル数（それまでは既定の待ち時間を使う）
+MIN_LATENCY_SAMPLES = 5
+DEFAULT_HEDGE_DELAY = 2.0
+
+# 成功率の判定に使う直近の結果数と有効期間（古い結果は無視する）
+OUTCOME_WINDOW = 20
+OUTCOME_MAX_AGE_SECONDS = 300.0
+MIN_OUTCOME_SAMPLES = 3
+# 成功率がこれ未満なら障害中（down）、DEGRADED未満なら不安定（degraded）
+DOWN_SUCCESS_RATE = 0.2
+DEGRADED_SUCCESS_RATE = 0.8
+# 障害中のエンジンにも、この間隔で1回だけ試しに送って復旧を検知する
+PROBE_INTERVAL_SECONDS = 30.0
+# "retry in XXs" が取れない429の場合に利用上限中とみなす秒数
+DEFAULT_QUOTA_COOLDOWN = 60.0
+
+STATUS_BADGES = {
+    "healthy": "🟢",
+    "degraded": "🟡",
+    "down": "🔴",
+    "quota": "⏳",
+    "unknown": "",
+}
+
+_RETRY_PATTERN = re.compile(r"retry in ([0-9\.]+)s")
+
+
+class EngineHealth:
+    """
+    エンジンごとのレイテンシ履歴・成功率・利用上限の状態とヘッジ結果を管理する（スレッドセーフ）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self._hedge_wins: Dict[str, Dict[str, int]] = {}
+        self._outcomes: Dict[str, deque] = {}
+        self._quota_until: Dict[str, float] = {}
+        self._last_attempt: Dict[str, float] = {}
+
+    def record_latency(self, engine: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(engine, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def latency_percentile(self, engine: str, percentile: float = 0.9) -> Optional[float]:
+        """
+        直近のレイテンシのパーセンタイル（サンプル不足の場合はNone）
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(engine, ()))
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def hedge_delay(self, engine: str) -> float:
+        """
+        この秒数を過ぎても応答が無ければヘッジを送る（p90、サンプル不足なら既定値）
+        """
+        p90 = self.latency_percentile(engine, 0.9)
+        return p90 if p90 is not None else DEFAULT_HEDGE_DELAY
+
+    def record_hedge(self, engine: str, winner: str):
+        """
+        ヘッジを送ったリクエストで先に返ったほうを記録する
+        winner: "primary"（元のエンジン）または副エンジン名
+        """
+        with self._lock:
+            wins = self._hedge_wins.setdefault(engine, {})
+            wins[winner] = wins.get(winner, 0) + 1
+
+    def hedge_stats(self, engine: str) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._hedge_wins.get(engine, {}))
+
+    def record_success(self, engine: str):
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes.setdefault(engine, deque(maxlen=OUTCOME_WINDOW)).append((now, True))
+            self._last_attempt[engine] = now
+            self._quota_until.pop(engine, None)
+
+    def record_failure(self, engine: str, message: str = "", quota: Optional[bool] = None):
+        """
+        失敗を記録する。429・quota のエラーなら "retry in XXs"（無ければ既定値）の間、利用上限中とみなす
+        quota: 利用上限中とみなすかどうか（Noneならメッセージから判定する）。
+               複数キーを使うエンジンでは、全キーが休止中の場合のみTrueを渡す
+        """
+        now = time.monotonic()
+        lowered = (message or "").lower()
+        if quota is None:
+            quota = "429" in lowered or "quota" in lowered or "too many requests" in lowered
+        with self._lock:
+            self._outcomes.setdefault(engine, deque(maxlen=OUTCOME_WINDOW)).append((now, False))
+            self._last_attempt[engine] = now
+            if quota:
+                retry_match = _RETRY_PATTERN.search(message)
+                seconds = float(retry_match.group(1)) if retry_match else DEFAULT_QUOTA_COOLDOWN
+                self._quota_until[engine] = now + seconds
+
+    def success_rate(self, engine: str) -> Optional[float]:
+        """
+        直近の成功率（有効な結果が MIN_OUTCOME_SAMPLES 件未満ならNone）
+        """
+        now = time.monotonic()
+        with self._lock:
+            recent = [ok for at, ok in self._outcomes.get(engine, ()) if now - at <= OUTCOME_MAX_AGE_SECONDS]
+        if len(recent) < MIN_OUTCOME_SAMPLES:
+            return None
+        return sum(recent) / len(recent)
+
+    def status(self, engine: str) -> str:
+        """
+        "healthy" / "degraded" / "down" / "quota" / "unknown"
+        """
+        with self._lock:
+            quota_until = self._quota_until.get(engine, 0.0)
+        if quota_until > time.monotonic():
+            return "quota"
+        rate = self.success_rate(engine)
+        if rate is None:
+            return "unknown"
+        if rate < DOWN_SUCCESS_RATE:
+            return "down"
+        if rate < DEGRADED_SUCCESS_RATE:
+            return "degraded"
+        return "healthy"
+
+    def is_available(self, engine: str) -> bool:
+        """
+        リクエストを送ってよいか。障害中・利用上限中でも、PROBE_INTERVAL_SECONDS ごとに1回は通す
+        """
+        if self.status(engine) not in ("down", "quota"):
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_attempt.get(engine, 0.0) >= PROBE_INTERVAL_SECONDS:
+                self._last_attempt[engine] = now
+                return True
+        return False
+
+    def route(self, engine: str, fallbacks: List[str]) -> List[str]:
+        """
+        指定エンジンとフォールバック先のうち、使えるものを優先順に返す。
+        すべて使えない場合は、元の順番のまま全エンジンを返す（何も試さずに失敗させない）
+        """
+        chain = [engine] + [e for e in fallbacks if e != engine]
+        available = [e for e in chain if self.is_available(e)]
+        return available or chain
+
+    def status_badge(self, engine: str) -> str:
+        return STATUS_BADGES.get(self.status(engine), "")
+
+
+# プロセス全体で共有するインスタンス
+engine_health = EngineHealth()
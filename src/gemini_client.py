@@ -0,0 +1,110 @@
+"""
+APIキーごとのGeminiクライアントプール（プロセス全体で共有）
+genai.configure() はプロセス全体の設定を書き換えるため、別のキーを使うセッションと競合する。
+ここではキーごとに GenerativeServiceClient / ModelServiceClient を1つだけ作って使い回し、
+(APIキー, モデル名) ごとの KeyedGenerativeModel からそのクライアントを直接呼び出す。
+"""
+import threading
+from typing import Dict, Iterable
+
+import google.ai.generativelanguage as glm
+from google.generativeai.types import content_types, generation_types, safety_types
+
+from src.rate_limiter import _key_id
+
+
+_lock = threading.Lock()
+_generative_clients: Dict[str, glm.GenerativeServiceClient] = {}
+_model_clients: Dict[str, glm.ModelServiceClient] = {}
+_models: Dict[tuple, "KeyedGenerativeModel"] = {}
+
+
+class KeyedGenerativeModel:
+    """
+    キー専用のクライアントで generateContent を呼ぶ、genai.GenerativeModel.generate_content() 相当のモデル。
+    SDKの GenerativeModel の内部属性（_client）を書き換えずに済むよう、リクエストは公開の型変換関数で組み立てる。
+    戻り値は SDK と同じ GenerateContentResponse（stream=True ならチャンクを順に返す）。
+    """
+
+    def __init__(self, client: glm.GenerativeServiceClient, model_name: str):
+        self.client = client
+        self.model_name = model_name if "/" in model_name else f"models/{model_name}"
+
+    def generate_content(self, contents, safety_settings=None, stream: bool = False):
+        request = glm.GenerateContentRequest(
+            model=self.model_name,
+            contents=content_types.to_contents(contents),
+            safety_settings=safety_types.normalize_safety_settings(safety_types.to_easy_safety_dict(safety_settings)),
+        )
+        if request.contents and not request.contents[-1].role:
+            request.contents[-1].role = "user"
+        if stream:
+            with generation_types.rewrite_stream_error():
+                iterator = self.client.stream_generate_content(request)
+            return generation_types.GenerateContentResponse.from_iterator(iterator)
+        return generation_types.GenerateContentResponse.from_response(self.client.generate_content(request))
+
+
+def get_generative_client(api_key: str) -> glm.GenerativeServiceClient:
+    """
+    キーごとの生成APIクライアント（gRPCチャネルを共有するためスレッドセーフ）
+    """
+    key_id = _key_id(api_key)
+    with _lock:
+        client = _generative_clients.get(key_id)
+        if client is None:
+            client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+            _generative_clients[key_id] = client
+        return client
+
+
+def get_model_client(api_key: str) -> glm.ModelServiceClient:
+    """
+    キーごとのモデル一覧APIクライアント
+    """
+    key_id = _key_id(api_key)
+    with _lock:
+        client = _model_clients.get(key_id)
+        if client is None:
+            client = glm.ModelServiceClient(client_options={"api_key": api_key})
+            _model_clients[key_id] = client
+        return client
+
+
+def get_model(api_key: str, model_name: str) -> KeyedGenerativeModel:
+    """
+    (APIキー, モデル名) ごとのモデルを返す（genai.configure() を使わず、キー専用のクライアントで呼び出す）
+    """
+    client = get_generative_client(api_key)
+    cache_key = (_key_id(api_key), model_name)
+    with _lock:
+        model = _models.get(cache_key)
+        if model is None:
+            model = KeyedGenerativeModel(client, model_name)
+            _models[cache_key] = model
+        return model
+
+
+def prewarm(api_key: str, model_names: Iterable[str] = (), timeout: float = 5.0):
+    """
+    キー保存時などに、クライアント生成とgRPCチャネルの接続をバックグラウンドで済ませておく。
+    最初の翻訳・記事生成でTLS接続の確立を待たないようにするため（失敗しても無視する）。
+    """
+    if not api_key:
+        return
+
+    def warm():
+        try:
+            client = get_generative_client(api_key)
+            for name in model_names:
+                if name:
+                    get_model(api_key, name)
+            channel = getattr(client.transport, "grpc_channel", None)
+            if channel is not None:
+                import grpc
+                grpc.channel_ready_future(channel).result(timeout=timeout)
+        except Exception:
+            pass
+
+    threading.Thread(target=warm, daemon=True).start()
+
@@ -0,0 +1,209 @@
+"""
+バックグラウンドジョブ管理（プロセス全体で共有）
+翻訳・記事生成をワーカースレッドで実行し、途中経過と結果をジョブIDごとのストアに保存する。
+Streamlitの再実行（ウィジェット操作）でスクリプトが中断されても、ジョブは止まらず結果も失われない。
+画面側は毎回の実行でジョブの状態を読み出して描画する（ポーリング）。
+"""
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+# ジョブ実行中に画面を再描画する間隔（秒）
+JOB_POLL_INTERVAL = 0.5
+# 完了したジョブを保持する時間（秒）。受け取られないまま放置されたジョブを掃除する
+JOB_RETENTION_SECONDS = 3600.0
+JOB_MAX_WORKERS = 8
+
+_local = threading.local()
+
+
+class StorePlaceholder:
+    """
+    st.empty() の代わりにジョブへ渡すプレースホルダー。
+    描画内容をストアに記録するだけなので、ワーカースレッドから呼んでも安全。
+    """
+
+    def __init__(self, job: "Job", slot: str):
+        self._job = job
+        self._slot = slot
+
+    def markdown(self, body: str, unsafe_allow_html: bool = False):
+        self._job.set_output(self._slot, ("markdown", body, unsafe_allow_html))
+
+    def info(self, body: str):
+        self._job.set_output(self._slot, ("info", body, False))
+
+    def success(self, body: str):
+        self._job.set_output(self._slot, ("success", body, False))
+
+    def warning(self, body: str):
+        self._job.set_output(self._slot, ("warning", body, False))
+
+    def error(self, body: str):
+        self._job.set_output(self._slot, ("error", body, False))
+
+    def empty(self):
+        self._job.set_output(self._slot, None)
+
+
+class Job:
+    """
+    1つのバックグラウンド処理の状態（途中経過の描画内容・結果・エラー）
+    """
+
+    def __init__(self, kind: str, dedupe_key: Optional[tuple] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        # 同じリクエストを複数のセッションで共有する場合のキー（single-flight）
+        self.dedupe_key = dedupe_key
+        self.status = "running"  # running / done / error
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # エラーバナー（v9_error_banner_html）への書き込み。banner_set が False なら変更なし
+        self.banner_set = False
+        self.banner_html: Optional[str] = None
+        self._outputs: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._finished_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != "running"
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        ジョブの完了を待つ（タイムアウトした場合はFalse）
+        """
+        return self._finished_event.wait(timeout)
+
+    def placeholder(self, slot: str) -> StorePlaceholder:
+        return StorePlaceholder(self, slot)
+
+    def placeholders(self, slot: str, count: int) -> List[StorePlaceholder]:
+        """
+        行ごとのプレースホルダー（translate_paragraphs の行モード用）
+        """
+        return [StorePlaceholder(self, f"{slot}:{i}") for i in range(count)]
+
+    def set_output(self, slot: str, output):
+        with self._lock:
+            self._outputs[slot] = output
+
+    def set_banner(self, html: Optional[str]):
+        with self._lock:
+            self.banner_set = True
+            self.banner_html = html
+
+    def replay(self, slot: str, target):
+        """
+        記録された描画内容を実際のプレースホルダー（st.empty() またはそのリスト）に描画する
+        """
+        if target is None:
+            return
+        with self._lock:
+            outputs = dict(self._outputs)
+        if isinstance(target, list):
+            for i, ph in enumerate(target):
+                _replay_output(outputs.get(f"{slot}:{i}"), ph)
+        else:
+            _replay_output(outputs.get(slot), target)
+
+
+def _replay_output(output, placeholder):
+    if output is None:
+        return
+    method, body, unsafe_allow_html = output
+    if method == "markdown":
+        placeholder.markdown(body, unsafe_allow_html=unsafe_allow_html)
+    else:
+        getattr(placeholder, method)(body)
+
+
+class JobManager:
+    """
+    ジョブの登録・実行・参照を行う（スレッドセーフ）
+    """
+
+    def __init__(self, max_workers: int = JOB_MAX_WORKERS):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._inflight: Dict[tuple, Job] = {}
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def submit(self, kind: str, target: Callable[[Job], Any], dedupe_key: Optional[tuple] = None) -> Job:
+        """
+        target(job) をバックグラウンドで実行する。
+        target には job.placeholder() / job.placeholders() で作ったプレースホルダーを使わせる。
+        dedupe_key: 同じキーのジョブが実行中なら、新しく実行せずにそのジョブを返す（別セッションからの同じリクエストに相乗りする）
+        """
+        with self._lock:
+            self._cleanup()
+            if dedupe_key is not None:
+                running = self._inflight.get(dedupe_key)
+                if running is not None and not running.finished:
+                    return running
+            job = Job(kind, dedupe_key)
+            self._jobs[job.id] = job
+            if dedupe_key is not None:
+                self._inflight[dedupe_key] = job
+
+        def run():
+            with self._slots:
+                _local.job = job
+                try:
+                    job.result = target(job)
+                    job.status = "done"
+                except Exception as e:
+                    job.error = str(e)
+                    job.status = "error"
+                finally:
+                    job.finished_at = time.time()
+                    _local.job = None
+                    job._finished_event.set()
+
+        threading.Thread(target=run, name=f"job-{kind}-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id: Optional[str]):
+        """
+        結果を受け取ったジョブを削除する。
+        共有ジョブ（dedupe_key あり）は他のセッションがまだ受け取っていない可能性があるため、保持期間の経過まで残す。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.dedupe_key is None:
+                del self._jobs[job_id]
+
+    def _cleanup(self):
+        now = time.time()
+        for job_id in [jid for jid, job in self._jobs.items() if job.finished_at and now - job.finished_at > JOB_RETENTION_SECONDS]:
+            job = self._jobs.pop(job_id)
+            if job.dedupe_key is not None and self._inflight.get(job.dedupe_key) is job:
+                del self._inflight[job.dedupe_key]
+
+
+def wait_for_next_poll():
+    """
+    次のポーリングまで待つ（画面側でジョブの途中経過を再描画する前に呼ぶ）
+    """
+    time.sleep(JOB_POLL_INTERVAL)
+
+
+def current_job() -> Optional[Job]:
+    """
+    現在のスレッドで実行中のジョブ（ジョブ外から呼ばれた場合はNone）
+    """
+    return getattr(_local, "job", None)
+
+
+# プロセス全体で共有するインスタンス
+job_manager = JobManager()
@@ -0,0 +1,118 @@
+"""
+複数APIキーのローテーション（Gemini / DeepL、プロセス全体で共有）
+キー入力欄にはカンマ・改行区切りで複数のキーを入力できる。
+リクエストごとに残り枠が最も多いキーを選び、429（利用上限）が返ったキーは
+解除予定時刻まで休ませて次のキーで再送する。
+"""
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from src.rate_limiter import rate_limiter, _key_id
+
+T = TypeVar("T")
+
+# "retry in XXs" が取れない429の場合に休ませる秒数
+DEFAULT_COOLDOWN_SECONDS = 60.0
+
+_KEY_SPLIT_PATTERN = re.compile(r"[,\s]+")
+_RETRY_PATTERN = re.compile(r"retry in ([0-9\.]+)s")
+
+
+def parse_api_keys(value: Optional[str]) -> List[str]:
+    """
+    カンマ・空白・改行区切りのキー文字列をリストにする（重複は除く、入力順を保つ）
+    """
+    if not value:
+        return []
+    keys = []
+    for key in _KEY_SPLIT_PATTERN.split(value.strip()):
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def is_quota_error(message: str) -> bool:
+    """
+    キーを切り替えれば回避できるエラー（429 / DeepLの456 / ローカルの枠切れ）かどうか
+    """
+    lowered = (message or "").lower()
+    return "429" in lowered or "456" in lowered or "quota" in lowered or "too many requests" in lowered
+
+
+class KeyPool:
+    """
+    (エンジン, キー) ごとの休止期限を管理し、使うキーの順番を決める（スレッドセーフ）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cooldowns: Dict[tuple, float] = {}
+
+    def mark_exhausted(self, engine: str, api_key: str, message: str = ""):
+        """
+        429が返ったキーを、"retry in XXs" の秒数（無ければ既定値）だけ候補から外す
+        """
+        retry_match = _RETRY_PATTERN.search(message or "")
+        seconds = float(retry_match.group(1)) if retry_match else DEFAULT_COOLDOWN_SECONDS
+        with self._lock:
+            self._cooldowns[(engine, _key_id(api_key))] = time.monotonic() + seconds
+
+    def cooldown_remaining(self, engine: str, api_key: str) -> float:
+        with self._lock:
+            until = self._cooldowns.get((engine, _key_id(api_key)), 0.0)
+        return max(0.0, until - time.monotonic())
+
+    def ordered(self, engine: str, keys: List[str]) -> List[str]:
+        """
+        使用する順にキーを並べる。休止中でないキーを先に、その中では
+        1日の残り枠（無ければ1分の残り枠）が多い順。休止中のキーは解除が近い順に最後へ回す。
+        """
+        def load(key):
+            cooldown = self.cooldown_remaining(engine, key)
+            remaining = rate_limiter.remaining(engine, key, "rpd")
+            if remaining is None:
+                remaining = rate_limiter.remaining(engine, key, "rpm")
+            return (cooldown > 0, cooldown, -(remaining if remaining is not None else float("inf")))
+
+        return sorted(keys, key=load)
+
+    def all_exhausted(self, engine: str, keys: List[str]) -> bool:
+        """
+        全キーが休止中かどうか（キーが無い場合はFalse）
+        """
+        return bool(keys) and all(self.cooldown_remaining(engine, key) > 0 for key in keys)
+
+    def total_remaining(self, engine: str, keys: List[str], limit_name: str = "rpd") -> Optional[int]:
+        """
+        全キーの残り枠の合計（上限が設定されていない場合はNone）
+        """
+        values = [rate_limiter.remaining(engine, key, limit_name) for key in keys]
+        if not values or any(v is None for v in values):
+            return None
+        return sum(values)
+
+
+# プロセス全体で共有するインスタンス
+key_pool = KeyPool()
+
+
+def call_with_failover(engine: str, keys_value: Optional[str], fn: Callable[[str], T]) -> T:
+    """
+    残り枠の多いキーから順に fn(key) を呼び、利用上限エラーならキーを休ませて次のキーで再試行する。
+    全キーで失敗した場合は最後の例外を送出する。
+    """
+    keys = parse_api_keys(keys_value)
+    if not keys:
+        return fn("")
+    last_error = None
+    for key in key_pool.ordered(engine, keys):
+        try:
+            return fn(key)
+        except Exception as e:
+            if not is_quota_error(str(e)):
+                raise
+            key_pool.mark_exhausted(engine, key, str(e))
+            last_error = e
+    raise last_error
@@ -0,0 +1,319 @@
+"""
+読み込んだ記事の類似記事インデックス（MinHash + LSH、プロセス全体で共有）
+同じニュースを別の媒体から読み込んでも気づかず、翻訳・記事生成をやり直すことが多かった。
+記事を読み込むたびに本文の文字 n-gram（シングル）から MinHash の署名を作って保存し、
+以前に読み込んだ記事のうち本文がほぼ同じもの（推定Jaccard係数が NEAR_DUPLICATE_THRESHOLD 以上）を探す。
+
+- 署名の計算はNumPyでまとめて行う（1万字の記事で数ミリ秒）
+- 検索は LSH（署名を LSH_BANDS 個の帯に分け、どれかの帯が一致した記事だけを候補にする）で、
+  帯ごとに整列済みの配列を二分探索するため、10万件でも1件あたり1ミリ秒未満で済む
+- 署名はSQLite（.data/near_duplicates.sqlite3）に保存し、起動後の最初の検索でメモリに読み込む
+"""
+import os
+import re
+import sqlite3
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from src.draft_store import DRAFT_STORE_PATH, _SqliteStore
+
+NEAR_DUPLICATE_INDEX_PATH = os.environ.get(
+    "NEAR_DUPLICATE_INDEX_PATH",
+    os.path.join(os.path.dirname(DRAFT_STORE_PATH), "near_duplicates.sqlite3"),
+)
+
+# シングルの文字数（中国語・日本語は単語の区切りが無いため文字 n-gram を使う）
+SHINGLE_SIZE = 5
+# 署名の長さ = LSH_BANDS * LSH_ROWS。帯の一致確率は 1 - (1 - J^ROWS)^BANDS（J=0.5 で約87%）
+LSH_BANDS = 32
+LSH_ROWS = 4
+NUM_PERMUTATIONS = LSH_BANDS * LSH_ROWS
+# 候補のうち、署名から推定したJaccard係数がこれ以上のものを類似記事とする
+NEAR_DUPLICATE_THRESHOLD = 0.5
+# これより短い本文は索引に入れない（定型文だけの記事が互いに一致するのを避ける）
+MIN_TEXT_CHARS = 200
+# 整列済み配列に入れずに末尾で保持する新着の記事数の上限（これと件数の1/8の大きいほうを超えたら並べ直す）
+MAX_UNSORTED_ARTICLES = 1024
+
+# 空白・句読点は比較に使わない（媒体ごとの体裁の違いを無視する）
+_IGNORED_CHARS = re.compile(r"[\s -⁯　-〿＀-／：-＠［-｀｛-･!-/:-@\[-`{-~]+")
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(20240501)
+# 固定の乱数で作るため、保存した署名はプロセスをまたいで比較できる
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=(NUM_PERMUTATIONS, 1)).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=(NUM_PERMUTATIONS, 1)).astype(np.uint64)
+# 帯の値を1つの64bitキーにまとめるための係数（奇数）
+_BAND_MIX = (_rng.randint(1, 1 << 30, size=LSH_ROWS).astype(np.uint64) * np.uint64(2) + np.uint64(1))
+# 一度に処理するシングル数（長文で (署名長 x シングル数) の行列が大きくなりすぎないようにする）
+_SHINGLE_BATCH = 4096
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """
+    本文の文字 n-gram を31bitのハッシュ値の配列にする（重複は除く）
+    """
+    normalized = _IGNORED_CHARS.sub("", text or "")
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < SHINGLE_SIZE:
+        return np.zeros(0, dtype=np.uint64)
+    # 多項式ハッシュ（n-gram ごとの和をずらした配列の足し算でまとめて求める。オーバーフローは 2^64 で巡回する）
+    hashes = np.zeros(len(codes) - SHINGLE_SIZE + 1, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(SHINGLE_SIZE):
+            hashes = hashes * np.uint64(1000003) + codes[offset:offset + len(hashes)]
+    return np.unique(hashes % _MERSENNE_PRIME)
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """
+    本文の MinHash 署名（長さ NUM_PERMUTATIONS の uint32 配列）。本文が短すぎる場合はNone
+    """
+    if len(text or "") < MIN_TEXT_CHARS:
+        return None
+    shingles = _shingle_hashes(text)
+    if len(shingles) == 0:
+        return None
+    signature = np.full(NUM_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(shingles), _SHINGLE_BATCH):
+        batch = shingles[start:start + _SHINGLE_BATCH]
+        # (a * x + b) mod p。a, b, x < 2^31 のため uint64 に収まる
+        permuted = (_PERM_A * batch[np.newaxis, :] + _PERM_B) % _MERSENNE_PRIME
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def _band_keys(signatures: np.ndarray) -> np.ndarray:
+    """
+    署名（N x NUM_PERMUTATIONS）を帯ごとの64bitキー（N x LSH_BANDS）にする
+    """
+    bands = signatures.astype(np.uint64).reshape(len(signatures), LSH_BANDS, LSH_ROWS)
+    with np.errstate(over="ignore"):
+        keys = np.zeros((len(signatures), LSH_BANDS), dtype=np.uint64)
+        for row in range(LSH_ROWS):
+            keys = (keys ^ bands[:, :, row]) * _BAND_MIX[row]
+    return keys
+
+
+class NearDuplicateIndex(_SqliteStore):
+    """
+    MinHash 署名の LSH インデックス（スレッドセーフ）。
+    メモリ上では帯ごとにキーを整列した配列と、その並びの記事番号を持ち、np.searchsorted で候補を探す。
+    署名と帯のキーは容量を倍々に広げる配列に追記し、新着の記事は整列済み配列に挿入せず末尾でまとめて照合する
+    （一定数たまったら並べ直す）。1件の追加で全体をコピーしないため、索引の構築は件数に比例する時間で済む。
+    """
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS articles (
+            url TEXT PRIMARY KEY,
+            title TEXT,
+            signature BLOB NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+    ]
+
+    def __init__(self, path: str = NEAR_DUPLICATE_INDEX_PATH):
+        super().__init__(path)
+        self._loaded = False
+        self._urls: List[str] = []
+        self._titles: List[str] = []
+        self._positions = {}
+        # 先頭 self._count 行が有効（残りは追記用の空き）
+        self._count = 0
+        self._signature_buffer = np.zeros((0, NUM_PERMUTATIONS), dtype=np.uint32)
+        self._key_buffer = np.zeros((0, LSH_BANDS), dtype=np.uint64)
+        # 先頭 self._sorted_count 件の帯ごとの整列済みキー（それ以降の記事は未整列）
+        self._sorted_count = 0
+        self._sorted_keys = np.zeros((LSH_BANDS, 0), dtype=np.uint64)
+        self._sorted_ids = np.zeros((LSH_BANDS, 0), dtype=np.int64)
+
+    @property
+    def _signatures(self) -> np.ndarray:
+        return self._signature_buffer[:self._count]
+
+    def _load(self):
+        """
+        保存済みの署名を読み込み、帯ごとの整列済み配列を作る（ロックを取った状態で呼ぶ）
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT url, title, signature FROM articles ORDER BY created_at").fetchall()
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            rows = []
+        rows = [row for row in rows if len(row["signature"]) == NUM_PERMUTATIONS * 4]
+        self._urls = [row["url"] for row in rows]
+        self._titles = [row["title"] or "" for row in rows]
+        self._positions = {url: i for i, url in enumerate(self._urls)}
+        if rows:
+            self._signature_buffer = np.frombuffer(b"".join(row["signature"] for row in rows), dtype=np.uint32).reshape(len(rows), NUM_PERMUTATIONS).copy()
+            self._key_buffer = _band_keys(self._signature_buffer)
+            self._count = len(rows)
+        self._rebuild()
+
+    def _rebuild(self):
+        """
+        全記事の帯のキーを並べ直す
+        """
+        keys = self._key_buffer[:self._count].T  # LSH_BANDS x N
+        order = np.argsort(keys, axis=1, kind="stable")
+        self._sorted_keys = np.take_along_axis(keys, order, axis=1)
+        self._sorted_ids = order
+        self._sorted_count = self._count
+
+    def _insert(self, signature: np.ndarray) -> int:
+        """
+        新しい記事の署名と帯のキーを末尾に追記する（空きが無ければ容量を倍にする）。
+        未整列の記事が一定数を超えたら、まとめて並べ直す
+        """
+        doc_id = self._count
+        if doc_id == len(self._signature_buffer):
+            capacity = max(2 * doc_id, 64)
+            signature_buffer = np.zeros((capacity, NUM_PERMUTATIONS), dtype=np.uint32)
+            signature_buffer[:doc_id] = self._signature_buffer[:doc_id]
+            key_buffer = np.zeros((capacity, LSH_BANDS), dtype=np.uint64)
+            key_buffer[:doc_id] = self._key_buffer[:doc_id]
+            self._signature_buffer, self._key_buffer = signature_buffer, key_buffer
+        self._signature_buffer[doc_id] = signature
+        self._key_buffer[doc_id] = _band_keys(signature[np.newaxis, :])[0]
+        self._count += 1
+        if self._count - self._sorted_count > max(MAX_UNSORTED_ARTICLES, self._sorted_count // 8):
+            self._rebuild()
+        return doc_id
+
+    def _candidates(self, signature: np.ndarray) -> np.ndarray:
+        keys = _band_keys(signature[np.newaxis, :])[0]
+        left = [np.searchsorted(self._sorted_keys[band], keys[band], side="left") for band in range(LSH_BANDS)]
+        right = [np.searchsorted(self._sorted_keys[band], keys[band], side="right") for band in range(LSH_BANDS)]
+        matched = [self._sorted_ids[band, l:r] for band, (l, r) in enumerate(zip(left, right)) if r > l]
+        # 整列済み配列に入っていない新着の記事は、帯のキーを直接比較する
+        unsorted = np.flatnonzero((self._key_buffer[self._sorted_count:self._count] == keys[np.newaxis, :]).any(axis=1))
+        if len(unsorted):
+            matched.append(unsorted + self._sorted_count)
+        if not matched:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(matched))
+
+    def query(self, signature: Optional[np.ndarray], exclude_url: str = None, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> List[dict]:
+        """
+        類似記事を似ている順に返す
+        各要素: {"url", "title", "similarity"}（similarity は署名から推定したJaccard係数）
+        """
+        if signature is None:
+            return []
+        with self._lock:
+            self._load()
+            candidates = self._candidates(signature)
+            if len(candidates) == 0:
+                return []
+            similarity = (self._signatures[candidates] == signature[np.newaxis, :]).mean(axis=1)
+            order = np.argsort(-similarity, kind="stable")
+            return [
+                {"url": self._urls[candidates[i]], "title": self._titles[candidates[i]], "similarity": float(similarity[i])}
+                for i in order
+                if similarity[i] >= threshold and self._urls[candidates[i]] != exclude_url
+            ]
+
+    def add(self, url: str, title: str, signature: Optional[np.ndarray]):
+        """
+        記事の署名を登録する（同じURLで本文が変わっていれば署名を置き換える）
+        """
+        if signature is None or not url:
+            return
+        with self._lock:
+            self._load()
+            position = self._positions.get(url)
+            if position is not None and np.array_equal(self._signatures[position], signature):
+                return
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO articles (url, title, signature, created_at) VALUES (?, ?, ?, ?)",
+                        (url, title, signature.astype(np.uint32).tobytes(), time.time()),
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+            except (sqlite3.Error, OSError):
+                pass
+            if position is not None:
+                self._signature_buffer[position] = signature
+                self._key_buffer[position] = _band_keys(signature[np.newaxis, :])[0]
+                self._titles[position] = title or ""
+                self._rebuild()
+            else:
+                self._positions[url] = self._insert(signature)
+                self._urls.append(url)
+                self._titles.append(title or "")
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._urls)
+
+
+def find_and_register(url: str, title: str, text: str) -> List[dict]:
+    """
+    読み込んだ記事の類似記事を探し、その記事を索引に登録する
+    """
+    signature = minhash_signature(text)
+    duplicates = near_duplicate_index.query(signature, exclude_url=url)
+    near_duplicate_index.add(url, title, signature)
+    return duplicates
+
+
+def benchmark(article_count: int = 100_000, query_count: int = 1000):
+    """
+    ランダムな署名で索引を作り、1件あたりの検索時間を表示する（python -m src.near_duplicates）
+    """
+    import tempfile
+
+    rng = np.random.RandomState(0)
+    index = NearDuplicateIndex(os.path.join(tempfile.mkdtemp(), "bench.sqlite3"))
+    with index._lock:
+        index._loaded = True
+        index._urls = [f"https://example.com/{i}" for i in range(article_count)]
+        index._titles = [""] * article_count
+        index._positions = {url: i for i, url in enumerate(index._urls)}
+        index._signatures = rng.randint(0, (1 << 31) - 1, size=(article_count, NUM_PERMUTATIONS)).astype(np.uint32)
+        started = time.perf_counter()
+        index._rebuild()
+        print(f"build ({article_count} articles): {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    # 半分は既存の記事の署名を一部だけ変えたもの（類似記事あり）、半分は無関係な署名
+    queries = []
+    for i in range(query_count):
+        if i % 2 == 0:
+            signature = index._signatures[rng.randint(article_count)].copy()
+            changed = rng.choice(NUM_PERMUTATIONS, NUM_PERMUTATIONS // 4, replace=False)
+            signature[changed] = rng.randint(0, (1 << 31) - 1, size=len(changed))
+        else:
+            signature = rng.randint(0, (1 << 31) - 1, size=NUM_PERMUTATIONS).astype(np.uint32)
+        queries.append(signature)
+    started = time.perf_counter()
+    hits = sum(1 for signature in queries if index.query(signature))
+    elapsed = time.perf_counter() - started
+    print(f"query: {elapsed / query_count * 1e6:.0f} us/query  (hits: {hits}/{query_count})")
+
+    text = "".join(chr(0x4e00 + i % 5000) for i in rng.randint(0, 5000, size=10_000))
+    started = time.perf_counter()
+    minhash_signature(text)
+    print(f"signature (10k chars): {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+# プロセス全体で共有するインスタンス
+near_duplicate_index = NearDuplicateIndex()
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,184 @@
+"""
+翻訳エンジンごとのレート制限（プロセス全体で共有）
+同じサーバーIP・同じAPIキーを使う全セッション・全スレッドで、
+RPM（1分あたりリクエスト数）/ RPD（1日あたりリクエスト数）/ CPM（1分あたり文字数）を調整する。
+"""
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+# エンジンごとの既定値（None は無制限）。st.secrets の [rate_limits.<engine>] で上書きできる。
+DEFAULT_RATE_LIMITS = {
+    "Gemini": {"rpm": 10, "rpd": 250, "cpm": None},
+    "Google": {"rpm": 120, "rpd": None, "cpm": 100000},
+    "MyMemory": {"rpm": 30, "rpd": None, "cpm": 10000},
+    "DeepL": {"rpm": 60, "rpd": None, "cpm": 200000},
+}
+
+# これ以上待つ必要がある場合は待たずにエラーにする（1日の上限切れを事前に検知する）
+MAX_WAIT_SECONDS = 60.0
+
+
+class QuotaExhaustedError(Exception):
+    """
+    ローカルのレート制限で、許容時間内にリクエストを送れない場合のエラー。
+    メッセージには "quota" と "retry in XXs" を含め、既存の429エラー処理と同じ扱いにする。
+    """
+
+    def __init__(self, engine: str, limit_name: str, wait_seconds: float):
+        self.engine = engine
+        self.limit_name = limit_name
+        self.wait_seconds = wait_seconds
+        super().__init__(
+            f"Local quota guard: {engine} {limit_name.upper()} budget exhausted "
+            f"(quota), retry in {wait_seconds:.0f}s"
+        )
+
+
+class TokenBucket:
+    """
+    予約型のトークンバケット。残量がマイナスになることを許し、
+    その分だけ呼び出し側が待つことで、待ち時間を公平に割り当てる。
+    """
+
+    def __init__(self, capacity: float, per_seconds: float):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def reserve(self, amount: float, now: float) -> float:
+        wait = self.wait_time(amount, now)
+        self.tokens -= min(amount, self.capacity)
+        return wait
+
+    @property
+    def available(self) -> float:
+        self._refill(time.monotonic())
+        return max(0.0, self.tokens)
+
+
+class RateLimiter:
+    """
+    (エンジン, APIキー) ごとのバケットを管理するレートリミッター（スレッドセーフ）。
+    """
+
+    _WINDOWS = {"rpm": 60.0, "rpd": 86400.0, "cpm": 60.0}
+
+    def __init__(self, limits: Optional[Dict[str, dict]] = None):
+        self._lock = threading.Lock()
+        self._limits = {engine: dict(values) for engine, values in (limits or DEFAULT_RATE_LIMITS).items()}
+        self._buckets: Dict[tuple, Dict[str, TokenBucket]] = {}
+        self._listeners: List[Callable[[str, str, int], None]] = []
+
+    def add_listener(self, listener: Callable[[str, str, int], None]):
+        """
+        枠を確保するたびに listener(engine, api_key, chars) を呼ぶ（別プロセスと使用量を共有する記録用）
+        """
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def limits(self, engine: str) -> dict:
+        with self._lock:
+            return dict(self._limits.get(engine, {}))
+
+    def configure(self, engine: str, **values):
+        """
+        エンジンの上限を変更する（rpm / rpd / cpm、None で無制限）。
+        値が変わったバケットは作り直す。
+        """
+        with self._lock:
+            current = self._limits.setdefault(engine, {"rpm": None, "rpd": None, "cpm": None})
+            changed = False
+            for name, value in values.items():
+                if name not in self._WINDOWS:
+                    continue
+                value = int(value) if value else None
+                if current.get(name) != value:
+                    current[name] = value
+                    changed = True
+            if changed:
+                for bucket_key in [k for k in self._buckets if k[0] == engine]:
+                    del self._buckets[bucket_key]
+
+    def _get_buckets(self, engine: str, api_key: str) -> Dict[str, TokenBucket]:
+        bucket_key = (engine, _key_id(api_key))
+        if bucket_key not in self._buckets:
+            limits = self._limits.get(engine, {})
+            self._buckets[bucket_key] = {
+                name: TokenBucket(limits[name], window)
+                for name, window in self._WINDOWS.items()
+                if limits.get(name)
+            }
+        return self._buckets[bucket_key]
+
+    def acquire(self, engine: str, api_key: str = "", chars: int = 0, max_wait: float = MAX_WAIT_SECONDS) -> float:
+        """
+        1リクエスト分の枠を確保し、必要な時間だけ待つ。
+        max_wait を超える待ちが必要な場合は枠を消費せずに QuotaExhaustedError を送出する。
+        Returns: 実際に待った秒数
+        """
+        amounts = {"rpm": 1, "rpd": 1, "cpm": chars}
+        with self._lock:
+            buckets = self._get_buckets(engine, api_key)
+            now = time.monotonic()
+            waits = {name: bucket.wait_time(amounts[name], now) for name, bucket in buckets.items()}
+            if waits:
+                limit_name, longest = max(waits.items(), key=lambda kv: kv[1])
+                if longest > max_wait:
+                    raise QuotaExhaustedError(engine, limit_name, longest)
+            wait = max([bucket.reserve(amounts[name], now) for name, bucket in buckets.items()], default=0.0)
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(engine, api_key, chars)
+            except Exception:
+                pass
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def remaining(self, engine: str, api_key: str = "", limit_name: str = "rpd") -> Optional[int]:
+        """
+        現在すぐに使える枠の数（上限が設定されていない場合はNone）
+        """
+        with self._lock:
+            bucket = self._get_buckets(engine, api_key).get(limit_name)
+            return int(bucket.available) if bucket else None
+
+
+def _key_id(api_key: str) -> str:
+    # APIキーそのものはメモリ上のキーにも残さない
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+# プロセス全体で共有するインスタンス
+rate_limiter = RateLimiter()
+
+
+def configure_rate_limits(settings: Optional[dict]):
+    """
+    設定（st.secrets の rate_limits セクションなど）から上限を反映する。
+    例: {"Gemini": {"rpm": 10, "rpd": 250}, "DeepL": {"cpm": 100000}}
+    """
+    if not settings:
+        return
+    for engine, values in settings.items():
+        if hasattr(values, "items"):
+            rate_limiter.configure(engine, **dict(values))
@@ -0,0 +1,94 @@
+"""
+ストリーミング表示用の間引き描画
+ストリーミング中はチャンクを受信するたびに placeholder.markdown() を呼んでいたが、
+1回ごとにWebSocketでブラウザへ差分が送られるため、高速なモデルでは画面の更新が追いつかない。
+ThrottledPlaceholder は一定間隔（既定 10Hz）に1回だけ最新の内容を描画し、途中の更新は捨てる。
+最後の内容は flush()（または with 文の終了時）に必ず描画する。
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# 描画の最小間隔（秒）。0.1秒 = 10Hz
+RENDER_INTERVAL = 0.1
+
+
+class ThrottledPlaceholder:
+    """
+    st.empty() などのプレースホルダーを包み、描画を RENDER_INTERVAL に1回までにまとめる。
+    markdown() には文字列の代わりに、文字列を返す関数も渡せる（描画しない更新ではHTMLを組み立てない）。
+    """
+
+    def __init__(self, placeholder, interval: float = RENDER_INTERVAL):
+        self._placeholder = placeholder
+        self._interval = interval
+        self._pending: Optional[Callable[[], None]] = None
+        self._last_render = 0.0
+
+    def _schedule(self, render: Callable[[], None]):
+        self._pending = render
+        if time.monotonic() - self._last_render >= self._interval:
+            self.flush()
+
+    def flush(self):
+        """
+        保留中の最新の内容を描画する
+        """
+        render, self._pending = self._pending, None
+        if render is not None:
+            render()
+            self._last_render = time.monotonic()
+
+    def markdown(self, body, unsafe_allow_html: bool = False):
+        self._schedule(lambda: self._placeholder.markdown(body() if callable(body) else body, unsafe_allow_html=unsafe_allow_html))
+
+    def info(self, body: str):
+        self._schedule(lambda: self._placeholder.info(body))
+
+    def success(self, body: str):
+        self._schedule(lambda: self._placeholder.success(body))
+
+    def warning(self, body: str):
+        self._schedule(lambda: self._placeholder.warning(body))
+
+    def error(self, body: str):
+        self._schedule(lambda: self._placeholder.error(body))
+
+    def empty(self):
+        self._schedule(self._placeholder.empty)
+
+
+def throttle(placeholder, interval: float = RENDER_INTERVAL):
+    """
+    プレースホルダー（またはそのリスト）を ThrottledPlaceholder で包む。None はそのまま返す
+    """
+    if placeholder is None:
+        return None
+    if isinstance(placeholder, list):
+        return [throttle(ph, interval) for ph in placeholder]
+    return ThrottledPlaceholder(placeholder, interval)
+
+
+def flush_all(placeholder):
+    if placeholder is None:
+        return
+    if isinstance(placeholder, list):
+        for ph in placeholder:
+            flush_all(ph)
+    else:
+        placeholder.flush()
+
+
+@contextmanager
+def throttled(placeholder, interval: float = RENDER_INTERVAL):
+    """
+    with throttled(placeholder) as ph:
+        for chunk in stream:
+            ph.markdown(...)
+    終了時（例外の場合も）に最後の内容を描画する
+    """
+    wrapped = throttle(placeholder, interval)
+    try:
+        yield wrapped
+    finally:
+        flush_all(wrapped)
@@ -0,0 +1,68 @@
+"""
+翻訳結果・生成記事の共有キャッシュ（プロセス全体で共有）
+st.session_state はセッションごとのため、同じ記事を複数の編集者が開くと、それぞれが同じ翻訳・生成を行っていた。
+ここに完成した結果を保存し、別のセッションからも再利用する。
+実行中の同じリクエストへの相乗り（single-flight）は job_manager.submit(dedupe_key=...) が担う。
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# 結果を保持する時間（秒）と最大件数（古いものから捨てる）
+RESULT_CACHE_TTL_SECONDS = 6 * 3600.0
+RESULT_CACHE_MAX_ENTRIES = 256
+
+
+def translation_cache_key(src_url: str, engine_name: str, model_name: Optional[str], source_lang: str) -> tuple:
+    """
+    翻訳結果のキー（モデル名はGeminiの場合のみ区別する）
+    """
+    return ("translation", src_url, engine_name, model_name if "Gemini" in (engine_name or "") else None, source_lang)
+
+
+def article_cache_key(src_url: str, model_name: str) -> tuple:
+    return ("article", src_url, model_name)
+
+
+class SharedResultCache:
+    """
+    有効期限付きのLRUキャッシュ（スレッドセーフ）。
+    セッション側で結果を書き換えても共有分に影響しないよう、出し入れの際にコピーする。
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if now - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def put(self, key: tuple, value: Any):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: tuple):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+# プロセス全体で共有するインスタンス
+result_cache = SharedResultCache()
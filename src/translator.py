@@ -4,12 +4,69 @@ import json
 import re
 import requests
 import time
+import queue
+import threading
+from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from deep_translator import GoogleTranslator, MyMemoryTranslator
 import google.generativeai as genai
 
+from src.utils import plan_token_chunks
+from src.diff_engine import diff_opcodes
+from src.rate_limiter import rate_limiter, QuotaExhaustedError
+from src.gemini_client import get_model, get_model_client
+from src.key_pool import key_pool, parse_api_keys, is_quota_error, call_with_failover
+from src.engine_health import engine_health
+from src.jobs import current_job
+from src.render import throttle, flush_all
+from src.concurrency import get_limiter, classify_message, OUTCOME_OK, OUTCOME_THROTTLED, OUTCOME_TIMEOUT, OUTCOME_ERROR
+
 # Google翻訳の文字数制限（安全マージンを取って4500文字）
 CHAR_LIMIT = 4500
 
+# DeepL /v2/translate の1リクエストあたりの上限（textパラメータ数 / リクエストサイズ 128KiB）
+DEEPL_MAX_TEXTS_PER_REQUEST = 50
+DEEPL_MAX_REQUEST_BYTES = 120 * 1024  # 安全マージンを取って120KiB
+
+# 短い段落を1リクエストにまとめる際の区切り（翻訳後も残りやすい記号列）
+PACK_DELIMITER = "\n|||\n"
+PACK_SPLIT_PATTERN = re.compile(r"\s*\|\s*\|\s*\|\s*")
+# エンジンごとの1リクエストあたりの文字数上限（MyMemoryは500文字まで）
+PACK_CHAR_LIMITS = {
+    "Google": CHAR_LIMIT,
+    "MyMemory": 500,
+}
+PACK_MAX_ITEMS = 30
+
+# Google / MyMemory のフォールバック順（障害中・利用上限中のエンジンはルーターが飛ばす）
+FALLBACK_CHAINS = {
+    "Google": ["MyMemory"],
+    "MyMemory": ["Google"],
+}
+
+# ヘッジ: 応答がp90を超えても返らないリクエストを、この副エンジンにも送って先に返ったほうを使う
+HEDGE_SECONDARY_ENGINES = {
+    "Google": "MyMemory",
+    "MyMemory": "Google",
+}
+
+# Gemini一括翻訳: 1サブバッチあたりの推定入力トークン数
+# （出力が途中で打ち切られないよう、出力上限に対して十分小さく保つ）
+# 同時実行数は src.concurrency のコントローラーが429・レイテンシに応じて調整する
+GEMINI_CHUNK_TOKEN_BUDGET = 4000
+
+# 429エラーの "retry in XXs" がこの秒数以内なら、未翻訳の段落だけを自動で再送する
+GEMINI_AUTO_RETRY_MAX_WAIT = 60
+GEMINI_AUTO_RETRY_LIMIT = 2
+
+# Gemini Safety Settings (same as article_generator.py)
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
 
 def split_text_by_sentences(text: str, max_chars: int = CHAR_LIMIT) -> List[str]:
     """
@@ -93,113 +150,56 @@ def _translate_chunk(text: str, engine_name: str, source_lang: str, deepl_api_ke
     """
     実際の翻訳処理（内部関数）
     """
-    if engine_name == "Google":
-        try:
-            res = GoogleTranslator(source=source_lang, target='ja').translate(text)
-            return (res if res else text), "Google"
-        except:
-            try:
-                mem_source = source_lang if source_lang != 'auto' else 'zh-CN'
-                res = MyMemoryTranslator(source=mem_source, target='ja-JP').translate(text)
-                return (res if res else text), "MyMemory (Fallback)"
-            except:
-                return text, "Failed"
-    
-    elif engine_name == "DeepL":
-        if not deepl_api_key:
-            return text, "Failed (No API Key)"
-        try:
-            # DeepL Direct API Implementation
-            # Determine endpoint and source mapping
-            # DeepL source for Chinese is 'ZH' per docs
-            # If auto, omit source_lang
-            
-            is_free = deepl_api_key.endswith(':fx')
-            base_url = "https://api-free.deepl.com/v2/translate" if is_free else "https://api.deepl.com/v2/translate"
-            
-            params = {
-                'text': text,
-                'target_lang': 'JA'
-            }
-            
-            headers = {
-                'Authorization': f'DeepL-Auth-Key {deepl_api_key}'
-            }
-            
-            if source_lang != 'auto':
-                s_upper = source_lang.upper()
-                if s_upper in ['ZH-CN', 'ZH-TW', 'ZH-HANS', 'ZH-HANT', 'ZH']:
-                    params['source_lang'] = 'ZH'
-                elif s_upper == 'JA':
-                    return text, "DeepL (Skipped: Source=Target)"
-                else:
-                    params['source_lang'] = s_upper
-            
+    if engine_name in FALLBACK_CHAINS:
+        # 障害中・利用上限中のエンジンは飛ばし、フォールバック先を順に試す
+        # 1リクエストの文字数上限を超えるエンジン（MyMemoryは500文字）は候補から外す
+        # （上限内のエンジンがすべて障害中なら、状態に関わらずそれらを試す）
+        fits = lambda e: len(text) <= PACK_CHAR_LIMITS.get(e, CHAR_LIMIT)
+        route = (
+            [e for e in engine_health.route(engine_name, FALLBACK_CHAINS[engine_name]) if fits(e)]
+            or [e for e in [engine_name] + FALLBACK_CHAINS[engine_name] if fits(e)]
+            or [engine_name]
+        )
+        for engine in route:
             try:
-                resp = requests.post(base_url, data=params, headers=headers, timeout=10)
-                
-                if resp.status_code == 200:
-                    data = resp.json()
-                    translations = data.get('translations', [])
-                    if translations:
-                        return translations[0].get('text', text), "DeepL"
-                    else:
-                        return text, "DeepL (Empty Response)"
-                else:
-                    return text, f"DeepL (Error: {resp.status_code} - {resp.text[:50]})"
-                    
+                res = _translate_with_free_engine(text, engine, source_lang)
             except Exception as e:
-                return text, f"DeepL (NetError: {str(e)[:50]})"
-        except Exception as e:
-            return text, f"DeepL (SetupError: {str(e)})"
+                engine_health.record_failure(engine, str(e))
+                continue
+            engine_health.record_success(engine)
+            return (res if res else text), (engine if engine == engine_name else f"{engine} (Fallback)")
+        return text, "Failed"
     
-    elif engine_name == "MyMemory":
-        try:
-            mem_source = source_lang if source_lang != 'auto' else 'zh-CN'
-            res = MyMemoryTranslator(source=mem_source, target='ja-JP').translate(text)
-            return (res if res else text), "MyMemory"
-        except:
-            try:
-                res = GoogleTranslator(source=source_lang, target='ja').translate(text)
-                return (res if res else text), "Google (Fallback)"
-            except:
-                return text, "Failed"
+    elif engine_name == "DeepL":
+        return _translate_deepl_batch([text], source_lang, deepl_api_key)[0]
     
     elif engine_name == "Gemini":
         if not gemini_api_key:
             return text, "Failed (No API Key)"
         
         try:
-            genai.configure(api_key=gemini_api_key)
-            # Use the latest available model from user's list
-            model = genai.GenerativeModel('gemini-3-flash-preview')
-            
-            # Safety settings to avoid blocking content
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_NONE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_NONE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_NONE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_NONE"
-                },
-            ]
-
             prompt = f"Translate the following text into natural Japanese. Do not add any explanations or notes, just output the translation.\n\n{text}"
-            
-            response = model.generate_content(
-                prompt,
-                safety_settings=safety_settings
-            )
+
+            def generate(key):
+                rate_limiter.acquire("Gemini", key, chars=len(prompt))
+                # Use the latest available model from user's list
+                model = get_model(key, 'gemini-3-flash-preview')
+                return model.generate_content(
+                    prompt,
+                    safety_settings=SAFETY_SETTINGS
+                )
+
+            # 複数キーが設定されている場合は、429のキーを避けて次のキーで再送する
+            try:
+                response = call_with_failover("Gemini", gemini_api_key, generate)
+            except Exception as e:
+                # 1つのキーの枠切れだけでは、残りのキーがあるのでエンジン全体を利用上限中にしない
+                engine_health.record_failure(
+                    "Gemini", str(e),
+                    quota=key_pool.all_exhausted("Gemini", parse_api_keys(gemini_api_key))
+                )
+                raise
+            engine_health.record_success("Gemini")
             
             if response.text:
                 return response.text.strip(), "Gemini"
@@ -214,6 +214,165 @@ def _translate_chunk(text: str, engine_name: str, source_lang: str, deepl_api_ke
     return text, "None"
 
 
+def _translate_with_free_engine(text: str, engine: str, source_lang: str) -> str:
+    """
+    Google / MyMemory で1回翻訳する（失敗時は例外をそのまま送出する）
+    """
+    rate_limiter.acquire(engine, chars=len(text))
+    if engine == "Google":
+        return GoogleTranslator(source=source_lang, target='ja').translate(text)
+    mem_source = source_lang if source_lang != 'auto' else 'zh-CN'
+    return MyMemoryTranslator(source=mem_source, target='ja-JP').translate(text)
+
+
+def _plan_packs(texts: List[str], max_chars: int) -> List[List[int]]:
+    """
+    連続する段落を区切り記号込みでmax_chars以下になるようにまとめる
+    上限を超える段落や区切り記号を含む段落は単独のグループにする
+    Returns: 段落インデックスのリストのリスト
+    """
+    groups = []
+    current = []
+    current_len = 0
+    
+    for i, text in enumerate(texts):
+        if len(text) > max_chars or "|||" in text:
+            if current:
+                groups.append(current)
+                current = []
+                current_len = 0
+            groups.append([i])
+            continue
+        
+        added = len(text) + (len(PACK_DELIMITER) if current else 0)
+        if current and (current_len + added > max_chars or len(current) >= PACK_MAX_ITEMS):
+            groups.append(current)
+            current = []
+            current_len = 0
+            added = len(text)
+        current.append(i)
+        current_len += added
+    
+    if current:
+        groups.append(current)
+    
+    return groups
+
+
+def _translate_pack(texts: List[str], engine_name: str, source_lang: str):
+    """
+    複数の短い段落を区切り記号で連結して1回で翻訳し、段落ごとに分割して返す
+    Returns: [(translated_text, used_engine), ...] / 分割数が一致しない場合はNone
+    """
+    res_text, used_engine = _translate_chunk(PACK_DELIMITER.join(texts), engine_name, source_lang)
+    if "Failed" in used_engine:
+        return None
+    
+    segments = [seg.strip() for seg in PACK_SPLIT_PATTERN.split(res_text.strip())]
+    if len(segments) != len(texts):
+        return None
+    
+    return [(seg if seg else text, used_engine) for seg, text in zip(segments, texts)]
+
+
+def _plan_deepl_batches(texts: List[str]) -> List[List[int]]:
+    """
+    連続する段落をDeepLの1リクエスト上限（テキスト数・サイズ）に収まるようにまとめる
+    Returns: 段落インデックスのリストのリスト
+    """
+    batches = []
+    current = []
+    current_bytes = 0
+    
+    for i, text in enumerate(texts):
+        # フォームエンコード後のサイズで見積もる（中国語は1文字9バイト程度になる）
+        size = len(quote_plus(text)) + len("&text=")
+        if current and (len(current) >= DEEPL_MAX_TEXTS_PER_REQUEST or current_bytes + size > DEEPL_MAX_REQUEST_BYTES):
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(i)
+        current_bytes += size
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+
+def _translate_deepl_batch(texts: List[str], source_lang: str, deepl_api_key: str = None) -> List[tuple]:
+    """
+    DeepL APIに複数のtextパラメータをまとめて送信する（レスポンスは入力順）
+    Returns: [(translated_text, used_engine), ...]
+    """
+    keys = parse_api_keys(deepl_api_key)
+    if not keys:
+        return [(t, "Failed (No API Key)") for t in texts]
+    try:
+        # DeepL Direct API Implementation
+        # Determine endpoint and source mapping
+        # DeepL source for Chinese is 'ZH' per docs
+        # If auto, omit source_lang
+        
+        # 同名パラメータを複数送るためタプルのリストで渡す
+        params = [('text', t) for t in texts]
+        params.append(('target_lang', 'JA'))
+        
+        if source_lang != 'auto':
+            s_upper = source_lang.upper()
+            if s_upper in ['ZH-CN', 'ZH-TW', 'ZH-HANS', 'ZH-HANT', 'ZH']:
+                params.append(('source_lang', 'ZH'))
+            elif s_upper == 'JA':
+                return [(t, "DeepL (Skipped: Source=Target)") for t in texts]
+            else:
+                params.append(('source_lang', s_upper))
+        
+        # 複数キーが設定されている場合は、残り枠の多いキーから順に使い、
+        # 429 / 456（文字数上限）が返ったキーは休ませて次のキーで再送する
+        results = None
+        for key in key_pool.ordered("DeepL", keys):
+            try:
+                rate_limiter.acquire("DeepL", key, chars=sum(len(t) for t in texts))
+            except QuotaExhaustedError as e:
+                key_pool.mark_exhausted("DeepL", key, str(e))
+                results = [(t, f"DeepL (Error: {e})") for t in texts]
+                continue
+
+            is_free = key.endswith(':fx')
+            base_url = "https://api-free.deepl.com/v2/translate" if is_free else "https://api.deepl.com/v2/translate"
+            headers = {
+                'Authorization': f'DeepL-Auth-Key {key}'
+            }
+
+            try:
+                resp = requests.post(base_url, data=params, headers=headers, timeout=10 + 2 * len(texts))
+                
+                if resp.status_code == 200:
+                    data = resp.json()
+                    translations = data.get('translations', [])
+                    if len(translations) != len(texts):
+                        return [(t, "DeepL (Empty Response)") for t in texts]
+                    engine_health.record_success("DeepL")
+                    return [(tr.get('text', t), "DeepL") for t, tr in zip(texts, translations)]
+                results = [(t, f"DeepL (Error: {resp.status_code} - {resp.text[:50]})") for t in texts]
+                if resp.status_code in (429, 456):
+                    key_pool.mark_exhausted("DeepL", key, resp.text)
+                    continue
+                break
+                    
+            except Exception as e:
+                results = [(t, f"DeepL (NetError: {str(e)[:50]})") for t in texts]
+                break
+        # 全キーで失敗した場合のみエンジンの失敗として記録する
+        engine_health.record_failure(
+            "DeepL", results[0][1] if results else "",
+            quota=key_pool.all_exhausted("DeepL", keys)
+        )
+        return results
+    except Exception as e:
+        return [(t, f"DeepL (SetupError: {str(e)})") for t in texts]
+
+
 def ocr_and_translate_image(image_bytes: bytes, mime_type: str, gemini_api_key: str, model_name: str = "gemini-2.0-flash") -> dict:
     """
     OCR and translate an image using Gemini.
@@ -223,9 +382,6 @@ def ocr_and_translate_image(image_bytes: bytes, mime_type: str, gemini_api_key:
         return {"error": "Gemini API Key is required for OCR."}
 
     try:
-        genai.configure(api_key=gemini_api_key)
-        model = genai.GenerativeModel(model_name)
-
         prompt = """
         Please transcribe the text in this image (likely Chinese) and translate it into natural Japanese.
         Format your response as a JSON object with the following keys:
@@ -234,10 +390,16 @@ def ocr_and_translate_image(image_bytes: bytes, mime_type: str, gemini_api_key:
         Do not add any other text outside the JSON.
         """
 
-        response = model.generate_content([
-            prompt,
-            {"mime_type": mime_type, "data": image_bytes}
-        ])
+        def generate(key):
+            rate_limiter.acquire("Gemini", key, chars=len(prompt))
+            # 複数画像の並列OCRは "OCR" コントローラーが429に応じて同時実行数を絞る
+            with get_limiter("OCR").slot():
+                return get_model(key, model_name).generate_content([
+                    prompt,
+                    {"mime_type": mime_type, "data": image_bytes}
+                ])
+
+        response = call_with_failover("Gemini", gemini_api_key, generate)
 
         if not response.text:
             return {"error": "Gemini returned an empty response."}
@@ -266,9 +428,10 @@ def get_available_models(api_key: str):
     List available Gemini models for the provided API key.
     """
     try:
-        genai.configure(api_key=api_key)
         models = []
-        for m in genai.list_models():
+        # 複数キーの場合は先頭のキーで一覧を取得する（モデル一覧はキーによらず同じ）
+        keys = parse_api_keys(api_key)
+        for m in genai.list_models(client=get_model_client(keys[0] if keys else api_key)):
             if 'generateContent' in m.supported_generation_methods:
                 models.append(m.name)
         return models
@@ -276,55 +439,287 @@ def get_available_models(api_key: str):
         return [f"Error listing models: {str(e)}"]
 
 
-def translate_batch_gemini(paragraphs: List[dict], source_lang: str, gemini_api_key: str, output_placeholder, status_area, model_name: str = "gemini-3-flash-preview", engine_label: str = "Gemini (Batch)", progress_placeholder=None):
+def _gemini_batch_prompt(indices: List[int], texts: List[str]) -> str:
     """
-    Translate all paragraphs in a single batch request using line-based format for robustness.
+    一括翻訳用のプロンプトを組み立てる（各ブロックの先頭に <<段落番号>> マーカーを付ける）
     """
-    if not paragraphs:
-        return []
-
-    # Prepare batch input with clear separators
-    # JSON is fragile. We use a custom separator that is unlikely to appear in text.
-    # But simple newline might be safest if we instruct properly.
-    # Let's use "|||" as separator for input and output to be safe against newlines in text.
+    # JSON is fragile, and a plain separator silently shifts every later block when one is dropped.
+    # Each block is tagged with its paragraph index so the output can be routed (and checked) per block.
+    combined_text = "\n".join(f"<<{i}>>\n{text}" for i, text in zip(indices, texts))
     
-    texts = [p.get("text", "") for p in paragraphs]
-    combined_text = "\n|||\n".join(texts)
-    
-    # Configure Gemini
-    genai.configure(api_key=gemini_api_key)
-    model = genai.GenerativeModel(model_name)
-    
-    # Safety settings to avoid blocking content (Apply here too!)
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-    ]
-    
-    # Prompt
-    prompt = f"""
+    return f"""
     You are a professional translator. 
-    Translate the following text blocks into natural Japanese.
-    The input blocks are separated by "|||".
+    Translate each of the following text blocks into natural Japanese.
+    Every block starts with a marker line such as <<12>>.
     
     IMPORTANT: 
-    1. Output MUST be separated by "|||" exactly matching the input structure.
-    2. Do NOT output JSON. Just the translated text blocks.
-    3. Maintain the order.
-    4. If a block is empty or just whitespace, keep it empty in output.
+    1. Start each translated block with exactly the same marker line as its input block.
+    2. Output every marker exactly once and in the same order. Never translate, renumber or merge markers.
+    3. Do NOT output JSON or explanations. Just the markers and the translated text blocks.
+    4. If a block is empty or just whitespace, output only its marker.
     
     Input:
     {combined_text}
     """
 
+
+class GeminiSegmentDemux:
+    """
+    ストリーミング出力を <<N>> マーカーで区切り、段落番号ごとに振り分ける。
+    受信済みのテキストは一度だけ走査し、マーカーの途中で切れた末尾だけを次回に持ち越す。
+    """
+    MARKER_PATTERN = re.compile(r"<<(\d+)>>")
+    PARTIAL_MARKER_PATTERN = re.compile(r"<(?:<\d*>?)?$")
+
+    def __init__(self, expected_indices: List[int]):
+        self.expected = set(expected_indices)
+        self.completed = {}  # index -> 確定したテキスト
+        self.current_index = None
+        self._current_parts = []
+        self._tail = ""
+
+    @property
+    def current_text(self) -> str:
+        return "".join(self._current_parts).strip()
+
+    def feed(self, text: str) -> List[tuple]:
+        """
+        受信テキストを処理する
+        Returns: [(index, text, is_final), ...] 確定した段落と、受信途中の段落のプレビュー
+        """
+        events = []
+        data = self._tail + text
+        self._tail = ""
+        pos = 0
+        for match in self.MARKER_PATTERN.finditer(data):
+            self._append(data[pos:match.start()])
+            self._finalize(events)
+            index = int(match.group(1))
+            # 想定外の番号や重複した番号の本文は捨てる
+            self.current_index = index if index in self.expected and index not in self.completed else None
+            pos = match.end()
+
+        rest = data[pos:]
+        # マーカーの途中（"<", "<<1" など）で切れている可能性がある末尾は持ち越す
+        partial = self.PARTIAL_MARKER_PATTERN.search(rest)
+        if partial:
+            self._tail = rest[partial.start():]
+            rest = rest[:partial.start()]
+        self._append(rest)
+
+        if self.current_index is not None and self.current_text:
+            events.append((self.current_index, self.current_text, False))
+        return events
+
+    def finish(self) -> List[tuple]:
+        """
+        ストリームの正常終了時に、最後の段落を確定する
+        """
+        events = []
+        self._append(self._tail)
+        self._tail = ""
+        self._finalize(events)
+        return events
+
+    @property
+    def missing(self) -> List[int]:
+        return sorted(self.expected - set(self.completed))
+
+    def _append(self, text: str):
+        if self.current_index is not None and text:
+            self._current_parts.append(text)
+
+    def _finalize(self, events: list):
+        if self.current_index is not None:
+            final_text = self.current_text
+            self.completed[self.current_index] = final_text
+            events.append((self.current_index, final_text, True))
+        self.current_index = None
+        self._current_parts = []
+
+
+def _stream_gemini_chunk(model_name: str, gemini_api_key: str, chunk_id: int, indices: List[int], texts: List[str], events: "queue.Queue"):
+    """
+    1つのサブバッチをストリーミング翻訳し、受信したテキストをイベントキューに流す（ワーカースレッド用）
+    イベント: ("delta", chunk_id, text) / ("done", chunk_id, None) / ("error", chunk_id, Exception)
+    複数キーが設定されている場合、受信開始前に429が返ったら次のキーで再送する。
+    """
+    prompt = _gemini_batch_prompt(indices, texts)
+    keys = parse_api_keys(gemini_api_key) or [gemini_api_key]
+    last_error = None
+    for key in key_pool.ordered("Gemini", keys):
+        received = False
+        try:
+            # 上限に達する場合は QuotaExhaustedError（"retry in XXs" 付き）として通常の429と同様に扱う
+            rate_limiter.acquire("Gemini", key, chars=len(prompt))
+            # 429・5xxで例外が発生すると、コントローラーが同時実行数を減らす
+            with get_limiter("Gemini").slot():
+                response = get_model(key, model_name).generate_content(
+                    prompt,
+                    safety_settings=SAFETY_SETTINGS,
+                    stream=True
+                )
+                for chunk in response:
+                    if chunk.text:
+                        received = True
+                        events.put(("delta", chunk_id, chunk.text))
+            engine_health.record_success("Gemini")
+            events.put(("done", chunk_id, None))
+            return
+        except Exception as e:
+            last_error = e
+            # 途中まで受信した場合は再送すると重複するため、未翻訳の段落として後で再開する
+            if received or not is_quota_error(str(e)):
+                break
+            key_pool.mark_exhausted("Gemini", key, str(e))
+    engine_health.record_failure("Gemini", str(last_error), quota=key_pool.all_exhausted("Gemini", keys))
+    events.put(("error", chunk_id, last_error))
+
+
+def _format_gemini_error(e: Exception, paragraphs: List[dict]) -> str:
+    """
+    Gemini APIのエラーを画面表示用のメッセージ（HTML）に変換する
+    """
+    error_message = str(e)
+    
+    # Friendly Error Message for Quota Exceeded (429)
+    if "429" in error_message or "quota" in error_message.lower():
+         # Try to extract "retry in XXs"
+         wait_time_msg = "しばらく時間を置いてから再試行してください（数分程度）。"
+         wait_seconds = _parse_retry_seconds(error_message)
+         if wait_seconds is not None:
+             wait_time_msg = f"約 {int(wait_seconds) + 1} 秒待機してから再試行してください。"
+         
+         # Sophisticated HTML Error Message
+         # Check if this is just a Title (h1) or small single item
+         is_title = len(paragraphs) == 1 and paragraphs[0].get("tag") == "h1"
+         
+         if is_title:
+             # Simplified error for title to avoid duplication with body error
+             # Use HTML span that fits inside H3
+             error_message = f"<span style='color: #be123c; font-size: 0.7em; font-weight: normal;'>⚠️ タイトル翻訳失敗: {str(e)[:50]}...</span>"
+         else:
+             error_message = f"""
+             <div style="
+                background-color: #fff1f2; 
+                border: 1px solid #fda4af; 
+                border-radius: 8px; 
+                padding: 16px; 
+                color: #be123c; 
+                font-family: sans-serif;
+                margin-bottom: 10px;
+             ">
+                <div style="display: flex; align-items: start; gap: 10px;">
+                    <div style="font-size: 1.5em;">⚠️</div>
+                    <div>
+                         <div style="font-weight: bold; font-size: 1.1em; margin-bottom: 5px;">Gemini 利用制限 (Quota)</div>
+                         <div style="font-size: 0.9em; line-height: 1.6;">
+                             APIの利用制限に達しました。{wait_time_msg}
+                         </div>
+                         <div style="
+                             background-color: #ffffff;
+                             border: 1px solid #fecdd3;
+                             border-radius: 6px;
+                             padding: 10px;
+                             margin-top: 10px;
+                             font-size: 0.85em;
+                             color: #881337;
+                         ">
+                             <strong>【対処法】</strong>
+                             <ul style="margin: 5px 0 0 18px; padding: 0;">
+                                 <li>別のGoogleアカウントのAPIキーを追加する（カンマ区切りで複数登録すると自動で切り替えます）</li>
+                                 <li>Google Cloudの有料プラン(Pay-as-you-go)を有効にする</li>
+                             </ul>
+                         </div>
+                        <details style="margin-top: 10px; font-size: 0.8em; color: #9f1239; opacity: 0.8; cursor: pointer;">
+                            <summary style="margin-bottom: 5px;">詳細エラーを表示</summary>
+                            <div style="word-break: break-all; padding: 10px; background: rgba(255,255,255,0.5); border-radius: 4px;">
+                                {str(e)}
+                            </div>
+                        </details>
+                    </div>
+                </div>
+             </div>
+             """
+    
+    return error_message
+
+
+def _parse_retry_seconds(error_text: str):
+    """
+    エラーメッセージから "retry in XXs" の待機秒数を取り出す（無い場合はNone）
+    """
+    retry_match = re.search(r"retry in ([0-9\.]+)s", error_text)
+    if retry_match:
+        try:
+            return float(retry_match.group(1))
+        except ValueError:
+            return None
+    return None
+
+
+def _set_error_banner(html):
+    """
+    画面上部のエラーバナーを設定する。
+    バックグラウンドジョブ内ではセッション状態に触れられないため、ジョブに記録して画面側で反映する
+    """
+    job = current_job()
+    if job is not None:
+        job.set_banner(html)
+    else:
+        st.session_state["v9_error_banner_html"] = html
+
+
+def _render_gemini_segment(placeholders: list, index: int, text: str, final: bool):
+    """
+    ストリーミング中の段落を該当するプレースホルダーに描画する
+    """
+    if index >= len(placeholders) or placeholders[index] is None:
+        return
+    ph = placeholders[index]
+    if final:
+        # fadeIn の @keyframes は app.py の共通CSSで定義している（段落ごとに<style>を送らない）
+        ph.markdown(f"<div style='color:#334155; line-height:1.8; font-size:15px; animation: fadeIn 0.5s;'>{text}</div>", unsafe_allow_html=True)
+    elif text:
+        # Show accumulating text for current paragraph
+        ph.markdown(f"<div style='color:#334155; line-height:1.8; font-size:15px; opacity: 0.7;'>{text}▌</div>", unsafe_allow_html=True)
+
+
+def _gemini_preview_text(paragraphs: List[dict], live_texts: List[str]) -> str:
+    """
+    単一プレースホルダーの場合の表示内容（受信済みの段落を原文順にまとめる）
+    """
+    preview = ""
+    for p, t_text in zip(paragraphs, live_texts):
+        if t_text is None:
+            continue
+        tag = p.get("tag", "p")
+        header_prefix = "## " if tag == 'h2' else "### " if tag == 'h3' else ""
+        preview += f"\n\n{header_prefix}{t_text}\n\n"
+    return preview + "▌"
+
+
+def translate_batch_gemini(paragraphs: List[dict], source_lang: str, gemini_api_key: str, output_placeholder, status_area, model_name: str = "gemini-3-flash-preview", engine_label: str = "Gemini (Batch)", progress_placeholder=None):
+    """
+    Translate paragraphs in batch requests using line-based format for robustness.
+    長い記事は推定トークン数で段落境界ごとにサブバッチへ分割し、並列にストリーミング翻訳する。
+    """
+    if not paragraphs:
+        return []
+
+    texts = [p.get("text", "") for p in paragraphs]
+    chunks = plan_token_chunks(texts, GEMINI_CHUNK_TOKEN_BUDGET)
     
+    chunk_info = f", {len(chunks)} 分割" if len(chunks) > 1 else ""
     if progress_placeholder:
-         progress_placeholder.info(f"{engine_label} 一括翻訳中... ({len(texts)} 段落)")
+         progress_placeholder.info(f"{engine_label} 一括翻訳中... ({len(texts)} 段落{chunk_info})")
     else:
-         status_area.info(f"{engine_label} 一括翻訳中... ({len(texts)} 段落)")
-    if output_placeholder:
+         status_area.info(f"{engine_label} 一括翻訳中... ({len(texts)} 段落{chunk_info})")
+
+    # Row-by-row placeholders or a single container
+    is_row_mode = isinstance(output_placeholder, list)
+    placeholders = output_placeholder if is_row_mode else []
+    if output_placeholder and not is_row_mode:
         output_placeholder.markdown(
             """
             <div style="
@@ -346,129 +741,55 @@ def translate_batch_gemini(paragraphs: List[dict], source_lang: str, gemini_api_
             unsafe_allow_html=True
         )
 
-    full_response_text = ""
-    streaming_text = ""
-    error_message = None
+    # Per-chunk stream state
+    demuxes = [GeminiSegmentDemux(indices) for indices in chunks]
+    chunk_errors = {}
+    live_texts = [None] * len(texts)
+    # 受信中の描画は10Hzに間引く（確定した段落はすぐに描画する）
+    live_placeholders = throttle(placeholders)
+    live_output = throttle(output_placeholder) if output_placeholder and not is_row_mode else None
 
-    try:
-        response = model.generate_content(
-            prompt,
-            safety_settings=safety_settings,
-            stream=True
-        )
-        
-        # Stream response
-        if output_placeholder:
-             # Ensure it's a list for compatibility with verify
-             placeholders = output_placeholder if isinstance(output_placeholder, list) else [output_placeholder]
-        else:
-             placeholders = []
+    def apply_segments(segment_events):
+        for index, segment_text, is_final in segment_events:
+            live_texts[index] = segment_text
+            _render_gemini_segment(live_placeholders, index, segment_text, final=is_final)
+            if is_final and index < len(live_placeholders) and live_placeholders[index] is not None:
+                live_placeholders[index].flush()
 
-        # Stream response
-        accumulated_buffer = ""
-        current_paragraph_index = 0
-        
-        for chunk in response:
-            if chunk.text:
-                full_response_text += chunk.text
-                accumulated_buffer += chunk.text
-                
-                # Check for separators in the buffer
-                while "|||" in accumulated_buffer:
-                    # Found a complete paragraph
-                    split_idx = accumulated_buffer.find("|||")
-                    paragraph_text = accumulated_buffer[:split_idx].strip()
-                    accumulated_buffer = accumulated_buffer[split_idx + 3:]
-                    
-                    # Update current placeholder with FINAL text
-                    if current_paragraph_index < len(placeholders):
-                        ph = placeholders[current_paragraph_index]
-                         # Format nicely
-                        formatted_text = f"<div style='color:#334155; line-height:1.8; font-size:15px; animation: fadeIn 0.5s;'>{paragraph_text}</div>"
-                        # Extra CSS for fade-in
-                        ph.markdown(f"""
-                        <style>@keyframes fadeIn {{ from {{ opacity:0; }} to {{ opacity:1; }} }}</style>
-                        {formatted_text}
-                        """, unsafe_allow_html=True)
-                    
-                    current_paragraph_index += 1
-                
-                # Update the CURRENT (incomplete) paragraph with streaming text
-                if current_paragraph_index < len(placeholders):
-                    ph = placeholders[current_paragraph_index]
-                    # Show accumulating text for current paragraph
-                    # To avoid jitter, we might want to only update periodically or clean it?
-                    # Streamlit handles markdown updates reasonably well.
-                    preview_text = accumulated_buffer.strip()
-                    if preview_text:
-                         ph.markdown(f"<div style='color:#334155; line-height:1.8; font-size:15px; opacity: 0.7;'>{preview_text}▌</div>", unsafe_allow_html=True)
-                
-    except Exception as e:
-        error_message = str(e)
-        
-        # Friendly Error Message for Quota Exceeded (429)
-        if "429" in error_message or "quota" in error_message.lower():
-             # Try to extract "retry in XXs"
-             wait_time_msg = "しばらく時間を置いてから再試行してください（数分程度）。"
-             retry_match = re.search(r"retry in ([0-9\.]+)s", error_message)
-             if retry_match:
-                 wait_seconds = float(retry_match.group(1))
-                 wait_time_msg = f"約 {int(wait_seconds) + 1} 秒待機してから再試行してください。"
-             
-             # Sophisticated HTML Error Message
-             # Check if this is just a Title (h1) or small single item
-             is_title = len(paragraphs) == 1 and paragraphs[0].get("tag") == "h1"
-             
-             if is_title:
-                 # Simplified error for title to avoid duplication with body error
-                 # Use HTML span that fits inside H3
-                 error_message = f"<span style='color: #be123c; font-size: 0.7em; font-weight: normal;'>⚠️ タイトル翻訳失敗: {str(e)[:50]}...</span>"
-             else:
-                 error_message = f"""
-                 <div style="
-                    background-color: #fff1f2; 
-                    border: 1px solid #fda4af; 
-                    border-radius: 8px; 
-                    padding: 16px; 
-                    color: #be123c; 
-                    font-family: sans-serif;
-                    margin-bottom: 10px;
-                 ">
-                    <div style="display: flex; align-items: start; gap: 10px;">
-                        <div style="font-size: 1.5em;">⚠️</div>
-                        <div>
-                             <div style="font-weight: bold; font-size: 1.1em; margin-bottom: 5px;">Gemini 利用制限 (Quota)</div>
-                             <div style="font-size: 0.9em; line-height: 1.6;">
-                                 APIの利用制限に達しました。{wait_time_msg}
-                             </div>
-                             <div style="
-                                 background-color: #ffffff;
-                                 border: 1px solid #fecdd3;
-                                 border-radius: 6px;
-                                 padding: 10px;
-                                 margin-top: 10px;
-                                 font-size: 0.85em;
-                                 color: #881337;
-                             ">
-                                 <strong>【対処法】</strong>
-                                 <ul style="margin: 5px 0 0 18px; padding: 0;">
-                                     <li>別のGoogleアカウントのAPIキーを使用する</li>
-                                     <li>Google Cloudの有料プラン(Pay-as-you-go)を有効にする</li>
-                                 </ul>
-                             </div>
-                            <details style="margin-top: 10px; font-size: 0.8em; color: #9f1239; opacity: 0.8; cursor: pointer;">
-                                <summary style="margin-bottom: 5px;">詳細エラーを表示</summary>
-                                <div style="word-break: break-all; padding: 10px; background: rgba(255,255,255,0.5); border-radius: 4px;">
-                                    {str(e)}
-                                </div>
-                            </details>
-                        </div>
-                    </div>
-                 </div>
-                 """
+    events = queue.Queue()
+    limiter = get_limiter("Gemini")
+    with ThreadPoolExecutor(max_workers=min(limiter.max_limit, len(chunks))) as executor:
+        for chunk_id, indices in enumerate(chunks):
+            executor.submit(_stream_gemini_chunk, model_name, gemini_api_key, chunk_id, indices, [texts[i] for i in indices], events)
+
+        pending = len(chunks)
+        while pending:
+            kind, chunk_id, payload = events.get()
+            if kind == "delta":
+                apply_segments(demuxes[chunk_id].feed(payload))
+            else:
+                pending -= 1
+                if kind == "error":
+                    # 受信途中の段落は未確定のまま（未翻訳扱い）にする
+                    chunk_errors[chunk_id] = payload
+                else:
+                    apply_segments(demuxes[chunk_id].finish())
+            
+            if live_output:
+                live_output.markdown(lambda: _gemini_preview_text(paragraphs, live_texts))
+
+    flush_all(live_placeholders)
+    flush_all(live_output)
+
+    error_message = None
+    retry_after = None
+    if chunk_errors:
+        first_error = chunk_errors[min(chunk_errors)]
+        error_message = _format_gemini_error(first_error, paragraphs)
+        retry_after = _parse_retry_seconds(str(first_error))
         
         # Store full HTML error in session state for banner display
-        st.session_state["v9_error_banner_html"] = error_message
+        _set_error_banner(error_message)
         
         # Return a clean message for the result column
         column_error = f"""
@@ -477,7 +798,7 @@ def translate_batch_gemini(paragraphs: List[dict], source_lang: str, gemini_api_
         </div>
         """
         
-        if not full_response_text:
+        if not any(demux.completed or demux.current_text for demux in demuxes):
             # Failed completely at start. Return error as text for the first block so it persists.
             results = []
             for i, p in enumerate(paragraphs):
@@ -485,38 +806,41 @@ def translate_batch_gemini(paragraphs: List[dict], source_lang: str, gemini_api_
                     results.append({
                         "text": column_error, 
                         "engine": "Gemini (Error)",
-                        "tag": "div"
+                        "tag": "div",
+                        "missing": True,
+                        "retry_after": retry_after
                     })
                 else:
                     results.append({
                         "text": "...", 
                         "engine": "Gemini (Error)",
-                        "tag": "p"
+                        "tag": "p",
+                        "missing": True
                     })
             return results
 
-    # Split by separator
-    translated_texts = full_response_text.split("|||")
-    
-    # Clean up
-    translated_texts = [t.strip() for t in translated_texts]  # Allow empty strings if valid
-    
-    # Handle length mismatch
-    if len(translated_texts) < len(texts):
-        shortage = len(texts) - len(translated_texts)
-        suffix = f"<br><span style='color:red; font-size:0.8em;'>⚠️ 翻訳停止 (詳細エラーは上部に表示)</span>" if error_message else " (中断)"
-        if error_message:
-             # If we have partial results but also an error, we should inject the error message somewhere visible.
-             # Maybe append it to the last valid text or the first text?
-             # For now, if we have partials, status_area IS useful.
-             # But user wants single area.
-             # Let's append the HTML error to the *next* block (the first failed one) to show where it stopped.
-             translated_texts.append(error_message) # This becomes the first "missing" block
-             shortage -= 1 # We filled one
-             
-        translated_texts.extend([f"..."] * shortage)
-    elif len(translated_texts) > len(texts):
-         translated_texts = translated_texts[:len(texts)]
+    # Collect segments by index. Anything the model dropped (or did not reach) is flagged as missing.
+    translated_texts = [None] * len(texts)
+    missing_indices = set()
+    retry_hints = {}
+    for chunk_id, demux in enumerate(demuxes):
+        for index, segment_text in demux.completed.items():
+            translated_texts[index] = segment_text
+        chunk_missing = demux.missing
+        if not chunk_missing:
+            continue
+        missing_indices.update(chunk_missing)
+        if chunk_id in chunk_errors:
+            # Put the HTML error on the first failed block to show where it stopped.
+            translated_texts[chunk_missing[0]] = error_message
+            retry_hints[chunk_missing[0]] = retry_after
+        else:
+            # 区切りの欠落だけならすぐに再送できる
+            retry_hints[chunk_missing[0]] = 0
+    
+    for index in missing_indices:
+        if translated_texts[index] is None:
+            translated_texts[index] = "..."
     
     results = []
     ui_accumulated_text = ""
@@ -534,32 +858,64 @@ def translate_batch_gemini(paragraphs: List[dict], source_lang: str, gemini_api_
             "engine": current_engine,
             "tag": p.get("tag", "p")
         }
+        if i in missing_indices:
+            # 未翻訳の段落（再開時にこの段落だけを再送する）
+            item["engine"] = "Gemini (Error)"
+            item["missing"] = True
+            if i in retry_hints:
+                item["retry_after"] = retry_hints[i]
         results.append(item)
         
         tag = p.get("tag", "p")
         header_prefix = "## " if tag == 'h2' else "### " if tag == 'h3' else ""
         ui_accumulated_text += f"\n\n{header_prefix}{t_text}\n\n"
 
-    if output_placeholder:
+    if is_row_mode:
+        # Make sure every row shows its final text (incl. padded/error rows)
+        for i, item in enumerate(results):
+            if live_texts[i] != item["text"]:
+                _render_gemini_segment(placeholders, i, item["text"], final=True)
+    elif output_placeholder:
          output_placeholder.markdown(ui_accumulated_text)
 
-    if error_message:
-        # Error is already in the results text, so just log or show a small warning if needed
-        # But user wants NO duplication.
-        # status_area.error(...) -> Removed
-        pass
-    else:
+    if not missing_indices:
         status_area.success(f"Gemini (Batch) 翻訳完了！")
         
     return results
 
 
-def translate_paragraphs(paragraphs: List[dict], engine_name="Google", source_lang="auto", deepl_api_key: str = None, gemini_api_key: str = None, output_placeholder=None, model_name=None, progress_placeholder=None, item_id_prefix=None, status_placeholder=None):
+def translate_paragraphs(paragraphs: List[dict], engine_name="Google", source_lang="auto", deepl_api_key: str = None, gemini_api_key: str = None, output_placeholder=None, model_name=None, progress_placeholder=None, item_id_prefix=None, status_placeholder=None, previous_results: List[dict] = None, hedge: bool = None, title: str = None, previous_title: str = None):
     """
     段落ごとに翻訳する（長い段落は自動分割）
     output_placeholder: Streamlit placeholder to render results incrementally
     status_placeholder: Streamlit placeholder to render status messages (moved to top)
+    previous_results: 途中で失敗した前回の翻訳結果。指定すると未翻訳の段落だけを翻訳して結合する
+    hedge: p90を超えて返らないリクエストを副エンジンにも送る（None の場合は画面の設定に従う）
+    title: 記事タイトル。指定すると本文と同じリクエストで翻訳し、(翻訳結果リスト, タイトル訳) を返す
+    previous_title: 再開時の前回のタイトル訳（未翻訳ならNone）
     """
+    if hedge is None:
+        hedge = bool(st.session_state.get("hedge_translation", False))
+
+    if title is not None:
+        # タイトルを本文の末尾に加えて1回で翻訳する（Geminiでは利用枠1回分で済む）
+        # 行ごとのプレースホルダーは本文の行数分しか無いため、タイトルは描画されない
+        combined = list(paragraphs) + [{"tag": "h1", "text": title}]
+        combined_previous = None
+        if previous_results is not None:
+            title_item = {"text": previous_title, "engine": engine_name, "tag": "h1"} if previous_title else None
+            combined_previous = list(previous_results) + [title_item]
+        results = translate_paragraphs(combined, engine_name, source_lang, deepl_api_key, gemini_api_key, output_placeholder, model_name, progress_placeholder, item_id_prefix, status_placeholder, combined_previous, hedge=hedge)
+        title_item = results[-1]
+        # タイトルだけ未翻訳の場合は原題を表示し、次回の再開で翻訳する
+        translated_title = title if is_missing_translation(title_item) else title_item["text"]
+        return results[:-1], translated_title
+
+    if previous_results is not None and len(previous_results) == len(paragraphs):
+        def translate_missing(sub_paragraphs, sub_placeholder):
+            return translate_paragraphs(sub_paragraphs, engine_name, source_lang, deepl_api_key, gemini_api_key, sub_placeholder, model_name, progress_placeholder, item_id_prefix, status_placeholder, hedge=hedge)
+        return _resume_paragraphs(paragraphs, previous_results, output_placeholder, item_id_prefix, translate_missing)
+
     translated_data = []
     total = len(paragraphs)
     
@@ -600,111 +956,99 @@ def translate_paragraphs(paragraphs: List[dict], engine_name="Google", source_la
              gemini_model_name = "gemini-2.5-flash" # Use 2.5 flash as safe default per user feedback
 
         # Exception handling is done inside translate_batch_gemini
-        return translate_batch_gemini(paragraphs, source_lang, gemini_api_key, output_placeholder, status_area, model_name=gemini_model_name, engine_label=f"Gemini ({gemini_model_name})", progress_placeholder=progress_placeholder)
+        results = translate_batch_gemini(paragraphs, source_lang, gemini_api_key, output_placeholder, status_area, model_name=gemini_model_name, engine_label=f"Gemini ({gemini_model_name})", progress_placeholder=progress_placeholder)
+
+        # 欠落した段落や、利用制限 (429) で待機時間が短い場合は未翻訳の段落だけを自動再送する
+        for _ in range(GEMINI_AUTO_RETRY_LIMIT):
+            retry_after = next((r.get("retry_after") for r in results if r.get("retry_after") is not None), None)
+            if retry_after is None or retry_after > GEMINI_AUTO_RETRY_MAX_WAIT:
+                break
+            _wait_for_retry(status_area, retry_after)
+            results = _resume_paragraphs(
+                paragraphs, results, output_placeholder, item_id_prefix,
+                lambda sub_paragraphs, sub_placeholder: translate_batch_gemini(sub_paragraphs, source_lang, gemini_api_key, sub_placeholder, status_area, model_name=gemini_model_name, engine_label=f"Gemini ({gemini_model_name})", progress_placeholder=progress_placeholder)
+            )
+        return results
 
-    # ... (Original loop for other engines)
+    # ... (Concurrent translation for other engines)
     
     # Header for streaming view - ONY if single placeholder
     if output_placeholder and not isinstance(output_placeholder, list):
         output_placeholder.markdown("### 翻訳プレビュー (生成中...)")
     
-    streaming_text = ""
+    translated_data = [None] * total
+    long_count = sum(1 for p in paragraphs if len(p.get("text", "")) > CHAR_LIMIT)
 
-    for i, p in enumerate(paragraphs):
-        # ... (rest of the loop)
-        text = p.get("text", "")
-        tag = p.get("tag", "p")
-        
-        # Update custom progress bar
-        progress = (i + 1) / total
-        percent = int(progress * 100)
-        
-        bar_html = f"""
-        <div style="margin-bottom: 5px; font-weight: bold; color: #475569;">翻訳中: {i+1}/{total} 段落</div>
-        <div style="
-            background-color: #f1f5f9;
-            width: 100%;
-            height: 8px;
-            border-radius: 4px;
-            overflow: hidden;
-            margin-bottom: 15px;
-        ">
-            <div style="
-                background-color: #3b82f6;
-                width: {percent}%;
-                height: 100%;
-                border-radius: 4px;
-                transition: width 0.3s ease;
-            "></div>
-        </div>
-        """
-        progress_placeholder.markdown(bar_html, unsafe_allow_html=True)
-        
-        # 長文の場合は分割処理中であることを表示
-        char_info = f" ({len(text)}文字)" if len(text) > CHAR_LIMIT else ""
-        status_area.markdown(f"""
-            <div style="
-                padding: 12px 16px;
-                border-radius: 8px;
-                background: linear-gradient(135deg, #f0f9ff 0%, #e0f2fe 100%);
-                border: 1px solid #bae6fd;
-                color: #0369a1;
-                font-weight: 500;
-            ">
-                <strong>{engine_name}</strong> で翻訳中... ({i+1}/{total} 段落){char_info}
-            </div>
-        """, unsafe_allow_html=True)
-        
-        # 翻訳実行（長文は自動分割）
-        # Geminiの場合はレート制限対策として少し待機
-        if engine_name == "Gemini":
-            time.sleep(2.0) # Rate limit wait
-        
-        res_text, used_engine = translate_single_text(text, engine_name, source_lang, deepl_api_key, gemini_api_key)
-        
-        # エラー判定
-        is_error = False
-        if engine_name == "Gemini" and ("Error" in used_engine or "Failed" in used_engine):
-             is_error = True
-             status_area.error(f"翻訳が中断されました: {used_engine}")
-        
-        # Append to result list
-        item = {
-            "text": str(res_text),
-            "engine": used_engine,
-            "tag": tag
-        }
-        translated_data.append(item)
-
-        # Update Streaming UI
-        if output_placeholder:
-            if isinstance(output_placeholder, list):
-                # Row-by-row update
-                if i < len(output_placeholder):
-                    ph = output_placeholder[i]
-                    # Format nicely with consistent style
-                    # Apply simple card style for consistency
-                    # Use item_id_prefix if available to support JS alignment
-                    div_id = f'{item_id_prefix}-{i}'
-                    formatted_text = f"""<div id="{div_id}" class="trans-paragraph-block" style='color:#334155; line-height:1.6; font-size:15px; animation: fadeIn 0.5s;'>{res_text}</div>"""
-                    ph.markdown(formatted_text, unsafe_allow_html=True)
-            else:
-                # Single container update (Legacy)
-                if tag == 'h2':
-                    streaming_text += f"\n\n## {res_text}\n\n"
-                elif tag == 'h3':
-                    streaming_text += f"\n\n### {res_text}\n\n"
-                else:
-                    streaming_text += f"\n\n{res_text}\n\n"
-                
-                # Show current state
-                with output_placeholder.container():
-                    st.markdown(streaming_text)
-                    if is_error:
-                        st.error(f"⚠️ エラーにより中断: {used_engine}")
+    def translate_each(indices):
+        # レート制限は各API呼び出しの直前で rate_limiter が必要な時間だけ待つ
+        return [translate_single_text(paragraphs[i].get("text", ""), engine_name, source_lang, deepl_api_key, gemini_api_key) for i in indices]
+
+    def translate_packed(indices):
+        texts = [paragraphs[i].get("text", "") for i in indices]
+        if len(texts) > 1:
+            packed = _translate_pack(texts, engine_name, source_lang)
+            if packed is not None:
+                return packed
+        # 分割に失敗したパックは段落ごとに翻訳し直す
+        return translate_each(indices)
+
+    def translate_deepl(indices):
+        return _translate_deepl_batch([paragraphs[i].get("text", "") for i in indices], source_lang, deepl_api_key)
+
+    # グループ（1リクエストで送る段落のまとまり）の分け方と、グループを翻訳する関数をエンジンごとに選ぶ
+    if engine_name in PACK_CHAR_LIMITS:
+        # 短い段落（キャプション・一行引用など）は区切り記号で連結して1リクエストにまとめる
+        groups = _plan_packs([p.get("text", "") for p in paragraphs], PACK_CHAR_LIMITS[engine_name])
+        translate_group = translate_packed
+    elif engine_name == "DeepL":
+        # DeepLは1リクエストで複数テキストを翻訳できるため、上限までまとめて送る
+        groups = _plan_deepl_batches([p.get("text", "") for p in paragraphs])
+        long_count = 0
+        translate_group = translate_deepl
+    else:
+        groups = [[i] for i in range(total)]
+        translate_group = translate_each
+
+    # レイテンシを記録しておき、ヘッジの待ち時間（p90）に使う
+    translate_group = _timed(engine_name, translate_group)
+
+    hedge_executor = None
+    if hedge and engine_name in HEDGE_SECONDARY_ENGINES:
+        # 同時実行数の上限（AIMDコントローラーの最大値）の全グループが、主・副の2リクエストを同時に送れる大きさにする
+        hedge_executor = ThreadPoolExecutor(max_workers=2 * get_limiter(engine_name).max_limit)
+        translate_group = _hedged(
+            engine_name,
+            translate_group,
+            _hedge_secondary_group(paragraphs, engine_name, source_lang, deepl_api_key, gemini_api_key),
+            hedge_executor,
+        )
+
+    _render_translation_progress(progress_placeholder, status_area, engine_name, 0, total, long_count)
+
+    # 完了した段落の描画と進捗表示は10Hzに間引く（単一プレースホルダーは毎回全文を描き直すため）
+    live_output = throttle(output_placeholder) if output_placeholder else None
+    live_progress = throttle(progress_placeholder)
+    live_status = throttle(status_area)
+
+    done = 0
+    for indices, results in _run_concurrently(groups, translate_group, get_limiter(engine_name)):
+        for i, (res_text, used_engine) in zip(indices, results):
+            translated_data[i] = {
+                "text": str(res_text) if res_text is not None else paragraphs[i].get("text", ""),
+                "engine": used_engine,
+                "tag": paragraphs[i].get("tag", "p")
+            }
+            done += 1
+            _render_translated_item(live_output, translated_data, i, item_id_prefix)
+
+        # 完了数ベースで進捗を更新
+        _render_translation_progress(live_progress, live_status, engine_name, done, total, long_count)
+
+    flush_all(live_output)
 
-        if is_error:
-             break
+    if hedge_executor:
+        # 負けたほうのリクエストは中断できないため、完了を待たずに結果を捨てる
+        hedge_executor.shutdown(wait=False)
 
     # Clear progress UI when done
     progress_placeholder.empty()
@@ -712,13 +1056,293 @@ def translate_paragraphs(paragraphs: List[dict], engine_name="Google", source_la
     return translated_data
 
 
+def is_missing_translation(item: dict) -> bool:
+    """
+    翻訳結果の段落が未翻訳（途中失敗で残ったもの）かどうか
+    """
+    return item is None or bool(item.get("missing"))
+
+
+def reuse_aligned_translations(base_paragraphs: List[dict], base_results: List[dict], paragraphs: List[dict], engine_name: str) -> List[dict]:
+    """
+    転載記事など、翻訳済みの記事（base）とほぼ同じ記事の段落を差分エンジンで対応付け、
+    同一（equal）の段落には翻訳済みの結果を引き継いだ previous_results を作る。
+    追加・置換された段落は未翻訳として残すため、translate_paragraphs(previous_results=...) でその段落だけを翻訳できる。
+    """
+    previous = [
+        {"text": p.get("text", ""), "engine": engine_name, "tag": p.get("tag", "p"), "missing": True}
+        for p in paragraphs
+    ]
+    if len(base_results) != len(base_paragraphs):
+        return previous
+    opcodes = diff_opcodes([p.get("text", "") for p in base_paragraphs], [p.get("text", "") for p in paragraphs])
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != "equal":
+            continue
+        for i, j in zip(range(i1, i2), range(j1, j2)):
+            if not is_missing_translation(base_results[i]):
+                previous[j] = dict(base_results[i], tag=paragraphs[j].get("tag", "p"))
+    return previous
+
+
+def _resume_paragraphs(paragraphs: List[dict], previous_results: List[dict], output_placeholder, item_id_prefix, translate_fn):
+    """
+    前回の結果のうち翻訳済みの段落はそのまま残し、未翻訳の段落だけを翻訳して結合する
+    translate_fn: (未翻訳の段落リスト, 対応するプレースホルダー) -> 翻訳結果リスト
+    """
+    missing = [i for i, item in enumerate(previous_results) if is_missing_translation(item)]
+    if not missing:
+        return previous_results
+
+    # 翻訳済みの段落は先に描画しておく（先行翻訳の結果を引き継いだ場合など、まだ画面に出ていないため）
+    if output_placeholder:
+        done = [None if is_missing_translation(item) else item for item in previous_results]
+        if isinstance(output_placeholder, list):
+            for i, item in enumerate(done):
+                if item is not None:
+                    _render_translated_item(output_placeholder, done, i, item_id_prefix)
+        else:
+            _render_translated_item(output_placeholder, done, 0, item_id_prefix)
+
+    # 行ごとのプレースホルダーなら未翻訳の行だけを渡す（行の無い段落はNoneで描画しない）
+    sub_placeholder = None
+    if isinstance(output_placeholder, list):
+        sub_placeholder = [output_placeholder[i] if i < len(output_placeholder) else None for i in missing]
+
+    sub_results = translate_fn([paragraphs[i] for i in missing], sub_placeholder)
+
+    merged = list(previous_results)
+    for i, item in zip(missing, sub_results):
+        merged[i] = item
+
+    if not any(is_missing_translation(item) for item in merged):
+        _set_error_banner(None)
+
+    if output_placeholder and not isinstance(output_placeholder, list):
+        _render_translated_item(output_placeholder, merged, 0, item_id_prefix)
+    return merged
+
+
+def _wait_for_retry(status_area, seconds: float):
+    """
+    利用制限の解除を待つ（残り秒数をステータスに表示）
+    """
+    if seconds <= 0:
+        return
+    remaining = int(seconds) + 1
+    while remaining > 0:
+        status_area.info(f"⏳ Geminiの利用制限のため、{remaining} 秒後に未翻訳の段落から自動で再開します...")
+        time.sleep(1)
+        remaining -= 1
+
+
+def _run_concurrently(groups: List[List[int]], worker, limiter):
+    """
+    段落インデックスのグループを並列に処理し、完了した順に (indices, results) を返すジェネレータ。
+    Streamlitの描画はスクリプトスレッドからのみ行えるため、workerはAPI呼び出しだけを行い、
+    プレースホルダーの更新は呼び出し側（メインスレッド）で行う。
+    同時実行数は limiter（AIMDコントローラー）が決め、スレッドプールはその上限の大きさで用意する。
+    """
+    if not groups:
+        return
+
+    def run_group(indices):
+        with limiter.slot() as slot:
+            results = worker(indices)
+            slot.outcome = _classify_results(results)
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(limiter.max_limit, len(groups)))) as executor:
+        futures = {executor.submit(run_group, indices): indices for indices in groups}
+        for future in as_completed(futures):
+            indices = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [(None, f"Failed ({str(e)[:50]})")] * len(indices)
+            yield indices, results
+
+
+def _timed(engine_name: str, worker):
+    """
+    workerの所要時間をエンジンのレイテンシとして記録するラッパー
+    """
+    def run(indices):
+        started = time.monotonic()
+        results = worker(indices)
+        engine_health.record_latency(engine_name, time.monotonic() - started)
+        return results
+    return run
+
+
+def _hedge_secondary_group(paragraphs: List[dict], engine_name: str, source_lang: str, deepl_api_key: str, gemini_api_key: str):
+    """
+    ヘッジ用の副リクエスト。副エンジンの文字数上限に収まらない段落を含む場合は、
+    同じエンジンへの重複リクエストにする。
+    """
+    secondary_engine = HEDGE_SECONDARY_ENGINES[engine_name]
+
+    def run(indices):
+        texts = [paragraphs[i].get("text", "") for i in indices]
+        target = secondary_engine
+        if any(len(t) > PACK_CHAR_LIMITS.get(secondary_engine, CHAR_LIMIT) for t in texts):
+            target = engine_name
+        results = []
+        for sub in _plan_packs(texts, PACK_CHAR_LIMITS.get(target, CHAR_LIMIT)):
+            sub_texts = [texts[i] for i in sub]
+            packed = _translate_pack(sub_texts, target, source_lang) if len(sub_texts) > 1 else None
+            if packed is None:
+                packed = [translate_single_text(t, target, source_lang, deepl_api_key, gemini_api_key) for t in sub_texts]
+            results.extend(packed)
+        return results
+    return run
+
+
+def _hedged(engine_name: str, primary, secondary, executor: ThreadPoolExecutor):
+    """
+    primary が p90 のレイテンシを過ぎても返らなければ secondary も送り、先に成功したほうの結果を使う。
+    待ち時間は primary が実際に動き始めてから数える（スレッドプールの空き待ちで余計なヘッジを送らない）。
+    どちらが勝ったか（両方失敗なら "failed"）は engine_health に記録する。
+    """
+    secondary_engine = HEDGE_SECONDARY_ENGINES[engine_name]
+
+    def run(indices):
+        started = threading.Event()
+
+        def run_primary():
+            started.set()
+            return primary(indices)
+
+        first = executor.submit(run_primary)
+        started.wait()
+        done, _ = wait([first], timeout=engine_health.hedge_delay(engine_name))
+        if done:
+            return first.result()
+
+        second = executor.submit(secondary, indices)
+        pending = {first, second}
+        fallback = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = [(None, f"Failed ({str(e)[:50]})")] * len(indices)
+                if _classify_results(results) == OUTCOME_OK:
+                    engine_health.record_hedge(engine_name, "primary" if future is first else secondary_engine)
+                    return results
+                fallback = fallback or results
+        # 両方失敗した場合はエラー表示付きの結果を返す
+        engine_health.record_hedge(engine_name, "failed")
+        return fallback
+
+    return run
+
+
+def _classify_results(results) -> str:
+    """
+    翻訳結果のエンジン表示（"Google (Fallback)"・"DeepL (Error: 429 - ...)" など）から、
+    グループ全体の結果を分類する（429 > timeout > error > ok の優先度）
+    """
+    outcomes = {classify_message(used_engine) for _, used_engine in results}
+    for outcome in (OUTCOME_THROTTLED, OUTCOME_TIMEOUT, OUTCOME_ERROR):
+        if outcome in outcomes:
+            return outcome
+    return OUTCOME_OK
+
+
+def _render_translation_progress(progress_placeholder, status_area, engine_name: str, done: int, total: int, long_count: int = 0):
+    """
+    完了段落数に基づいてプログレスバーとステータスを描画する
+    """
+    percent = int(done / total * 100) if total else 100
+    
+    bar_html = f"""
+    <div style="margin-bottom: 5px; font-weight: bold; color: #475569;">翻訳中: {done}/{total} 段落</div>
+    <div style="
+        background-color: #f1f5f9;
+        width: 100%;
+        height: 8px;
+        border-radius: 4px;
+        overflow: hidden;
+        margin-bottom: 15px;
+    ">
+        <div style="
+            background-color: #3b82f6;
+            width: {percent}%;
+            height: 100%;
+            border-radius: 4px;
+            transition: width 0.3s ease;
+        "></div>
+    </div>
+    """
+    progress_placeholder.markdown(bar_html, unsafe_allow_html=True)
+    
+    # 長文の場合は分割処理中であることを表示
+    char_info = f" (長文 {long_count} 段落は分割翻訳)" if long_count else ""
+    status_area.markdown(f"""
+        <div style="
+            padding: 12px 16px;
+            border-radius: 8px;
+            background: linear-gradient(135deg, #f0f9ff 0%, #e0f2fe 100%);
+            border: 1px solid #bae6fd;
+            color: #0369a1;
+            font-weight: 500;
+        ">
+            <strong>{engine_name}</strong> で翻訳中... ({done}/{total} 段落){char_info}
+        </div>
+    """, unsafe_allow_html=True)
+
+
+def _render_translated_item(output_placeholder, translated_data: List[dict], i: int, item_id_prefix=None):
+    """
+    翻訳が完了した段落をプレースホルダーに描画する。
+    リスト形式なら該当行のみ、単一プレースホルダーなら完了済みの段落を原文順に再描画する。
+    """
+    if not output_placeholder:
+        return
+
+    if isinstance(output_placeholder, list):
+        # Row-by-row update
+        if i < len(output_placeholder) and output_placeholder[i] is not None:
+            ph = output_placeholder[i]
+            # Use item_id_prefix if available to support JS alignment
+            div_id = f'{item_id_prefix}-{i}'
+            formatted_text = f"""<div id="{div_id}" class="trans-paragraph-block" style='color:#334155; line-height:1.6; font-size:15px; animation: fadeIn 0.5s;'>{translated_data[i]["text"]}</div>"""
+            ph.markdown(formatted_text, unsafe_allow_html=True)
+    else:
+        # Single container update (Legacy)
+        streaming_text = ""
+        for item in translated_data:
+            if item is None:
+                continue
+            if item["tag"] == 'h2':
+                streaming_text += f"\n\n## {item['text']}\n\n"
+            elif item["tag"] == 'h3':
+                streaming_text += f"\n\n### {item['text']}\n\n"
+            else:
+                streaming_text += f"\n\n{item['text']}\n\n"
+        output_placeholder.markdown(streaming_text)
+
+
 def get_deepl_usage(deepl_api_key: str) -> dict:
     """
-    DeepL APIの使用状況を取得する
+    DeepL APIの使用状況を取得する（複数キーの場合は全キーの合計）
     Returns: {'character_count': int, 'character_limit': int} or {'error': str}
     """
-    if not deepl_api_key:
+    keys = parse_api_keys(deepl_api_key)
+    if not keys:
         return {'error': 'API Key is empty'}
+    if len(keys) > 1:
+        usages = [get_deepl_usage(key) for key in keys]
+        errors = [u['error'] for u in usages if 'error' in u]
+        if len(errors) == len(usages):
+            return {'error': errors[0]}
+        return {
+            'character_count': sum(u.get('character_count', 0) for u in usages if 'error' not in u),
+            'character_limit': sum(u.get('character_limit', 0) for u in usages if 'error' not in u)
+        }
     
     is_free = deepl_api_key.endswith(':fx')
     base_url = "https://api-free.deepl.com/v2/usage" if is_free else "https://api.deepl.com/v2/usage"
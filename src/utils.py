@@ -1,13 +1,17 @@
 import base64
+import html
 import io
 import re
 import zipfile
 import requests
-from difflib import SequenceMatcher
 import streamlit as st
 from PIL import Image
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from src.concurrency import get_limiter, classify_status_code, thread_initializer
+from src.diff_engine import diff_sentences, grouped_opcodes, inline_opcodes, memoize_by_text_hash
 
 @st.cache_data(show_spinner=False)
 def fetch_image_data_v10(img_url: str, referer_url: str) -> tuple[Optional[str], str, str]:
@@ -27,7 +31,10 @@ def fetch_image_data_v10(img_url: str, referer_url: str) -> tuple[Optional[str],
                 "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
             }
         
-        resp = requests.get(img_url, headers=headers, timeout=10)
+        # 429・5xx・タイムアウトが続くと、画像取得の同時実行数が自動で減る
+        with get_limiter("image").slot() as slot:
+            resp = requests.get(img_url, headers=headers, timeout=10)
+            slot.outcome = classify_status_code(resp.status_code)
         
         if resp.status_code != 200 or len(resp.content) < 100:
             return None, "", ""
@@ -63,6 +70,17 @@ def fetch_image_data_v10(img_url: str, referer_url: str) -> tuple[Optional[str],
     except Exception:
         return None, "", ""
 
+def prefetch_images(img_urls: List[str], referer_url: str):
+    """
+    画像グリッドの描画前に、全画像を並列に取得して fetch_image_data_v10 のキャッシュを温める。
+    同時実行数は "image" コントローラーが調整し、スレッドプールはその上限の大きさで用意する。
+    """
+    if not img_urls:
+        return
+    limiter = get_limiter("image")
+    with ThreadPoolExecutor(max_workers=min(limiter.max_limit, len(img_urls)), initializer=thread_initializer()) as executor:
+        list(executor.map(lambda u: fetch_image_data_v10(u, referer_url), img_urls))
+
 def create_images_zip(urls, referer):
     buf = io.BytesIO()
     with zipfile.ZipFile(buf, "w") as zf:
@@ -81,70 +99,110 @@ def create_images_zip(urls, referer):
             except: continue
     return buf.getvalue()
 
-def make_diff_html(a, b):
-    """Generate side-by-side diff HTML with guaranteed row alignment using table layout."""
-    s_a = [s.strip() for s in re.split(r'([。！？\n]+)', a) if s.strip()]
-    s_b = [s.strip() for s in re.split(r'([。！？\n]+)', b) if s.strip()]
-    sm = SequenceMatcher(None, s_a, s_b)
-    
-    rows = []  # Will contain complete table rows
-    
-    # Cell style
-    cell_style = "padding:12px 16px; line-height:1.8; min-height:2em; color:#1e293b; border-bottom:1px solid #f1f5f9; vertical-align:top; width:50%;"
-    
-    row_id = 0
-    
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+# 差分表の既定値。一致部分は変更箇所の前後 DIFF_CONTEXT_LINES 文だけ表示し、ハンクはページ単位で送る
+DIFF_CONTEXT_LINES = 3
+DIFF_HUNKS_PER_PAGE = 50
+
+# 差分表のスタイルは app.py の共通CSS（.diff-table 以下）で定義し、セルごとに style 属性を繰り返さない
+_DIFF_ROW_TEMPLATES = {
+    'equal': '<tr><td>{l}</td><td>{r}</td></tr>',
+    'delete': '<tr><td class="d-del">{l}</td><td class="d-none"><i>（削除）</i></td></tr>',
+    'insert': '<tr><td class="d-none"><i>（追加）</i></td><td class="d-ins">{r}</td></tr>',
+    'replace': '<tr><td class="d-rep">{l}</td><td class="d-rep">{r}</td></tr>',
+    'replace_left': '<tr><td class="d-rep">{l}</td><td class="d-none"></td></tr>',
+    'replace_right': '<tr><td class="d-none"></td><td class="d-rep">{r}</td></tr>',
+}
+
+
+def _inline_diff_cells(l_text: str, r_text: str) -> tuple:
+    """
+    置換行の左右の文を文字単位で比較し、変更箇所を <mark> で囲んだHTMLを返す
+    """
+    l_parts, r_parts = [], []
+    for tag, i1, i2, j1, j2 in inline_opcodes(l_text, r_text):
+        l_chunk, r_chunk = html.escape(l_text[i1:i2]), html.escape(r_text[j1:j2])
+        if tag == 'equal':
+            l_parts.append(l_chunk)
+            r_parts.append(r_chunk)
+            continue
+        if l_chunk:
+            l_parts.append(f'<mark>{l_chunk}</mark>')
+        if r_chunk:
+            r_parts.append(f'<mark>{r_chunk}</mark>')
+    return "".join(l_parts), "".join(r_parts)
+
+
+def _diff_rows(s_a, s_b, opcodes) -> List[str]:
+    rows = []
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == 'equal':
-            # Same content in both
             for i in range(i1, i2):
-                l_cell = f'<td style="{cell_style} background-color:#ffffff;">{s_a[i]}</td>'
-                r_cell = f'<td style="{cell_style} background-color:#ffffff;">{s_a[i]}</td>'
-                rows.append(f'<tr data-sync-id="diff-{row_id}">{l_cell}{r_cell}</tr>')
-                row_id += 1
-                
+                text = html.escape(s_a[i])
+                rows.append(_DIFF_ROW_TEMPLATES['equal'].format(l=text, r=text))
         elif tag == 'delete':
-            # Content only in left (deleted)
             for i in range(i1, i2):
-                l_cell = f'<td style="{cell_style} background-color:#fee2e2; border-left:3px solid #ef4444;">{s_a[i]}</td>'
-                r_cell = f'<td style="{cell_style} background-color:#fafafa;"><span style="color:#94a3b8; font-style:italic;">（削除）</span></td>'
-                rows.append(f'<tr data-sync-id="diff-{row_id}">{l_cell}{r_cell}</tr>')
-                row_id += 1
-                
+                rows.append(_DIFF_ROW_TEMPLATES['delete'].format(l=html.escape(s_a[i])))
         elif tag == 'insert':
-            # Content only in right (inserted)
             for j in range(j1, j2):
-                l_cell = f'<td style="{cell_style} background-color:#fafafa;"><span style="color:#94a3b8; font-style:italic;">（追加）</span></td>'
-                r_cell = f'<td style="{cell_style} background-color:#dcfce7; border-left:3px solid #22c55e;">{s_b[j]}</td>'
-                rows.append(f'<tr data-sync-id="diff-{row_id}">{l_cell}{r_cell}</tr>')
-                row_id += 1
-                
+                rows.append(_DIFF_ROW_TEMPLATES['insert'].format(r=html.escape(s_b[j])))
         elif tag == 'replace':
-            # Content differs
-            max_len = max(i2 - i1, j2 - j1)
-            for idx in range(max_len):
-                if idx < (i2 - i1):
-                    l_content = s_a[i1 + idx]
-                    l_cell = f'<td style="{cell_style} background-color:#fef3c7; border-left:3px solid #f59e0b;">{l_content}</td>'
-                else:
-                    l_cell = f'<td style="{cell_style} background-color:#fafafa;"></td>'
-                
-                if idx < (j2 - j1):
-                    r_content = s_b[j1 + idx]
-                    r_cell = f'<td style="{cell_style} background-color:#fef3c7; border-left:3px solid #f59e0b;">{r_content}</td>'
+            for idx in range(max(i2 - i1, j2 - j1)):
+                has_l, has_r = idx < (i2 - i1), idx < (j2 - j1)
+                if has_l and has_r:
+                    # 左右が対になる行は、変わった文字だけを強調する
+                    l_content, r_content = _inline_diff_cells(s_a[i1 + idx], s_b[j1 + idx])
+                    rows.append(_DIFF_ROW_TEMPLATES['replace'].format(l=l_content, r=r_content))
+                elif has_l:
+                    rows.append(_DIFF_ROW_TEMPLATES['replace_left'].format(l=html.escape(s_a[i1 + idx])))
                 else:
-                    r_cell = f'<td style="{cell_style} background-color:#fafafa;"></td>'
-                
-                rows.append(f'<tr data-sync-id="diff-{row_id}">{l_cell}{r_cell}</tr>')
-                row_id += 1
-    
-    # Wrap in table
-    table_html = f'<table style="width:100%; border-collapse:collapse; table-layout:fixed;">{"".join(rows)}</table>'
-    
-    return table_html, ""  # Return table as left, empty string as right (not used)
+                    rows.append(_DIFF_ROW_TEMPLATES['replace_right'].format(r=html.escape(s_b[j1 + idx])))
+    return rows
+
+
+def _skip_row(count: int) -> str:
+    return f'<tr class="d-skip"><td colspan="2">⋯ 同一の {count} 文を省略 ⋯</td></tr>'
+
+
+@memoize_by_text_hash()
+def make_diff_html(a, b, context=DIFF_CONTEXT_LINES, page=0, hunks_per_page=DIFF_HUNKS_PER_PAGE):
+    """
+    Generate side-by-side diff HTML with guaranteed row alignment using table layout.
+    context: 変更箇所の前後に残す一致文の数（None の場合は一致部分も全文表示）
+    page / hunks_per_page: ハンクのページ分割（hunks_per_page が None の場合は全ハンク）
+    Returns: (table_html, ページ数)
+    """
+    # 文単位の差分は src/diff_engine.py（patience diff + Myers）で取る。同じ組の再計算はメモ化で省く
+    s_a, s_b, opcodes = diff_sentences(a, b)
 
+    if context is None:
+        rows = _diff_rows(s_a, s_b, opcodes)
+        page_count = 1
+    else:
+        hunks = grouped_opcodes(opcodes, context)
+        if not hunks:
+            rows = [f'<tr class="d-skip"><td colspan="2">差分はありません（{len(s_a)} 文すべて同一）</td></tr>']
+            return f'<table class="diff-table">{"".join(rows)}</table>', 1
+        page_count = 1 if not hunks_per_page else (len(hunks) + hunks_per_page - 1) // hunks_per_page
+        page = min(max(page or 0, 0), page_count - 1)
+        # 2ページ目以降は、前のページの最後のハンクの直後から数える
+        prev_end = hunks[page * hunks_per_page - 1][-1][2] if page > 0 else 0
+        if hunks_per_page:
+            hunks = hunks[page * hunks_per_page:(page + 1) * hunks_per_page]
 
-    return table_html, ""  # Return table as left, empty string as right (not used)
+        rows = []
+        for hunk in hunks:
+            # 前のハンク（またはページ・本文の先頭）との間の一致部分は1行にまとめる
+            skipped = hunk[0][1] - prev_end
+            if skipped > 0:
+                rows.append(_skip_row(skipped))
+            rows.extend(_diff_rows(s_a, s_b, hunk))
+            prev_end = hunk[-1][2]
+        if page == page_count - 1 and len(s_a) - prev_end > 0:
+            rows.append(_skip_row(len(s_a) - prev_end))
+
+    table_html = f'<table class="diff-table">{"".join(rows)}</table>'
+
+    return table_html, page_count
 
 # --- 言語検出ユーティリティ ---
 from langdetect import detect, detect_langs
@@ -175,3 +233,63 @@ def detect_language(text: str) -> str:
         return primary.lang
     except LangDetectException:
         return "unknown"
+
+def default_source_lang(text: str, url: str = "") -> str:
+    """
+    本文から、翻訳に指定する元記事の言語の既定値（"auto" / "zh-CN" / "zh-TW" / "en"）を決める。
+    画面の言語選択の初期値と、言語を指定せずに登録した一括処理の翻訳で同じ判定を使う
+    （保存する翻訳のキーに言語が含まれるため、判定が異なると画面から見つからない）。
+    """
+    detected_code = detect_language(text[:2000] if text else "").lower()
+    is_english = detected_code.startswith("en")
+    is_chinese = detected_code.startswith("zh") or detected_code == "mixed"  # mixedも中国語扱い
+    is_traditional = "tw" in detected_code or "hant" in detected_code
+
+    if is_english:
+        return "en"
+    if "weixin.qq.com" in (url or ""):
+        # WeChat: "ja"（漢字による誤判定）・"mixed"（英語のUI要素）・"unknown" は中国語 (簡体字) とみなす
+        if detected_code.startswith("ja") or detected_code in ("mixed", "unknown"):
+            return "zh-CN"
+    if is_chinese:
+        return "zh-TW" if is_traditional else "zh-CN"
+    return "auto"
+
+
+# --- トークン見積もりユーティリティ ---
+# CJK（漢字・かな・全角記号）はおおよそ1文字1トークン、それ以外は4文字1トークン程度
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """
+    テキストのトークン数を概算する（APIを呼ばずに分割計画を立てるため）。
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def plan_token_chunks(texts: List[str], max_tokens: int, per_item_overhead: int = 4) -> List[List[int]]:
+    """
+    段落の境界を保ったまま、各チャンクの推定トークン数がmax_tokens以下になるように分割する。
+    1段落で上限を超える場合はその段落だけで1チャンクとする。
+    Returns: 段落インデックスのリストのリスト
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text) + per_item_overhead
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+
+    if current:
+        chunks.append(current)
+
+    return chunks
@@ -0,0 +1,57 @@
+"""
+IncrementalArticleFormatter の出力が、全文を _format_article_html() に渡した結果と同一であることの確認
+"""
+import random
+
+import pytest
+
+from src.article_generator import IncrementalArticleFormatter, _format_article_html
+
+# Geminiの出力に現れる記法（見出し・箇条書き・太字・【…】のセクションヘッダー・空行など）を混ぜた断片
+_FRAGMENTS = [
+    "# ", "## ", "### ", "- ", "* ", "1. ", "**", "太字", "見出し", "本文の段落です。",
+    "中国メディアの報道によると", "、", "。", " ", "  ", "\n", "\n\n", "<", ">", "&", "`", "_",
+    "【", "】", "【タイトル】", "【リード文】\n", "【本文】", "【深センFan的視点】",
+]
+
+
+def _random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(0, 80)))
+
+
+def _random_chunks(rng: random.Random, text: str):
+    """
+    ストリーミングの受信単位を模して、テキストを任意の位置で分割する（空のチャンクも含む）
+    """
+    cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 12)))
+    bounds = [0] + cuts + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_incremental_formatter_matches_full_formatting(seed):
+    rng = random.Random(seed)
+    for _ in range(60):
+        text = _random_text(rng)
+        formatter = IncrementalArticleFormatter()
+        received = ""
+        for chunk in _random_chunks(rng, text):
+            formatter.feed(chunk)
+            received += chunk
+            # 途中経過も、それまでに受信した全文を整形した結果と一致する
+            assert formatter.html() == _format_article_html(received)
+        assert formatter.html() == _format_article_html(text)
+
+
+def test_incremental_formatter_section_header_split_across_chunks():
+    # 【…】の見出しと同じ行の本文が、複数のチャンクにまたがって届く場合
+    chunks = ["## 記事\n【タイ", "トル】深センの", "新しい地下鉄", "\n【リード文】", "\n本文です。\n【本", "文】"]
+    formatter = IncrementalArticleFormatter()
+    received = ""
+    for chunk in chunks:
+        formatter.feed(chunk)
+        received += chunk
+        assert formatter.html() == _format_article_html(received)
+    html = formatter.html()
+    assert "【タイトル】</div>\n<div>深センの新しい地下鉄</div>" in html
+    assert html == _format_article_html("".join(chunks))
@@ -0,0 +1,52 @@
+"""
+一括処理キューで保存した翻訳が、画面で記事を開いたときの検索キーで見つかることの確認
+"""
+import src.draft_store
+import src.scraper
+import src.translator
+from src.batch_queue import BatchQueue, KIND_TRANSLATION, process_job
+from src.draft_store import TranslationStore
+from src.result_cache import translation_cache_key
+from src.scraper import ArticleContent
+from src.utils import default_source_lang
+
+URL = "https://example.com/article"
+MODEL = "gemini-2.5-flash"
+PARAGRAPHS = [
+    {"tag": "p", "text": "中国国家统计局今天发布了最新的经济数据，显示制造业继续保持稳定增长。"},
+    {"tag": "p", "text": "专家表示，消费市场的恢复为全年经济目标的实现提供了有力支撑。"},
+]
+
+
+def test_batch_translation_is_found_by_ui_lookup(tmp_path, monkeypatch):
+    article = ArticleContent(
+        URL, "经济数据发布", "\n\n".join(p["text"] for p in PARAGRAPHS), [], "媒体", None, PARAGRAPHS
+    )
+    store = TranslationStore(str(tmp_path / "translations.sqlite3"))
+    monkeypatch.setattr(src.draft_store, "translation_store", store)
+    monkeypatch.setattr(src.scraper, "load_article_v9", lambda url: article)
+    monkeypatch.setattr(
+        src.translator,
+        "translate_paragraphs",
+        lambda paragraphs, **kwargs: (
+            [{"text": f"訳:{p['text']}", "engine": "Google", "tag": p["tag"]} for p in paragraphs],
+            "訳:経済データ",
+        ),
+    )
+
+    queue = BatchQueue(str(tmp_path / "queue.sqlite3"))
+    # 画面の「キューに追加」と同じく、言語を指定せずに登録する
+    job_id = queue.enqueue(KIND_TRANSLATION, URL, engine="Google", model=MODEL)
+    job = queue.claim()
+    assert job["id"] == job_id
+    process_job(queue, job, gemini_api_key="", deepl_api_key="")
+    assert queue.get(job_id)["status"] == "done"
+
+    # 画面は言語選択の初期値（本文から判定した言語）を含むキーで保存済みの翻訳を探す
+    ui_source_lang = default_source_lang(article.text, URL)
+    assert ui_source_lang == "zh-CN"
+    stored = store.get(translation_cache_key(URL, "Google", MODEL, ui_source_lang))
+    assert stored is not None
+    results, translated_title = stored
+    assert [item["text"] for item in results] == [f"訳:{p['text']}" for p in PARAGRAPHS]
+    assert translated_title == "訳:経済データ"